@@ -0,0 +1,102 @@
+import asyncio
+import contextvars
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Any
+
+import numpy as np
+
+from telemetry import QUEUE_WAIT_SECONDS, REJECTED
+
+
+class QueueFullError(Exception):
+    """Raised when the admission queue is full; carries a Retry-After hint in seconds"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Analysis queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AnalysisExecutor:
+    """
+    Runs blocking analysis work off the event loop.
+    At most `max_concurrent` analyses run at once; up to `max_queue` more wait
+    for a slot, and anything beyond that is rejected with QueueFullError.
+    """
+
+    def __init__(self, max_concurrent: int = 2, max_queue: int = 16, name: str = "analysis"):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_queue = max(0, int(max_queue))
+        self.name = name
+        self._pool = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix=name)
+
+        self._lock = threading.Lock()
+        self._pending = 0  # Running + waiting
+        self._active = 0
+        self._completed = 0
+        self._rejected = 0
+        self._waits = deque(maxlen=1000)
+        self._service_times = deque(maxlen=1000)
+
+    def _retry_after(self) -> int:
+        """Rough seconds until a slot frees up, from recent service times"""
+        if not self._service_times:
+            return 1
+        mean_service = sum(self._service_times) / len(self._service_times)
+        backlog = self._pending - self._active + 1
+        return max(1, math.ceil(mean_service * backlog / self.max_concurrent))
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) in the worker pool and await its result"""
+        with self._lock:
+            if self._pending >= self.max_concurrent + self.max_queue:
+                self._rejected += 1
+                REJECTED.inc(executor=self.name)
+                raise QueueFullError(self._retry_after())
+            self._pending += 1
+
+        submitted = time.perf_counter()
+
+        def task():
+            started = time.perf_counter()
+            with self._lock:
+                self._active += 1
+                self._waits.append(started - submitted)
+            QUEUE_WAIT_SECONDS.observe(started - submitted, executor=self.name)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._completed += 1
+                    self._service_times.append(time.perf_counter() - started)
+
+        # The request id and span collection follow the work into the pool thread
+        future = self._pool.submit(contextvars.copy_context().run, task)
+        # Release the slot when the work finishes, even if the caller went away
+        future.add_done_callback(lambda _: self._release())
+        return await asyncio.wrap_future(future)
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = np.asarray(self._waits, dtype=np.float64) * 1000.0
+            return {
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "active": self._active,
+                "queue_depth": self._pending - self._active,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "wait_ms_mean": float(waits.mean()) if waits.size else 0.0,
+                "wait_ms_p99": float(np.percentile(waits, 99)) if waits.size else 0.0,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
@@ -0,0 +1,91 @@
+import base64
+import hashlib
+import cv2
+import numpy as np
+from typing import Tuple
+
+
+# format -> (file extension, content type)
+ARTIFACT_FORMATS = {
+    "png": (".png", "image/png"),
+    "webp": (".webp", "image/webp"),
+    "jpeg": (".jpg", "image/jpeg"),
+}
+
+# Image artifacts produced by an analysis and where they appear in the response
+ARTIFACT_FIELDS = {
+    "heatmap": ("heatmap", "heatmap"),
+    "overlay": ("heatmap", "overlay"),
+    "mask": ("segmentation", "mask"),
+}
+
+
+class ArtifactEncoder:
+    """Encodes heatmap / overlay / mask images for storage and download"""
+
+    def __init__(self, fmt: str = "png", png_compression: int = 3, quality: int = 80):
+        """
+        fmt: png (lossless), webp or jpeg (lossy previews)
+        png_compression: zlib level 0-9, lower is faster and larger
+        quality: 0-100 for webp / jpeg
+        """
+        if fmt not in ARTIFACT_FORMATS:
+            raise ValueError(f"Unknown artifact format: {fmt}. Choose from: {', '.join(ARTIFACT_FORMATS)}")
+        self.fmt = fmt
+        self.png_compression = int(png_compression)
+        self.quality = int(quality)
+        self.extension, self.content_type = ARTIFACT_FORMATS[fmt]
+
+        if fmt == "png":
+            self._params = [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression]
+        elif fmt == "webp":
+            self._params = [cv2.IMWRITE_WEBP_QUALITY, self.quality]
+        else:
+            self._params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+
+    @property
+    def cache_token(self) -> str:
+        """Identifies the encoding settings; part of result cache keys"""
+        return f"{self.fmt}:{self.png_compression}:{self.quality}"
+
+    def encode(self, image: np.ndarray) -> dict:
+        """Encode an image -> {"data", "content_type", "etag"}"""
+        ok, buffer = cv2.imencode(self.extension, image, self._params)
+        if not ok:
+            raise ValueError(f"Could not encode artifact as {self.fmt}")
+        data = buffer.tobytes()
+        return {
+            "data": data,
+            "content_type": self.content_type,
+            "etag": hashlib.sha256(data).hexdigest()[:32],
+        }
+
+
+def to_data_url(artifact: dict) -> str:
+    """Inline form of an artifact, for clients that want base64 in the JSON"""
+    encoded = base64.b64encode(artifact["data"]).decode("utf-8")
+    return f"data:{artifact['content_type']};base64,{encoded}"
+
+
+def artifact_extension(content_type: str) -> str:
+    for extension, known_type in ARTIFACT_FORMATS.values():
+        if known_type == content_type:
+            return extension
+    return ".bin"
+
+
+def render_artifacts(record: dict, artifacts: dict, url_for=None) -> dict:
+    """
+    Fill the heatmap / overlay / mask fields of a response.
+    With url_for(name) the fields become URLs; otherwise data URLs built from
+    artifacts (name -> {"data", "content_type"}).
+    """
+    for name, (section, field) in ARTIFACT_FIELDS.items():
+        if name not in artifacts or section not in record:
+            continue
+        if url_for is not None:
+            value = url_for(name)
+        else:
+            value = to_data_url(artifacts[name])
+        record[section] = {**record[section], field: value}
+    return record
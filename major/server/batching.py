@@ -0,0 +1,130 @@
+import threading
+import queue
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Tuple, Any
+
+import numpy as np
+
+from telemetry import BATCH_SIZE, log
+
+
+class MicroBatcher:
+    """Collects concurrent single-image requests into one batched forward pass"""
+
+    def __init__(self, batch_fn: Callable[[np.ndarray], np.ndarray],
+                 max_batch_size: int = 8, max_wait_ms: float = 5.0,
+                 name: str = "inference"):
+        """
+        batch_fn: takes an (N, ...) array and returns N results (one per row)
+        max_batch_size: largest batch sent to batch_fn
+        max_wait_ms: how long the first request in a batch waits for company
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+
+        self._thread = threading.Thread(target=self._run, name=f"{name}-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, item: np.ndarray) -> Future:
+        """Queue one input and return a Future for its result"""
+        if self._stopped.is_set():
+            raise RuntimeError(f"{self.name} batcher is closed")
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item: np.ndarray) -> Any:
+        """Blocking helper: submit and wait for the result"""
+        return self.submit(item).result()
+
+    def _collect(self) -> Tuple[List[tuple], bool]:
+        """Block for the first request, then gather more until full or timed out"""
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        pending = [first]
+        deadline = time.perf_counter() + self.max_wait
+
+        while len(pending) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    entry = self._queue.get_nowait()
+                else:
+                    entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is None:
+                return pending, True
+            pending.append(entry)
+
+        return pending, False
+
+    def _run(self):
+        while True:
+            pending, stop = self._collect()
+            if pending:
+                try:
+                    self._process(pending)
+                except Exception as e:
+                    # One bad batch must not take the batcher down with it
+                    log.exception("❌ %s batcher error: %s", self.name, e)
+                    self._fail(pending, e)
+            if stop:
+                return
+
+    def _process(self, pending: List[tuple]):
+        # Drop requests whose callers already gave up
+        pending = [(item, fut) for item, fut in pending if fut.set_running_or_notify_cancel()]
+        if not pending:
+            return
+
+        try:
+            batch = np.stack([item for item, _ in pending])
+            results = self.batch_fn(batch)
+            for (_, fut), result in zip(pending, results):
+                fut.set_result(result)
+        except Exception as e:
+            self._fail(pending, e)
+        # batch_fn returned fewer results than inputs
+        self._fail(pending, RuntimeError(f"{self.name} batch returned no result for this input"))
+
+        BATCH_SIZE.observe(len(pending))
+        with self._lock:
+            self._batches += 1
+            self._items += len(pending)
+
+    @staticmethod
+    def _fail(pending: List[tuple], error: Exception):
+        """Fail every future that has no result yet (some may already be resolved)"""
+        for _, fut in pending:
+            if not fut.done():
+                fut.set_exception(error)
+
+    def stats(self) -> dict:
+        with self._lock:
+            batches, items = self._batches, self._items
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": batches,
+            "items": items,
+            "mean_batch_size": (items / batches) if batches else 0.0,
+            "queued": self._queue.qsize(),
+        }
+
+    def close(self):
+        """Stop the worker thread; queued requests still get served first"""
+        if not self._stopped.is_set():
+            self._stopped.set()
+            self._queue.put(None)
+            self._thread.join(timeout=5)
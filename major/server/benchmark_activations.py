@@ -0,0 +1,84 @@
+"""
+Multi-layer activations: one model + predict per layer (the previous
+MultiLayerActivationVisualizer) against the single multi-output pass.
+
+    python benchmark_activations.py --batch-sizes 1,8
+    python benchmark_activations.py --standin   # small stand-in model instead of ResNet50
+"""
+import argparse
+import time
+import numpy as np
+import tensorflow as tf
+
+from gradcam import MultiLayerActivationVisualizer
+from benchmark_utils import build_standin_model, write_results
+
+
+def legacy_visualize(models, images):
+    """The previous visualize: predict per layer model, channel mean and normalization in numpy"""
+    results = [{} for _ in range(len(images))]
+    for layer_name, model in models.items():
+        activation = model.predict(images, verbose=0)
+        for i in range(len(images)):
+            mean_activation = np.mean(activation[i], axis=-1)
+            min_val, max_val = mean_activation.min(), mean_activation.max()
+            if max_val - min_val > 0:
+                mean_activation = (mean_activation - min_val) / (max_val - min_val)
+            results[i][layer_name] = mean_activation
+    return results
+
+
+def ms_per_call(fn, iterations):
+    fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) * 1000.0 / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-layer activation benchmark")
+    parser.add_argument("--batch-sizes", default="1,8")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--standin", action="store_true", help="Use the small stand-in model")
+    parser.add_argument("--output", default=None, help="Optional JSON results file")
+    args = parser.parse_args()
+
+    if args.standin:
+        model, layer_names = build_standin_model(), ["conv1", "conv2", "conv3"]
+    else:
+        model, layer_names = tf.keras.applications.ResNet50(weights=None), None
+
+    visualizer = MultiLayerActivationVisualizer(model, layer_names)
+    legacy_models = {
+        name: tf.keras.models.Model(inputs=model.inputs, outputs=model.get_layer(name).output)
+        for name in visualizer.layer_shapes
+    }
+    print(f"Layers: {', '.join(visualizer.layer_shapes)}")
+
+    rng = np.random.default_rng(0)
+    results = []
+    print(f"{'batch':>5} {'per_layer_ms':>12} {'single_pass_ms':>14} {'speedup':>7}")
+    for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+        images = rng.random((batch_size,) + tuple(model.input_shape[1:]), dtype=np.float32)
+
+        # Same maps as before
+        for old, new in zip(legacy_visualize(legacy_models, images), visualizer.visualize_batch(images)):
+            for name in old:
+                np.testing.assert_allclose(new[name]["mean_activation"], old[name], atol=1e-4)
+
+        r = {
+            "batch_size": batch_size,
+            "per_layer_ms": ms_per_call(lambda: legacy_visualize(legacy_models, images), args.iterations),
+            "single_pass_ms": ms_per_call(lambda: visualizer.visualize_batch(images), args.iterations),
+        }
+        r["speedup"] = r["per_layer_ms"] / r["single_pass_ms"]
+        results.append(r)
+        print(f"{batch_size:>5} {r['per_layer_ms']:>12.1f} {r['single_pass_ms']:>14.1f} {r['speedup']:>6.2f}x")
+
+    if args.output:
+        write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Response size and serialization time: base64 artifacts inlined in the JSON
+versus URL references, for each artifact encoding.
+
+    python benchmark_artifacts.py --iterations 50
+"""
+import argparse
+import json
+import time
+import numpy as np
+import cv2
+
+from artifacts import ArtifactEncoder, render_artifacts
+from gradcam import GradCAM
+from lung_segmentation import LungSegmentation
+from benchmark_utils import synthetic_xray, write_results
+
+
+ENCODINGS = [
+    ("png", 1, 80),
+    ("png", 3, 80),
+    ("png", 6, 80),
+    ("webp", 3, 80),
+    ("jpeg", 3, 80),
+]
+
+
+def sample_images(size):
+    """Heatmap, overlay and mask like the ones an analysis produces"""
+    img = synthetic_xray(size, size)
+    normalized = cv2.resize(img, (224, 224))[..., ::-1].astype(np.float32) / 255.0
+    gradcam = GradCAM.__new__(GradCAM)  # Fallback heatmap needs no model
+    _, heatmap_colored = gradcam._create_simulated_heatmap((224, 224))
+    overlay = gradcam.create_overlay(normalized, heatmap_colored)
+    mask, _, _ = LungSegmentation.segment_lungs(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+    return {
+        "heatmap": heatmap_colored,
+        "overlay": overlay,
+        "mask": (mask * 255).astype(np.uint8),
+    }
+
+
+def base_record():
+    return {
+        "id": "res_benchmark",
+        "status": "success",
+        "analysis": {"diagnosis": "NORMAL", "confidence": 0.97},
+        "heatmap": {"heatmap": "", "overlay": "", "intensity": 0.1},
+        "segmentation": {"mask": "", "metrics": {"coverage_percentage": 40.0}},
+    }
+
+
+def mean_ms(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) * 1000.0 / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Artifact delivery benchmark")
+    parser.add_argument("--size", type=int, default=1024, help="Source X-ray size (mask resolution)")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--output", default=None, help="Optional JSON results file")
+    args = parser.parse_args()
+
+    images = sample_images(args.size)
+    results = []
+
+    print(f"{'encoding':>10} {'encode_ms':>9} {'artifact_kb':>11} {'inline_kb':>9} "
+          f"{'inline_ms':>9} {'url_kb':>7} {'url_ms':>7}")
+    for fmt, level, quality in ENCODINGS:
+        encoder = ArtifactEncoder(fmt, level, quality)
+        encode_ms = mean_ms(lambda: {n: encoder.encode(i) for n, i in images.items()}, args.iterations)
+        artifacts = {n: encoder.encode(i) for n, i in images.items()}
+
+        inline = lambda: json.dumps(render_artifacts(base_record(), artifacts))
+        by_url = lambda: json.dumps(render_artifacts(
+            base_record(), artifacts, url_for=lambda name: f"http://localhost:8000/api/history/res_benchmark/artifacts/{name}"))
+
+        r = {
+            "encoding": f"{fmt}-{level}" if fmt == "png" else f"{fmt}-q{quality}",
+            "encode_ms": encode_ms,
+            "artifact_bytes": sum(len(a["data"]) for a in artifacts.values()),
+            "inline_response_bytes": len(inline()),
+            "inline_serialize_ms": mean_ms(inline, args.iterations),
+            "url_response_bytes": len(by_url()),
+            "url_serialize_ms": mean_ms(by_url, args.iterations),
+        }
+        results.append(r)
+        print(f"{r['encoding']:>10} {r['encode_ms']:>9.2f} {r['artifact_bytes']/1024:>11.1f} "
+              f"{r['inline_response_bytes']/1024:>9.1f} {r['inline_serialize_ms']:>9.3f} "
+              f"{r['url_response_bytes']/1024:>7.2f} {r['url_serialize_ms']:>7.3f}")
+
+    if args.output:
+        write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Throughput vs tail latency of the micro-batching scheduler.
+
+Runs concurrent single-image clients against a stand-in model for each
+(max_batch_size, max_wait_ms) setting and prints images/sec and p99.
+
+    python benchmark_batching.py --clients 16 --requests 20
+"""
+import argparse
+import threading
+import time
+import numpy as np
+
+from batching import MicroBatcher
+from benchmark_utils import build_standin_model, latency_summary, write_results
+
+
+def run_setting(model, batch_size, wait_ms, clients, requests_per_client):
+    """One sweep point: returns throughput and latency percentiles"""
+    predict = lambda batch: np.asarray(model.predict_on_batch(batch))[:, 0]
+
+    if batch_size > 1:
+        batcher = MicroBatcher(predict, batch_size, wait_ms)
+        score = batcher
+    else:
+        batcher = None
+        score = lambda x: predict(np.expand_dims(x, axis=0))[0]
+
+    image = np.random.default_rng(0).random((224, 224, 3), dtype=np.float32)
+    # Untimed calls at every size the batcher can form, so no client pays for the
+    # first trace / allocation of a batch shape
+    for n in range(1, batch_size + 1):
+        for _ in range(2):
+            predict(np.repeat(image[None], n, axis=0))
+
+    latencies = []
+    lock = threading.Lock()
+
+    def client():
+        local = []
+        for _ in range(requests_per_client):
+            start = time.perf_counter()
+            score(image)
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "max_batch_size": batch_size,
+        "max_wait_ms": wait_ms,
+        "throughput_ips": len(latencies) / elapsed,
+        **latency_summary(latencies),
+    }
+    if batcher is not None:
+        result["mean_batch_size"] = batcher.stats()["mean_batch_size"]
+        batcher.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-batching benchmark")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=20, help="Requests per client")
+    parser.add_argument("--batch-sizes", default="1,4,8,16")
+    parser.add_argument("--wait-ms", default="1,5,10")
+    parser.add_argument("--output", default=None, help="Optional JSON results file")
+    args = parser.parse_args()
+
+    model = build_standin_model()
+    model.predict_on_batch(np.zeros((1, 224, 224, 3), np.float32))  # Warmup
+
+    results = []
+    print(f"{'batch':>6} {'wait_ms':>8} {'img/s':>8} {'p50_ms':>8} {'p99_ms':>8} {'avg_batch':>9}")
+    for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+        waits = [float(w) for w in args.wait_ms.split(",")] if batch_size > 1 else [0.0]
+        for wait_ms in waits:
+            r = run_setting(model, batch_size, wait_ms, args.clients, args.requests)
+            results.append(r)
+            print(f"{batch_size:>6} {wait_ms:>8.1f} {r['throughput_ips']:>8.1f} "
+                  f"{r['p50_ms']:>8.1f} {r['p99_ms']:>8.1f} {r.get('mean_batch_size', 1.0):>9.2f}")
+
+    if args.output:
+        write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Decode memory and time for very large radiographs: full-size decode (what
+analyze_image used to hold: BGR image + grayscale copy) against
+BoundedDecoder's reduced decode. Each run happens in a fresh process whose
+RSS high-water mark (VmHWM, reset before decoding) belongs to that decode alone.
+Linux only.
+
+    python benchmark_decode.py --width 4000 --height 5000 --max-side 2048
+"""
+import argparse
+import multiprocessing
+import time
+import numpy as np
+import cv2
+
+from image_decode import BoundedDecoder
+
+
+def make_sources(width, height):
+    """16-bit PNG and TIFF, 8-bit JPEG and 8-bit colour PNG versions of one synthetic X-ray"""
+    from benchmark_utils import synthetic_xray
+    gray = cv2.cvtColor(synthetic_xray(height, width), cv2.COLOR_BGR2GRAY)
+    gray16 = gray.astype(np.uint16) * 257
+    return {
+        "png16": cv2.imencode(".png", gray16)[1].tobytes(),
+        "tiff16": cv2.imencode(".tiff", gray16)[1].tobytes(),
+        "jpeg": cv2.imencode(".jpg", gray, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes(),
+        "png_rgb": cv2.imencode(".png", cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR))[1].tobytes(),
+    }
+
+
+def _status_kb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def measure(args):
+    """Child process: decode once, report peak RSS growth (MB), time and output shape"""
+    mode, data, max_side = args
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")  # Reset the high-water mark to the current RSS
+    baseline = _status_kb("VmRSS")
+    start = time.perf_counter()
+    if mode == "full":
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    else:
+        img, _ = BoundedDecoder(max_side, max_pixels=10**9, max_decode_mb=0).decode(data)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    elapsed = time.perf_counter() - start
+    peak = _status_kb("VmHWM")
+    return (peak - baseline) / 1024.0, elapsed * 1000.0, list(gray.shape)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bounded decode benchmark")
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=5000)
+    parser.add_argument("--max-side", type=int, default=2048)
+    parser.add_argument("--output", default=None, help="Optional JSON results file")
+    args = parser.parse_args()
+
+    sources = make_sources(args.width, args.height)
+    context = multiprocessing.get_context("spawn")
+    decoder = BoundedDecoder(args.max_side)
+    results = []
+    print(f"{'source':>8} {'mode':>8} {'peak_mb':>8} {'est_mb':>7} {'ms':>7} {'decoded':>11}")
+    for name, data in sources.items():
+        info = decoder.probe(data)
+        estimate = decoder.estimate_bytes(info, decoder.reduction_for(info["width"], info["height"])) / 2**20
+        for mode in ("full", "bounded"):
+            with context.Pool(1) as pool:
+                peak_mb, ms, shape = pool.apply(measure, ((mode, data, args.max_side),))
+            r = {"source": name, "mode": mode, "peak_rss_mb": peak_mb, "ms": ms, "decoded": shape,
+                 "estimated_mb": estimate if mode == "bounded" else None}
+            results.append(r)
+            est = f"{estimate:.0f}" if mode == "bounded" else "-"
+            print(f"{name:>8} {mode:>8} {peak_mb:>8.1f} {est:>7} {ms:>7.1f} {shape[1]:>5}x{shape[0]:<5}")
+
+    if args.output:
+        from benchmark_utils import write_results
+        write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
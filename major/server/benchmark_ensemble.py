@@ -0,0 +1,108 @@
+"""
+Latency of the ML ensemble stage: one shared DenseNet feature pass scored by
+all three models, versus a feature pass per model.
+
+    python benchmark_ensemble.py --batch-sizes 1,8,32
+    python benchmark_ensemble.py --model-dir models   # trained .pkl files + ImageNet DenseNet
+"""
+import argparse
+import os
+import tempfile
+import time
+import joblib
+import numpy as np
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import SVC
+
+from ml_ensemble import MLEnsemble
+from benchmark_utils import synthetic_xray, latency_summary, write_results
+
+
+def train_standin_models(model_dir, num_features, seed=0):
+    """Small calibrated models with the same file names and types as train_ml_models.py"""
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(300, num_features)).astype(np.float32)
+    y = (X[:, :10].sum(axis=1) > 0).astype(int)
+    models = {
+        "svm.pkl": Pipeline([("scaler", StandardScaler()), ("svm", SVC(probability=True, random_state=42))]),
+        "random_forest.pkl": RandomForestClassifier(n_estimators=200, random_state=42),
+        "logistic_regression.pkl": Pipeline([("scaler", StandardScaler()),
+                                             ("lr", LogisticRegression(max_iter=2000, random_state=42))]),
+    }
+    for filename, model in models.items():
+        joblib.dump(CalibratedClassifierCV(model, method="sigmoid", cv=3).fit(X, y),
+                    os.path.join(model_dir, filename))
+
+
+def time_shared(ensemble, images, iterations):
+    """One feature pass, three models"""
+    features_ms, models_ms, totals = [], [], []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        _, timings = ensemble.predict(images)
+        totals.append(time.perf_counter() - start)
+        features_ms.append(timings["features_ms"])
+        models_ms.append(timings["models_ms"])
+    return totals, float(np.mean(features_ms)), float(np.mean(models_ms))
+
+
+def time_per_model(ensemble, images, iterations):
+    """Feature pass repeated for each model"""
+    totals = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        for model in ensemble.models.values():
+            model.predict_proba(ensemble.extract_features(images))[:, 1]
+        totals.append(time.perf_counter() - start)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ML ensemble stage benchmark")
+    parser.add_argument("--batch-sizes", default="1,8,32")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--model-dir", default=None,
+                        help="Directory with trained svm/random_forest/logistic_regression .pkl "
+                             "(default: stand-in models and a randomly initialized DenseNet121)")
+    parser.add_argument("--output", default=None, help="Optional JSON results file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.model_dir:
+            ensemble = MLEnsemble(args.model_dir)
+        else:
+            from tensorflow.keras.applications import DenseNet121
+            extractor = DenseNet121(weights=None, include_top=False, input_shape=(224, 224, 3), pooling="avg")
+            train_standin_models(tmp, extractor.output_shape[-1])
+            ensemble = MLEnsemble(tmp, feature_extractor=extractor)
+
+        print(f"{'batch':>5} {'features_ms':>11} {'models_ms':>9} {'shared_p50':>10} "
+              f"{'per_model_p50':>13} {'speedup':>7}")
+        results = []
+        for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+            images = [synthetic_xray(512, 512, seed=i) for i in range(batch_size)]
+            ensemble.predict(images)  # Trace this batch shape once
+            shared, features_ms, models_ms = time_shared(ensemble, images, args.iterations)
+            per_model = time_per_model(ensemble, images, args.iterations)
+            r = {
+                "batch_size": batch_size,
+                "features_ms": features_ms,
+                "models_ms": models_ms,
+                "shared": latency_summary(shared),
+                "per_model": latency_summary(per_model),
+            }
+            r["speedup"] = r["per_model"]["p50_ms"] / r["shared"]["p50_ms"]
+            results.append(r)
+            print(f"{batch_size:>5} {features_ms:>11.1f} {models_ms:>9.1f} {r['shared']['p50_ms']:>10.1f} "
+                  f"{r['per_model']['p50_ms']:>13.1f} {r['speedup']:>6.2f}x")
+
+    if args.output:
+        write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
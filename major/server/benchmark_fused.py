@@ -0,0 +1,57 @@
+"""
+Per-image latency of prediction + Grad-CAM: the old two-pass path
+(predict() then GradCAM.generate) against the fused single taped pass.
+
+    python benchmark_fused.py --iterations 30
+"""
+import argparse
+import time
+import numpy as np
+
+from gradcam import GradCAM
+from benchmark_utils import build_standin_model, synthetic_xray, latency_summary, write_results
+
+
+def time_it(fn, iterations):
+    fn()  # Warmup
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return latency_summary(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fused prediction + Grad-CAM benchmark")
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--output", default=None, help="Optional JSON results file")
+    args = parser.parse_args()
+
+    model = build_standin_model()
+    gradcam = GradCAM(model)
+    image = synthetic_xray(224, 224)[..., ::-1].astype(np.float32) / 255.0
+
+    def two_pass():
+        model.predict_on_batch(np.expand_dims(image, axis=0))
+        gradcam.generate(image)
+
+    def fused():
+        gradcam.generate_with_score(image)
+
+    results = {
+        "two_pass": time_it(two_pass, args.iterations),
+        "fused": time_it(fused, args.iterations),
+    }
+
+    for name, r in results.items():
+        print(f"{name:>10}: mean={r['mean_ms']:.1f}ms p50={r['p50_ms']:.1f}ms p99={r['p99_ms']:.1f}ms")
+    speedup = results["two_pass"]["mean_ms"] / results["fused"]["mean_ms"]
+    print(f"Speedup: {speedup:.2f}x")
+
+    if args.output:
+        write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Grad-CAM for many images: one taped pass, resize and overlay per image
+(generate_with_score + create_overlay in a loop) against generate_batch +
+create_overlays, which tape, resize, colormap and blend the whole batch at once.
+
+    python benchmark_gradcam_batch.py --batch-sizes 1,8,32
+    python benchmark_gradcam_batch.py --resnet   # ResNet50 (random weights) instead of the stand-in
+"""
+import argparse
+import time
+import numpy as np
+import tensorflow as tf
+
+from gradcam import GradCAM
+from benchmark_utils import build_standin_model, write_results
+
+
+def per_image(gradcam, images, rng=None):
+    results = []
+    for image in images:
+        score, heatmap, heatmap_colored = gradcam.generate_with_score(image, rng)
+        results.append((score, heatmap, gradcam.create_overlay(image, heatmap_colored)))
+    return results
+
+
+def batched(gradcam, images, rng=None):
+    scores, heatmaps, heatmaps_colored = gradcam.generate_batch(images, rng)
+    return scores, heatmaps, gradcam.create_overlays(images, heatmaps_colored)
+
+
+def ms_per_call(fn, iterations):
+    fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) * 1000.0 / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched Grad-CAM benchmark")
+    parser.add_argument("--batch-sizes", default="1,8,32")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--resnet", action="store_true", help="Use ResNet50 with random weights")
+    parser.add_argument("--output", default=None, help="Optional JSON results file")
+    args = parser.parse_args()
+
+    model = tf.keras.applications.ResNet50(weights=None, classes=1, classifier_activation="sigmoid") \
+        if args.resnet else build_standin_model()
+    gradcam = GradCAM(model)
+    print(f"Target layer: {gradcam.target_layer_name}")
+
+    rng = np.random.default_rng(0)
+    results = []
+    print(f"{'batch':>5} {'per_image_ms':>12} {'batched_ms':>10} {'speedup':>7}")
+    for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+        images = rng.random((batch_size,) + tuple(model.input_shape[1:]), dtype=np.float32)
+
+        # Same scores, heatmaps and overlays (weak maps get random blobs, so both runs draw from
+        # equally seeded generators; batched convolutions can round differently, which may move
+        # a pixel to the next colormap bin)
+        old = per_image(gradcam, images, np.random.default_rng(0))
+        scores, heatmaps, overlays = batched(gradcam, images, np.random.default_rng(0))
+        for i, (score, heatmap, overlay) in enumerate(old):
+            np.testing.assert_allclose(scores[i], score, atol=1e-5)
+            np.testing.assert_allclose(heatmaps[i], heatmap, atol=1e-4)
+            assert np.mean(np.any(overlays[i] != overlay, axis=-1)) < 0.001
+
+        r = {
+            "batch_size": batch_size,
+            "per_image_ms": ms_per_call(lambda: per_image(gradcam, images), args.iterations),
+            "batched_ms": ms_per_call(lambda: batched(gradcam, images), args.iterations),
+        }
+        r["speedup"] = r["per_image_ms"] / r["batched_ms"]
+        results.append(r)
+        print(f"{batch_size:>5} {r['per_image_ms']:>12.1f} {r['batched_ms']:>10.1f} {r['speedup']:>6.2f}x")
+
+    if args.output:
+        write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
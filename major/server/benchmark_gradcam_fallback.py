@@ -0,0 +1,117 @@
+"""
+Micro-benchmark for the Grad-CAM fallback heatmap generators.
+
+Checks the vectorized generators against the original per-pixel loops,
+times both, and exits non-zero if the fallback path goes over budget,
+so it can guard against regressions in CI.
+
+    python benchmark_gradcam_fallback.py --max-ms 5
+"""
+import argparse
+import sys
+import time
+import numpy as np
+import cv2
+
+from gradcam import GradCAM, _simulated_heatmap_template
+
+
+def legacy_simulated_heatmap(shape):
+    """The original pure-Python double loop, kept as the reference"""
+    h, w = shape
+    heatmap = np.zeros((h, w), dtype=np.float32)
+    center_y, center_x = h // 2, w // 2
+    radius_y, radius_x = h // 3, w // 4
+
+    for y in range(h):
+        for x in range(w):
+            if abs(x - center_x + w//6) < radius_x and abs(y - center_y) < radius_y:
+                dist = np.sqrt(((x - (center_x - w//6)) / radius_x)**2 +
+                               ((y - center_y) / radius_y)**2)
+                if dist < 1:
+                    heatmap[y, x] = 0.5 + 0.5 * (1 - dist)
+            if abs(x - center_x - w//6) < radius_x and abs(y - center_y) < radius_y:
+                dist = np.sqrt(((x - (center_x + w//6)) / radius_x)**2 +
+                               ((y - center_y) / radius_y)**2)
+                if dist < 1:
+                    heatmap[y, x] = 0.5 + 0.5 * (1 - dist)
+
+    heatmap = cv2.GaussianBlur(heatmap, (31, 31), 0)
+    if heatmap.max() > 0:
+        heatmap = heatmap / heatmap.max()
+    return heatmap
+
+
+def legacy_enhance_heatmap(heatmap, rng):
+    """The original meshgrid-per-blob version, kept as the reference (same draws from rng)"""
+    h, w = heatmap.shape
+    for i in range(5):
+        x = rng.integers(w//4, 3*w//4)
+        y = rng.integers(h//4, 3*h//4)
+        size = rng.integers(10, 30)
+        xx, yy = np.meshgrid(np.arange(w), np.arange(h))
+        dist = np.sqrt((xx - x)**2 + (yy - y)**2)
+        heatmap += 0.3 * np.exp(-dist**2 / (2 * (size/2)**2))
+    heatmap = np.clip(heatmap, 0, 1)
+    if heatmap.max() > 0:
+        heatmap = heatmap / heatmap.max()
+    return heatmap
+
+
+def best_of(fn, repeats):
+    """Best wall time in milliseconds over several runs"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grad-CAM fallback micro-benchmark")
+    parser.add_argument("--size", type=int, default=224)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--max-ms", type=float, default=5.0,
+                        help="Budget for one fallback heatmap + enhancement")
+    parser.add_argument("--skip-legacy", action="store_true", help="Do not time the slow reference loops")
+    args = parser.parse_args()
+
+    shape = (args.size, args.size)
+    gradcam = GradCAM.__new__(GradCAM)  # Fallback paths need no model
+    weak = np.full(shape, 0.01, dtype=np.float32)
+
+    # Correctness against the reference implementations
+    np.testing.assert_allclose(gradcam._create_simulated_heatmap(shape)[0],
+                               legacy_simulated_heatmap(shape), atol=1e-6)
+    expected = legacy_enhance_heatmap(weak.copy(), np.random.default_rng(0))
+    np.testing.assert_allclose(gradcam._enhance_heatmap(weak.copy(), np.random.default_rng(0)), expected, atol=1e-5)
+    print("✅ Vectorized generators match the reference loops")
+
+    _simulated_heatmap_template.cache_clear()
+    cold_ms = best_of(lambda: (_simulated_heatmap_template.cache_clear(),
+                               gradcam._create_simulated_heatmap(shape)), 3)
+    simulated_ms = best_of(lambda: gradcam._create_simulated_heatmap(shape), args.repeats)
+    enhance_ms = best_of(lambda: gradcam._enhance_heatmap(weak.copy()), args.repeats)
+    colormap_ms = best_of(lambda: cv2.applyColorMap(np.uint8(255 * weak), cv2.COLORMAP_JET), args.repeats)
+
+    print(f"Simulated heatmap (first call): {cold_ms:.2f}ms")
+    print(f"Simulated heatmap (cached):     {simulated_ms:.3f}ms")
+    print(f"Enhance heatmap:                {enhance_ms:.2f}ms")
+    print(f"Colormap lookup (reference):    {colormap_ms:.3f}ms")
+
+    if not args.skip_legacy:
+        legacy_ms = best_of(lambda: legacy_simulated_heatmap(shape), 1)
+        legacy_enhance_ms = best_of(lambda: legacy_enhance_heatmap(weak.copy(), np.random.default_rng(0)), 3)
+        print(f"Legacy simulated heatmap:       {legacy_ms:.1f}ms")
+        print(f"Legacy enhance heatmap:         {legacy_enhance_ms:.2f}ms")
+
+    total_ms = simulated_ms + enhance_ms
+    if total_ms > args.max_ms:
+        print(f"❌ Fallback path took {total_ms:.2f}ms, budget is {args.max_ms:.2f}ms")
+        sys.exit(1)
+    print(f"✅ Fallback path within budget ({total_ms:.2f}ms <= {args.max_ms:.2f}ms)")
+
+
+if __name__ == "__main__":
+    main()
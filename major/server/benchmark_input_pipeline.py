@@ -0,0 +1,108 @@
+"""
+Training input throughput: the old ImageDataGenerator + CLAHE lambda against
+the tf.data pipeline (uncached, cached, augmented).
+
+    python benchmark_input_pipeline.py --images 256
+    python benchmark_input_pipeline.py --data-dir dataset/test
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import cv2
+from tensorflow.keras.applications.densenet import preprocess_input
+from tensorflow.keras.preprocessing.image import ImageDataGenerator
+
+from data_pipeline import make_dataset
+from preprocessing import ImagePreprocessor
+from benchmark_utils import synthetic_xray, write_results
+
+CLASS_NAMES = ["NORMAL", "PNEUMONIA"]
+
+
+def write_synthetic_dataset(root, count, size):
+    """JPEG X-rays split over the two class folders"""
+    for i in range(count):
+        class_dir = os.path.join(root, CLASS_NAMES[i % 2])
+        os.makedirs(class_dir, exist_ok=True)
+        cv2.imwrite(os.path.join(class_dir, f"{i:05d}.jpg"), synthetic_xray(size, size, seed=i))
+
+
+def list_paths(root):
+    paths, labels = [], []
+    for label, class_name in enumerate(CLASS_NAMES):
+        class_dir = os.path.join(root, class_name)
+        for name in sorted(os.listdir(class_dir)):
+            paths.append(os.path.join(class_dir, name))
+            labels.append(label)
+    return paths, labels
+
+
+def legacy_generator(root, batch_size, augment):
+    """The previous train_ml_models input path"""
+    options = dict(rotation_range=15, width_shift_range=0.1, height_shift_range=0.1, shear_range=0.1,
+                   zoom_range=0.1, horizontal_flip=True, fill_mode="nearest") if augment else {}
+    datagen = ImageDataGenerator(
+        preprocessing_function=lambda x: preprocess_input(ImagePreprocessor.apply_clahe(x.astype("uint8"))),
+        **options
+    )
+    return datagen.flow_from_directory(root, target_size=ImagePreprocessor.TARGET_SIZE, batch_size=batch_size,
+                                       class_mode="categorical", color_mode="rgb", shuffle=False)
+
+
+def images_per_second(batches, total):
+    """Consume one epoch; returns images/s"""
+    start = time.perf_counter()
+    seen = 0
+    for x, _ in batches:
+        seen += len(x)
+        if seen >= total:
+            break
+    return seen / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Training input pipeline benchmark")
+    parser.add_argument("--data-dir", default=None, help="Folder with NORMAL/ and PNEUMONIA/ (default: synthetic)")
+    parser.add_argument("--images", type=int, default=256, help="Synthetic images to generate")
+    parser.add_argument("--size", type=int, default=1024, help="Synthetic image size")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--output", default=None, help="Optional JSON results file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = args.data_dir
+        if root is None:
+            root = os.path.join(tmp, "data")
+            write_synthetic_dataset(root, args.images, args.size)
+        paths, labels = list_paths(root)
+        total = len(paths)
+        cache_dir = os.path.join(tmp, "cache")
+
+        runs = [
+            ("ImageDataGenerator", lambda: legacy_generator(root, args.batch_size, False)),
+            ("ImageDataGenerator+augment", lambda: legacy_generator(root, args.batch_size, True)),
+            ("tf.data", lambda: make_dataset(paths, labels, args.batch_size)),
+            ("tf.data+augment", lambda: make_dataset(paths, labels, args.batch_size, augment=True)),
+            ("tf.data cache (fill)", lambda: make_dataset(paths, labels, args.batch_size, cache_dir=cache_dir)),
+            ("tf.data cache (hit)", lambda: make_dataset(paths, labels, args.batch_size, cache_dir=cache_dir)),
+        ]
+
+        # The pipeline must produce what inference-time preprocessing produces
+        first = next(iter(make_dataset(paths[:1], batch_size=1)))[0].numpy()[0]
+        np.testing.assert_allclose(first, ImagePreprocessor.preprocess_for_training(paths[0]), atol=1e-4)
+
+        print(f"📦 {total} images, batch {args.batch_size}")
+        results = []
+        for name, build in runs:
+            rate = images_per_second(build(), total)
+            results.append({"pipeline": name, "images_per_s": rate})
+            print(f"{name:>28}: {rate:8.1f} img/s")
+
+    if args.output:
+        write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
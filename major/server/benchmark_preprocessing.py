@@ -0,0 +1,74 @@
+"""
+Preprocessing throughput: the per-image paths (np.stack of _prepare_input, or
+preprocess_array with a fresh CLAHE and Keras preprocess_input) against
+ImagePreprocessor.preprocess_batch with a reused output buffer.
+
+    python benchmark_preprocessing.py --sizes 512,1024,2048 --batch-size 32
+"""
+import argparse
+import time
+import cv2
+import numpy as np
+from tensorflow.keras.applications.densenet import preprocess_input
+
+from preprocessing import ImagePreprocessor
+from benchmark_utils import synthetic_xray, write_results
+
+
+def legacy_scaled(bgr):
+    """The previous PneumoniaAI._prepare_input"""
+    rgb = cv2.resize(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB), ImagePreprocessor.TARGET_SIZE)
+    return rgb.astype(np.float32) / 255.0
+
+
+def legacy_densenet(bgr):
+    """The previous preprocess_array: CLAHE object per call, gray -> RGB, Keras normalization"""
+    rgb = cv2.resize(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB), ImagePreprocessor.TARGET_SIZE)
+    gray = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY))
+    return preprocess_input(cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB)).astype(np.float32)
+
+
+def ms_per_image(fn, count, iterations):
+    fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) * 1000.0 / (iterations * count)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch preprocessing benchmark")
+    parser.add_argument("--sizes", default="512,1024,2048", help="Square input sizes")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--output", default=None, help="Optional JSON results file")
+    args = parser.parse_args()
+
+    buffer = np.empty((args.batch_size, 224, 224, 3), dtype=np.float32)
+    print(f"{'size':>5} {'mode':>9} {'per_image_ms':>12} {'batch_ms':>9} {'speedup':>7}")
+    results = []
+    for size in [int(s) for s in args.sizes.split(",")]:
+        images = [synthetic_xray(size, size, seed=i) for i in range(args.batch_size)]
+        for mode, legacy in (("scaled", legacy_scaled), ("densenet", legacy_densenet)):
+            batch = lambda: ImagePreprocessor.preprocess_batch(images, mode=mode, color="bgr", out=buffer)
+            stacked = lambda: np.stack([legacy(img) for img in images])
+
+            # Same tensor as before (the fused normalization differs by float rounding only)
+            np.testing.assert_allclose(batch(), stacked(), atol=1e-5)
+
+            r = {
+                "size": size,
+                "mode": mode,
+                "per_image_ms": ms_per_image(stacked, len(images), args.iterations),
+                "batch_ms": ms_per_image(batch, len(images), args.iterations),
+            }
+            r["speedup"] = r["per_image_ms"] / r["batch_ms"]
+            results.append(r)
+            print(f"{size:>5} {mode:>9} {r['per_image_ms']:>12.3f} {r['batch_ms']:>9.3f} {r['speedup']:>6.2f}x")
+
+    if args.output:
+        write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Lung segmentation at full resolution against downscaled working resolutions:
+time per image and mask IoU against the full-resolution mask, plus
+segment_batch threads against a sequential loop.
+
+    python benchmark_segmentation.py --sizes 1024,2048,3000 --working-sizes 1024,512,256
+"""
+import argparse
+import time
+import numpy as np
+
+from lung_segmentation import LungSegmentation
+from benchmark_utils import synthetic_xray, write_results
+
+
+def ms_per_call(fn, iterations):
+    fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) * 1000.0 / iterations
+
+
+def mask_iou(a, b):
+    a, b = a > 0, b > 0
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lung segmentation benchmark")
+    parser.add_argument("--sizes", default="1024,2048,3000", help="Square input sizes")
+    parser.add_argument("--working-sizes", default="1024,512,256", help="Working resolutions to compare")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=16, help="Images for the segment_batch comparison")
+    parser.add_argument("--workers", type=int, default=None, help="segment_batch threads (default: CPUs)")
+    parser.add_argument("--output", default=None, help="Optional JSON results file")
+    args = parser.parse_args()
+
+    working_sizes = [int(s) for s in args.working_sizes.split(",")]
+    results = []
+    print(f"{'size':>5} {'working':>8} {'ms':>8} {'speedup':>7} {'iou':>6}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        image = synthetic_xray(size, size)
+        reference, _, _ = LungSegmentation.segment_lungs(image, as_float=False)
+        full_ms = ms_per_call(lambda: LungSegmentation.segment_lungs(image, as_float=False), args.iterations)
+        results.append({"size": size, "working_size": None, "ms": full_ms, "speedup": 1.0, "iou": 1.0})
+        print(f"{size:>5} {'full':>8} {full_ms:>8.2f} {1.0:>6.2f}x {1.0:>6.3f}")
+
+        for working in working_sizes:
+            if working >= size:
+                continue
+            mask, _, _ = LungSegmentation.segment_lungs(image, working, as_float=False)
+            r = {
+                "size": size,
+                "working_size": working,
+                "ms": ms_per_call(lambda: LungSegmentation.segment_lungs(image, working, as_float=False),
+                                  args.iterations),
+                "iou": mask_iou(mask, reference),
+            }
+            r["speedup"] = full_ms / r["ms"]
+            results.append(r)
+            print(f"{size:>5} {working:>8} {r['ms']:>8.2f} {r['speedup']:>6.2f}x {r['iou']:>6.3f}")
+
+    # Threads only pay off with spare cores; on one CPU this measures the pool overhead
+    size = int(args.sizes.split(",")[0])
+    images = [synthetic_xray(size, size, seed=i) for i in range(args.batch_size)]
+    sequential = ms_per_call(lambda: [LungSegmentation.segment_lungs(img, as_float=False) for img in images],
+                             args.iterations) / len(images)
+    batched = ms_per_call(lambda: LungSegmentation.segment_batch(images, as_float=False, max_workers=args.workers),
+                          args.iterations) / len(images)
+    results.append({"size": size, "mode": "batch", "sequential_ms": sequential, "batch_ms": batched,
+                    "speedup": sequential / batched})
+    print(f"\nsegment_batch x{len(images)} at {size}px: {sequential:.2f} -> {batched:.2f} ms/image "
+          f"({sequential / batched:.2f}x)")
+
+    if args.output:
+        write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Per-stage latency of the analysis pipeline on synthetic X-rays and a stand-in
+model (no dataset, no real weights): decode, resize, DL predict, Grad-CAM,
+overlay, lung segmentation, artifact encoding, base64, and the end-to-end
+full_analysis_bytes path, at several input resolutions and batch sizes.
+
+    python benchmark_stages.py --output stages.json
+    python benchmark_stages.py --compare stages.json --tolerance 0.25   # exit 1 on regression
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+
+from artifacts import ArtifactEncoder, to_data_url
+from final_predictor import PneumoniaAI
+from lung_segmentation import LungSegmentation
+from benchmark_utils import build_standin_model, synthetic_xray_bytes, latency_summary, write_results
+
+
+def time_stage(fn, iterations):
+    """Latency summary of fn (one untimed warmup call first)"""
+    fn()
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return latency_summary(latencies)
+
+
+def single_image_stages(ai, encoder, image_bytes):
+    """Each stage of full_analysis_bytes as a callable, fed by the previous stage's output"""
+    img = ai.decode_image(image_bytes)
+    normalized = ai._prepare_input(img)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    _, heatmap, heatmap_colored = ai.gradcam.generate_with_score(normalized)
+    overlay = ai.gradcam.create_overlay(normalized, heatmap_colored)
+    mask, _, _ = LungSegmentation.segment_lungs(gray)
+    images = {"heatmap": heatmap_colored, "overlay": overlay, "mask": (mask * 255).astype(np.uint8)}
+    artifacts = {name: encoder.encode(image) for name, image in images.items()}
+    batch = np.expand_dims(normalized, axis=0)
+
+    return {
+        "decode": lambda: ai.decode_image(image_bytes),
+        "resize": lambda: (ai._prepare_input(img), cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)),
+        "predict": lambda: ai._predict_scores(batch),
+        "gradcam": lambda: ai.gradcam.generate_with_score(normalized),
+        "overlay": lambda: ai.gradcam.create_overlay(normalized, heatmap_colored),
+        "segmentation": lambda: LungSegmentation.segment_lungs(gray),
+        "encode": lambda: {name: encoder.encode(image) for name, image in images.items()},
+        "base64": lambda: {name: to_data_url(artifact) for name, artifact in artifacts.items()},
+        "end_to_end": lambda: ai.full_analysis_bytes(image_bytes, "benchmark", encoder=encoder),
+    }
+
+
+def batch_stages(ai, contents):
+    """Batched forward pass, and the decode + batched predict path of /api/analyze/batch"""
+    batch = np.stack([ai._prepare_input(ai.decode_image(c)) for c in contents])
+    return {
+        "predict": lambda: ai._predict_scores(batch),
+        "end_to_end_batch": lambda: ai.predict_batch_bytes(contents),
+    }
+
+
+def result_key(r):
+    return r["stage"], r["resolution"], r["batch_size"]
+
+
+def compare(results, baseline_path, tolerance, min_delta_ms):
+    """
+    Stages whose p50 grew by more than tolerance (fraction) against a saved run.
+    Changes under min_delta_ms are ignored, so sub-millisecond stages don't flag on noise.
+    """
+    with open(baseline_path) as f:
+        baseline = {result_key(r): r for r in json.load(f)}
+    regressions = []
+    print(f"\n{'stage':>16} {'res':>5} {'batch':>5} {'base_p50':>9} {'p50':>9} {'change':>7}")
+    for r in results:
+        base = baseline.get(result_key(r))
+        if base is None:
+            continue
+        change = r["p50_ms"] / base["p50_ms"] - 1.0
+        regressed = change > tolerance and r["p50_ms"] - base["p50_ms"] > min_delta_ms
+        flag = "  ⚠" if regressed else ""
+        print(f"{r['stage']:>16} {r['resolution']:>5} {r['batch_size']:>5} "
+              f"{base['p50_ms']:>9.2f} {r['p50_ms']:>9.2f} {change:>+6.0%}{flag}")
+        if regressed:
+            regressions.append(r)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage analysis pipeline benchmark")
+    parser.add_argument("--resolutions", default="512,1024,2048", help="Square input sizes")
+    parser.add_argument("--batch-sizes", default="1,8,32")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--format", default="png", help="Artifact encoding (png, webp, jpeg)")
+    parser.add_argument("--model", default=None, help="Keras model to time (default: stand-in model)")
+    parser.add_argument("--output", default=None, help="Optional JSON results file")
+    parser.add_argument("--compare", default=None, help="Earlier JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p50 slowdown for --compare")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="Ignore smaller p50 changes")
+    args = parser.parse_args()
+
+    resolutions = [int(r) for r in args.resolutions.split(",")]
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",")]
+    encoder = ArtifactEncoder(args.format)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = args.model
+        if model_path is None:
+            model_path = os.path.join(tmp, "standin.h5")
+            build_standin_model().save(model_path)
+        ai = PneumoniaAI(model_path)
+
+        results = []
+        print(f"{'stage':>16} {'res':>5} {'batch':>5} {'p50_ms':>9} {'p99_ms':>9} {'per_image_ms':>12}")
+
+        def record(stage, resolution, batch_size, fn):
+            # The pipeline's progress prints would swamp the table
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                summary = time_stage(fn, args.iterations)
+            r = {"stage": stage, "resolution": resolution, "batch_size": batch_size,
+                 **summary, "per_image_ms": summary["p50_ms"] / batch_size}
+            results.append(r)
+            print(f"{stage:>16} {resolution:>5} {batch_size:>5} {r['p50_ms']:>9.2f} "
+                  f"{r['p99_ms']:>9.2f} {r['per_image_ms']:>12.2f}")
+
+        for resolution in resolutions:
+            image_bytes = synthetic_xray_bytes(resolution, resolution)
+            for stage, fn in single_image_stages(ai, encoder, image_bytes).items():
+                record(stage, resolution, 1, fn)
+            for batch_size in batch_sizes:
+                if batch_size == 1:
+                    continue
+                contents = [synthetic_xray_bytes(resolution, resolution, seed=i) for i in range(batch_size)]
+                for stage, fn in batch_stages(ai, contents).items():
+                    record(stage, resolution, batch_size, fn)
+        ai.close()
+
+    if args.output:
+        write_results(results, args.output)
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print(f"❌ {len(regressions)} stage(s) slower than baseline by more than {args.tolerance:.0%}")
+            sys.exit(1)
+        print("✅ No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Shared helpers for the benchmark scripts.
+Everything here runs without the dataset or the real model weights.
+"""
+import json
+import numpy as np
+import cv2
+import tensorflow as tf
+from typing import Tuple, List
+
+
+def build_standin_model(input_shape: Tuple[int, int, int] = (224, 224, 3)) -> tf.keras.Model:
+    """Small conv net with the same input/output contract as the pneumonia model"""
+    inputs = tf.keras.Input(shape=input_shape)
+    x = tf.keras.layers.Conv2D(16, 3, strides=2, padding="same", activation="relu", name="conv1")(inputs)
+    x = tf.keras.layers.Conv2D(32, 3, strides=2, padding="same", activation="relu", name="conv2")(x)
+    x = tf.keras.layers.Conv2D(64, 3, strides=2, padding="same", activation="relu", name="conv3")(x)
+    x = tf.keras.layers.Conv2D(128, 3, strides=2, padding="same", activation="relu", name="conv4_block1_out")(x)
+    x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    outputs = tf.keras.layers.Dense(1, activation="sigmoid")(x)
+    return tf.keras.Model(inputs, outputs, name="standin_pneumonia")
+
+
+def synthetic_xray(height: int = 1024, width: int = 1024, seed: int = 0) -> np.ndarray:
+    """Chest-X-ray-like BGR uint8 image: dark lung fields inside a bright body"""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    yy /= height
+    xx /= width
+
+    body = np.exp(-(((xx - 0.5) / 0.45) ** 2 + ((yy - 0.55) / 0.55) ** 2))
+    left = np.exp(-(((xx - 0.32) / 0.12) ** 2 + ((yy - 0.5) / 0.25) ** 2))
+    right = np.exp(-(((xx - 0.68) / 0.12) ** 2 + ((yy - 0.5) / 0.25) ** 2))
+
+    img = 200 * body - 120 * (left + right) + rng.normal(0, 8, (height, width))
+    img = np.clip(img + 30, 0, 255).astype(np.uint8)
+    return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+
+
+def synthetic_xray_bytes(height: int = 1024, width: int = 1024, seed: int = 0, ext: str = ".png") -> bytes:
+    """Encoded synthetic X-ray, as an upload would arrive"""
+    ok, buffer = cv2.imencode(ext, synthetic_xray(height, width, seed))
+    return buffer.tobytes()
+
+
+def latency_summary(latencies_s: List[float]) -> dict:
+    """p50/p90/p99/mean in milliseconds"""
+    arr = np.asarray(latencies_s, dtype=np.float64) * 1000.0
+    if arr.size == 0:
+        return {"count": 0}
+    return {
+        "count": int(arr.size),
+        "mean_ms": float(arr.mean()),
+        "p50_ms": float(np.percentile(arr, 50)),
+        "p90_ms": float(np.percentile(arr, 90)),
+        "p99_ms": float(np.percentile(arr, 99)),
+    }
+
+
+def current_rss_mb() -> float:
+    """Resident set size of this process in MB (Linux; 0.0 elsewhere)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return 0.0
+
+
+def write_results(results, path: str):
+    """Dump benchmark results as JSON so runs can be compared"""
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"💾 Results saved to {path}")
@@ -0,0 +1,97 @@
+"""
+Throughput of the multi-process worker pool for workers x threads combinations.
+
+    python benchmark_workers.py                       # every split of the host's CPUs
+    python benchmark_workers.py --configs 1x4,2x2,4x1 --requests 200 --fast
+    python benchmark_workers.py --model models/final_pnuemonia_model.h5
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from worker_pool import WorkerPool, available_cpus
+from benchmark_utils import build_standin_model, synthetic_xray_bytes, latency_summary, write_results
+
+
+def default_configs(num_cpus):
+    """Every workers x threads split that uses all CPUs"""
+    return [(w, num_cpus // w) for w in range(1, num_cpus + 1) if num_cpus % w == 0]
+
+
+def parse_configs(text):
+    return [tuple(int(v) for v in item.lower().split("x")) for item in text.split(",") if item]
+
+
+def run_config(model_path, workers, threads, images, include, concurrency_per_worker, pin_cpus):
+    pool = WorkerPool(workers, threads, {"model_path": model_path, "convert_model": False}, pin_cpus=pin_cpus)
+    try:
+        pool.warmup()
+        latencies = []
+
+        def request(image_bytes):
+            start = time.perf_counter()
+            result = pool.full_analysis_bytes(image_bytes, "bench.png", include)
+            latencies.append(time.perf_counter() - start)
+            return result["status"]
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers * concurrency_per_worker) as clients:
+            statuses = list(clients.map(request, images))
+        elapsed = time.perf_counter() - start
+    finally:
+        pool.close()
+
+    return {
+        "workers": workers,
+        "threads_per_worker": threads,
+        "requests": len(images),
+        "errors": sum(1 for s in statuses if s != "success"),
+        "throughput_rps": len(images) / elapsed,
+        **latency_summary(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker pool sweep")
+    parser.add_argument("--configs", default=None, help="Comma-separated WORKERSxTHREADS, e.g. 1x4,2x2,4x1")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--size", type=int, default=512, help="Synthetic X-ray size")
+    parser.add_argument("--fast", action="store_true", help="Diagnosis only (skip heatmap and segmentation)")
+    parser.add_argument("--concurrency", type=int, default=2, help="In-flight requests per worker")
+    parser.add_argument("--no-pin", action="store_true", help="Don't pin workers to CPUs")
+    parser.add_argument("--model", default=None, help="Model .h5 (default: small stand-in model)")
+    parser.add_argument("--output", default=None, help="Optional JSON results file")
+    args = parser.parse_args()
+
+    num_cpus = len(available_cpus())
+    configs = parse_configs(args.configs) if args.configs else default_configs(num_cpus)
+    include = () if args.fast else None
+    # Distinct images so the result caches never short-circuit inference
+    images = [synthetic_xray_bytes(args.size, args.size, seed=i) for i in range(args.requests)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = args.model
+        if model_path is None:
+            model_path = os.path.join(tmp, "standin.h5")
+            build_standin_model().save(model_path)
+
+        print(f"🖥 {num_cpus} CPUs, {args.requests} requests, {'fast' if args.fast else 'full'} analysis")
+        print(f"{'config':>8} {'req/s':>8} {'p50_ms':>8} {'p99_ms':>8} {'errors':>6}")
+        results = []
+        for workers, threads in configs:
+            r = run_config(model_path, workers, threads, images, include, args.concurrency, not args.no_pin)
+            results.append(r)
+            print(f"{workers:>4}x{threads:<3} {r['throughput_rps']:>8.2f} {r['p50_ms']:>8.1f} "
+                  f"{r['p99_ms']:>8.1f} {r['errors']:>6}")
+
+    best = max(results, key=lambda r: r["throughput_rps"])
+    print(f"🏆 Best: {best['workers']} workers x {best['threads_per_worker']} threads "
+          f"({best['throughput_rps']:.2f} req/s)")
+    if args.output:
+        write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
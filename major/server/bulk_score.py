@@ -0,0 +1,338 @@
+"""
+Bulk offline scoring of an X-ray archive.
+
+Walks a directory tree, decodes images in parallel worker processes, scores
+them in batches and appends results to CSV or Parquet as it goes. Re-running
+the same command resumes after the last written image.
+
+    python bulk_score.py /data/archive --output scores.csv
+    python bulk_score.py /data/archive --output scores.parquet --backend int8 --decode-workers 6
+    python bulk_score.py /data/archive --output scores.csv --heatmaps overlays/
+"""
+import argparse
+import csv
+import multiprocessing
+import os
+import time
+import cv2
+
+from image_decode import BoundedDecoder, ImageTooLargeError
+from preprocessing import ImagePreprocessor
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+MODEL_INPUT_SIZE = (224, 224)
+COLUMNS = ["path", "status", "diagnosis", "confidence", "raw_score", "severity", "message"]
+
+
+def find_images(root, extensions=IMAGE_EXTENSIONS):
+    """Image paths under root, relative and in a stable order"""
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(extensions):
+                found.append(os.path.relpath(os.path.join(dirpath, name), root))
+    return found
+
+
+_decoder = None
+
+
+def init_decoder(max_side, max_pixels, max_decode_mb):
+    """Decode worker initializer: the same decode budget as the API"""
+    global _decoder
+    _decoder = BoundedDecoder(max_side, max_pixels, max_decode_mb)
+
+
+def decode_for_model(path):
+    """
+    Runs in a decode worker: file -> (224x224 RGB uint8 or None, error message).
+    Large files are decoded reduced, as in the API; over-budget ones are not decoded.
+    The float conversion is done per batch in the main process
+    (ImagePreprocessor.preprocess_batch, as PneumoniaAI does).
+    """
+    try:
+        img, _ = (_decoder or BoundedDecoder()).read(path)
+    except ImageTooLargeError as e:
+        return None, str(e)
+    if img is None:
+        return None, "Could not decode image"
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    return cv2.resize(img, MODEL_INPUT_SIZE), ""
+
+
+# ---------- output ----------
+
+class CsvSink:
+    """Appends rows to a CSV file; the file itself is the checkpoint"""
+
+    def __init__(self, path):
+        self.path = path
+        self._repair_tail()
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "a", newline="")
+        self._writer = csv.DictWriter(self._file, fieldnames=COLUMNS)
+        if new_file:
+            self._writer.writeheader()
+
+    def _repair_tail(self):
+        """Drop a half-written last line left by an interrupted run"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def done_paths(self):
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path, newline="") as f:
+            return {row["path"] for row in csv.DictReader(f)}
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetSink:
+    """
+    Writes a Parquet dataset directory (Parquet files can't be appended to). Needs pyarrow.
+    Every write lands as its own small batch file, so each scored batch is checkpointed
+    like a CSV row flush; once rows_per_part rows have gathered (and on close) the batch
+    files are compacted into one part file named after the batch range it replaces.
+    """
+
+    def __init__(self, path, rows_per_part=4096):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("❌ Parquet output needs pyarrow (pip install pyarrow), or use a .csv output")
+        self._pa, self._pq = pa, pq
+        self._schema = pa.schema([
+            ("path", pa.string()), ("status", pa.string()), ("diagnosis", pa.string()),
+            ("confidence", pa.float64()), ("raw_score", pa.float64()),
+            ("severity", pa.string()), ("message", pa.string()),
+        ])
+        self.path = path
+        self.rows_per_part = rows_per_part
+        os.makedirs(path, exist_ok=True)
+        # Leftovers of a file that was being written when the run stopped
+        for name in os.listdir(path):
+            if name.endswith(".tmp"):
+                os.remove(os.path.join(path, name))
+        # Batch files already compacted into a part (the run stopped before deleting them)
+        compacted = self._compacted_ranges()
+        for number, name in self._batch_files():
+            if any(first <= number <= last for first, last in compacted):
+                os.remove(os.path.join(path, name))
+        numbers = [n for n, _ in self._batch_files()] + [last for _, last in compacted]
+        self._next_batch = max(numbers, default=-1) + 1
+        self._parts = len([n for n in os.listdir(path) if n.startswith("part-") and n.endswith(".parquet")])
+        self._pending_rows = sum(
+            self._pq.read_metadata(os.path.join(path, name)).num_rows for _, name in self._batch_files()
+        )
+
+    def _batch_files(self):
+        """(number, name) of batch files not yet compacted, in order"""
+        found = []
+        for name in os.listdir(self.path):
+            if name.startswith("batch-") and name.endswith(".parquet"):
+                found.append((int(name[len("batch-"):-len(".parquet")]), name))
+        return sorted(found)
+
+    def _compacted_ranges(self):
+        """Batch number ranges covered by part files (part-NNNNN-FIRST-LAST.parquet)"""
+        ranges = []
+        for name in os.listdir(self.path):
+            fields = name[:-len(".parquet")].split("-") if name.endswith(".parquet") else []
+            if len(fields) == 4 and fields[0] == "part":
+                ranges.append((int(fields[2]), int(fields[3])))
+        return ranges
+
+    def done_paths(self):
+        done = set()
+        for name in sorted(os.listdir(self.path)):
+            if name.endswith(".parquet"):
+                table = self._pq.read_table(os.path.join(self.path, name), columns=["path"])
+                done.update(table.column("path").to_pylist())
+        return done
+
+    def _write_table(self, table, final_path):
+        tmp_path = final_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            self._pq.write_table(table, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, final_path)
+
+    def write(self, rows):
+        if not rows:
+            return
+        table = self._pa.Table.from_pylist(rows, schema=self._schema)
+        self._write_table(table, os.path.join(self.path, f"batch-{self._next_batch:06d}.parquet"))
+        self._next_batch += 1
+        self._pending_rows += len(rows)
+        if self._pending_rows >= self.rows_per_part:
+            self._compact()
+
+    def _compact(self):
+        """Merge the batch files into one part file, then drop them"""
+        batches = self._batch_files()
+        if not batches:
+            return
+        table = self._pa.concat_tables([
+            self._pq.read_table(os.path.join(self.path, name)) for _, name in batches
+        ])
+        first, last = batches[0][0], batches[-1][0]
+        self._write_table(table, os.path.join(self.path, f"part-{self._parts:05d}-{first:06d}-{last:06d}.parquet"))
+        for _, name in batches:
+            os.remove(os.path.join(self.path, name))
+        self._parts += 1
+        self._pending_rows = 0
+
+    def close(self):
+        self._compact()
+
+
+def open_sink(path, rows_per_part):
+    if path.endswith(".parquet"):
+        return ParquetSink(path, rows_per_part)
+    return CsvSink(path)
+
+
+# ---------- scoring ----------
+
+def result_row(path, prediction):
+    return {
+        "path": path,
+        "status": prediction["status"],
+        "diagnosis": prediction.get("diagnosis", ""),
+        "confidence": prediction.get("confidence"),
+        "raw_score": prediction.get("raw_score"),
+        "severity": prediction.get("severity", ""),
+        "message": prediction.get("message", ""),
+    }
+
+
+def write_overlays(ai, batch, paths, heatmap_dir):
+    """
+    Batched Grad-CAM (one taped pass) -> overlay PNGs mirroring the archive layout
+    Returns the scores of the same pass (or None if the diagnosis must come from elsewhere)
+    and a message per image, non-empty where the overlay could not be written
+    """
+    scores, _, heatmaps_colored = ai.gradcam.generate_batch(batch)
+    messages = []
+    for path, overlay in zip(paths, ai.gradcam.create_overlays(batch, heatmaps_colored)):
+        target = os.path.join(heatmap_dir, os.path.splitext(path)[0] + ".png")
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            written = cv2.imwrite(target, overlay)
+        except (OSError, cv2.error):
+            written = False
+        messages.append("" if written else f"Could not write heatmap overlay {target}")
+    # A quantized backend always makes the diagnosis, as in the API
+    return (scores if ai.quantized is None else None), messages
+
+
+def score_batch(ai, paths, images, heatmap_dir=None, messages=None):
+    """One forward pass over the decodable images of a batch -> result rows"""
+    messages = messages or [""] * len(paths)
+    rows = [result_row(p, {"status": "error", "message": m or "Could not decode image"})
+            for p, m in zip(paths, messages)]
+    valid = [i for i, img in enumerate(images) if img is not None]
+    if valid:
+        batch = ImagePreprocessor.preprocess_batch([images[i] for i in valid], mode="scaled")
+        scores, overlay_messages = None, [""] * len(valid)
+        if heatmap_dir and ai.gradcam is not None:
+            scores, overlay_messages = write_overlays(ai, batch, [paths[i] for i in valid], heatmap_dir)
+        if scores is None:
+            scores = ai._predict_scores(batch)
+        for i, score, message in zip(valid, scores, overlay_messages):
+            # The score stands; a failed overlay write is noted on the row
+            rows[i] = result_row(paths[i], dict(ai._build_prediction(score), message=message))
+    return rows
+
+
+def run(root, output, model_path="models/final_pnuemonia_model.h5", backend="float",
+        batch_size=32, decode_workers=None, rows_per_part=4096, report_every=10.0, limit=None,
+        heatmap_dir=None, decode_max_side=2048, max_image_mp=50, max_decode_mb=256):
+    sink = open_sink(output, rows_per_part)
+    paths = find_images(root)
+    done = sink.done_paths()
+    todo = [p for p in paths if p not in done][:limit]
+    print(f"📂 {len(paths)} images found, {len(done)} already scored, {len(todo)} to go")
+    if not todo:
+        sink.close()
+        return
+
+    # Decode workers start before TensorFlow so they stay small
+    decode_workers = decode_workers or max(1, (os.cpu_count() or 2) - 1)
+    context = multiprocessing.get_context("spawn")
+    pool = context.Pool(decode_workers, initializer=init_decoder,
+                        initargs=(decode_max_side, int(max_image_mp * 1_000_000), max_decode_mb))
+
+    from final_predictor import PneumoniaAI
+    ai = PneumoniaAI(model_path, backend=backend)
+
+    start = last_report = time.perf_counter()
+    scored = scored_at_last_report = 0
+    try:
+        decoded = pool.imap(decode_for_model, [os.path.join(root, p) for p in todo], chunksize=8)
+        batch_paths, batch_images, batch_messages = [], [], []
+        for path, (image, message) in zip(todo, decoded):
+            batch_paths.append(path)
+            batch_images.append(image)
+            batch_messages.append(message)
+            if len(batch_paths) < batch_size and len(batch_paths) + scored < len(todo):
+                continue
+
+            sink.write(score_batch(ai, batch_paths, batch_images, heatmap_dir, batch_messages))
+            scored += len(batch_paths)
+            batch_paths, batch_images, batch_messages = [], [], []
+
+            now = time.perf_counter()
+            if now - last_report >= report_every or scored == len(todo):
+                recent = (scored - scored_at_last_report) / (now - last_report)
+                print(f"⏱ {scored}/{len(todo)}  {recent:.1f} img/s now, "
+                      f"{scored / (now - start):.1f} img/s overall")
+                last_report, scored_at_last_report = now, scored
+    finally:
+        # Whatever was written is kept; a re-run resumes after it
+        sink.close()
+        pool.terminate()
+        ai.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ Scored {scored} images in {elapsed:.1f}s ({scored / elapsed:.1f} img/s) -> {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk pneumonia scoring of an image archive")
+    parser.add_argument("root", help="Directory to scan (recursively)")
+    parser.add_argument("--output", default="scores.csv", help=".csv file or .parquet directory")
+    parser.add_argument("--model", default="models/final_pnuemonia_model.h5")
+    parser.add_argument("--backend", default="float", choices=["float", "dynamic", "int8"])
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--decode-workers", type=int, default=None, help="Default: CPUs - 1")
+    parser.add_argument("--rows-per-part", type=int, default=4096, help="Parquet rows per part file")
+    parser.add_argument("--report-every", type=float, default=10.0, help="Seconds between progress lines")
+    parser.add_argument("--limit", type=int, default=None, help="Score at most this many new images")
+    parser.add_argument("--heatmaps", default=None, help="Also write Grad-CAM overlays (PNG) under this directory")
+    parser.add_argument("--decode-max-side", type=int, default=2048,
+                        help="Decode images at least twice this size reduced (0 = full resolution)")
+    parser.add_argument("--max-image-mp", type=float, default=50, help="Skip images over this many megapixels")
+    parser.add_argument("--max-decode-mb", type=float, default=256, help="Skip images whose decode needs more memory")
+    args = parser.parse_args()
+    run(args.root, args.output, args.model, args.backend, args.batch_size, args.decode_workers,
+        args.rows_per_part, args.report_every, args.limit, args.heatmaps,
+        args.decode_max_side, args.max_image_mp, args.max_decode_mb)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import hashlib
+import os
+import numpy as np
+import tensorflow as tf
+from typing import List, Optional
+
+from preprocessing import ImagePreprocessor
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+# Same normalization as ImagePreprocessor.preprocess_batch (densenet mode), applied in-graph after augmentation
+_SCALE = ImagePreprocessor.DENSENET_SCALE
+_OFFSET = ImagePreprocessor.DENSENET_OFFSET
+
+
+def _preprocess_bytes(image_bytes) -> np.ndarray:
+    """Encoded image -> resized, CLAHE-enhanced RGB uint8 (same steps as ImagePreprocessor)"""
+    image = ImagePreprocessor.load_image(image_bytes)
+    image = ImagePreprocessor.resize(image)
+    return ImagePreprocessor.apply_clahe(image)
+
+
+def _load_preprocessed(path, label):
+    # File reads run in TF threads; decode / resize / CLAHE release the GIL inside PIL and OpenCV
+    image = tf.numpy_function(_preprocess_bytes, [tf.io.read_file(path)], tf.uint8)
+    image.set_shape(ImagePreprocessor.TARGET_SIZE + (3,))
+    return image, label
+
+
+def build_augmenter() -> tf.keras.Sequential:
+    """Random flips, rotation, shifts and zoom (shear has no Keras layer and is left out)"""
+    return tf.keras.Sequential([
+        tf.keras.layers.RandomFlip("horizontal"),
+        tf.keras.layers.RandomRotation(15 / 360, fill_mode="nearest"),
+        tf.keras.layers.RandomTranslation(0.1, 0.1, fill_mode="nearest"),
+        tf.keras.layers.RandomZoom(0.1, fill_mode="nearest"),
+    ], name="augment")
+
+
+def cache_path(cache_dir: str, paths: List[str]) -> str:
+    """
+    Cache file for this exact list of images and preprocessing version.
+    Any added, removed or modified file gives a new cache.
+    """
+    h = hashlib.sha256(ImagePreprocessor.VERSION.encode())
+    for path in paths:
+        stat = os.stat(path)
+        h.update(f"{path}|{stat.st_size}|{int(stat.st_mtime)}\n".encode())
+    return os.path.join(cache_dir, f"preprocessed_{h.hexdigest()[:16]}")
+
+
+def make_dataset(paths: List[str], labels=None, batch_size: int = 32, augment: bool = False,
+                 shuffle: bool = False, cache_dir: Optional[str] = None, seed: int = 42) -> tf.data.Dataset:
+    """
+    Batched (images, labels) for DenseNet: parallel decode + resize + CLAHE,
+    optional augmentation, DenseNet normalization, prefetch.
+    With cache_dir, the deterministic uint8 tensors are cached on disk after the
+    first full pass, so later passes skip decoding (augmentation still runs).
+    """
+    if labels is None:
+        labels = np.zeros(len(paths), dtype=np.int64)
+    # Explicit string dtype: an empty path list would otherwise become float32
+    dataset = tf.data.Dataset.from_tensor_slices((tf.constant(list(paths), dtype=tf.string),
+                                                  np.asarray(labels)))
+    dataset = dataset.map(_load_preprocessed, num_parallel_calls=AUTOTUNE, deterministic=True)
+
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        dataset = dataset.cache(cache_path(cache_dir, paths))
+    if shuffle:
+        dataset = dataset.shuffle(max(1, min(len(paths), 2048)), seed=seed, reshuffle_each_iteration=True)
+
+    dataset = dataset.batch(batch_size, num_parallel_calls=AUTOTUNE)
+    if augment:
+        augmenter = build_augmenter()
+        dataset = dataset.map(lambda x, y: (augmenter(tf.cast(x, tf.float32), training=True), y),
+                              num_parallel_calls=AUTOTUNE)
+    dataset = dataset.map(lambda x, y: (tf.cast(x, tf.float32) * _SCALE + _OFFSET, y),
+                          num_parallel_calls=AUTOTUNE)
+    return dataset.prefetch(AUTOTUNE)
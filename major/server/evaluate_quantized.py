@@ -0,0 +1,132 @@
+import os
+import time
+import numpy as np
+import cv2
+from sklearn.metrics import (accuracy_score, precision_score, recall_score, f1_score,
+                             roc_auc_score, classification_report)
+from final_predictor import PneumoniaAI
+from benchmark_utils import latency_summary, current_rss_mb, write_results
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def load_test_set(test_dir, limit=None):
+    """Prepared model inputs and labels (0 NORMAL, 1 PNEUMONIA)"""
+    inputs, labels = [], []
+    for label, class_name in enumerate(["NORMAL", "PNEUMONIA"]):
+        class_path = os.path.join(test_dir, class_name)
+        if not os.path.exists(class_path): continue
+
+        names = sorted(n for n in os.listdir(class_path) if n.lower().endswith(IMAGE_EXTENSIONS))
+        for img_name in names[:limit]:
+            img = cv2.imread(os.path.join(class_path, img_name))
+            if img is None: continue
+            inputs.append(PneumoniaAI._prepare_input(img))
+            labels.append(label)
+    return np.stack(inputs), np.asarray(labels)
+
+
+def model_bytes(ai):
+    """Size of the weights the backend runs on"""
+    if ai.quantized is not None:
+        return ai.quantized.size_bytes
+    return int(sum(np.asarray(w).nbytes for w in ai.model.weights))
+
+
+def varying_batch_latency(ai, inputs, max_batch_size=8, calls=50, seed=0):
+    """
+    Per-call latency when consecutive batches differ in size (1..max_batch_size), as
+    micro-batches do under load; one untimed pass per size first
+    """
+    sizes = np.random.default_rng(seed).integers(1, max_batch_size + 1, size=calls)
+    for n in range(1, max_batch_size + 1):
+        ai._predict_scores(inputs[np.arange(n) % len(inputs)])
+    latencies = []
+    for n in sizes:
+        batch = inputs[np.arange(n) % len(inputs)]
+        start = time.perf_counter()
+        ai._predict_scores(batch)
+        latencies.append(time.perf_counter() - start)
+    return latency_summary(latencies)
+
+
+def evaluate_backend(ai, inputs, labels, batch_size=32, max_micro_batch=8):
+    """Latency, memory and classification metrics for one backend"""
+    # Single-image latency (first call also allocates activation buffers)
+    rss_before = current_rss_mb()
+    latencies = []
+    for x in inputs:
+        start = time.perf_counter()
+        ai._predict_scores(x[None])
+        latencies.append(time.perf_counter() - start)
+    rss_after = current_rss_mb()
+
+    # Batched scores, also used for the metrics
+    start = time.perf_counter()
+    scores = np.concatenate([
+        ai._predict_scores(inputs[i:i + batch_size]) for i in range(0, len(inputs), batch_size)
+    ])
+    batch_seconds = time.perf_counter() - start
+    varying = varying_batch_latency(ai, inputs, max_micro_batch)
+    y_pred = (scores > 0.5).astype(int)
+
+    return {
+        "backend": ai.backend,
+        "model_mb": model_bytes(ai) / 1e6,
+        "inference_rss_delta_mb": rss_after - rss_before,
+        "latency": latency_summary(latencies[1:] or latencies),
+        "batch_images_per_s": len(inputs) / batch_seconds,
+        "varying_batch_latency": varying,
+        "accuracy": float(accuracy_score(labels, y_pred)),
+        "precision": float(precision_score(labels, y_pred, zero_division=0)),
+        "recall": float(recall_score(labels, y_pred, zero_division=0)),
+        "f1": float(f1_score(labels, y_pred, zero_division=0)),
+        "roc_auc": float(roc_auc_score(labels, scores)) if len(set(labels)) > 1 else None,
+    }, scores
+
+
+def run_comparison(test_dir, model_path="models/final_pnuemonia_model.h5",
+                   backends=("float", "dynamic", "int8"), calibration_dir="dataset/train",
+                   calibration_size=100, limit=None, output="quantization_report.json"):
+    inputs, labels = load_test_set(test_dir, limit)
+    print(f"\n🔍 Comparing backends on {len(labels)} test images...")
+
+    report = []
+    float_scores = None
+    for backend in backends:
+        print(f"\n⚙ Backend: {backend}")
+        ai = PneumoniaAI(model_path, backend=backend,
+                         calibration_dir=calibration_dir, calibration_size=calibration_size)
+        result, scores = evaluate_backend(ai, inputs, labels)
+        ai.close()
+
+        # Parity with the float model
+        if backend == "float":
+            float_scores = scores
+        if float_scores is not None:
+            result["agreement_with_float"] = float(np.mean((scores > 0.5) == (float_scores > 0.5)))
+            result["max_score_diff"] = float(np.max(np.abs(scores - float_scores)))
+        report.append(result)
+
+        print(classification_report(labels, (scores > 0.5).astype(int),
+                                    target_names=["NORMAL", "PNEUMONIA"], zero_division=0))
+
+    # Summary table
+    print("\n📊 Quantization Report:")
+    print(f"{'backend':>8} {'model_mb':>9} {'p50_ms':>7} {'p99_ms':>7} {'img/s':>7} {'mixed_p50':>9} "
+          f"{'acc':>6} {'f1':>6} {'auc':>6} {'agree':>6}")
+    for r in report:
+        auc = f"{r['roc_auc']:.3f}" if r["roc_auc"] is not None else "-"
+        agree = f"{r['agreement_with_float']:.3f}" if "agreement_with_float" in r else "-"
+        print(f"{r['backend']:>8} {r['model_mb']:>9.2f} {r['latency']['p50_ms']:>7.2f} "
+              f"{r['latency']['p99_ms']:>7.2f} {r['batch_images_per_s']:>7.1f} "
+              f"{r['varying_batch_latency']['p50_ms']:>9.2f} "
+              f"{r['accuracy']:>6.3f} {r['f1']:>6.3f} {auc:>6} {agree:>6}")
+
+    if output:
+        write_results(report, output)
+    return report
+
+if __name__ == "__main__":
+    # Ensure this points to your test folder
+    run_comparison("dataset/test")
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+from typing import List
+
+
+def content_hash(path: str) -> str:
+    """sha256 of a file's bytes"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class FeatureStore:
+    """
+    On-disk store of extracted features, keyed by image content hash.
+    Features live in memory-mapped float32 .npy shards with a JSON index
+    (hash -> shard, row). Each preprocessing + backbone version gets its own
+    directory, so changing either starts a fresh store instead of mixing features.
+    """
+
+    def __init__(self, root_dir: str, version: str):
+        self.version = version
+        self.dir = os.path.join(root_dir, hashlib.sha256(version.encode()).hexdigest()[:16])
+        os.makedirs(self.dir, exist_ok=True)
+        self._index_path = os.path.join(self.dir, "index.json")
+        self._lock = threading.Lock()
+        self._shards = {}  # shard name -> memmap
+
+        self._index = {}
+        self._num_shards = 0
+        if os.path.exists(self._index_path):
+            with open(self._index_path) as f:
+                data = json.load(f)
+            self._index = data["entries"]
+            self._num_shards = data["num_shards"]
+        else:
+            self._write_index()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def missing(self, keys: List[str]) -> List[str]:
+        """Keys without stored features, de-duplicated, in first-seen order"""
+        return list(dict.fromkeys(k for k in keys if k not in self._index))
+
+    def _write_index(self):
+        tmp_path = f"{self._index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": self.version, "num_shards": self._num_shards, "entries": self._index}, f)
+        os.replace(tmp_path, self._index_path)
+
+    def _shard(self, name: str) -> np.ndarray:
+        shard = self._shards.get(name)
+        if shard is None:
+            shard = np.load(os.path.join(self.dir, name), mmap_mode="r")
+            self._shards[name] = shard
+        return shard
+
+    def shard_writer(self, num_rows: int, dim: int) -> "ShardWriter":
+        """New shard preallocated for num_rows; rows are indexed as they are appended"""
+        with self._lock:
+            name = f"shard_{self._num_shards:05d}.npy"
+            self._num_shards += 1
+            self._write_index()
+        return ShardWriter(self, name, num_rows, dim)
+
+    def _commit(self, name: str, keys: List[str], first_row: int):
+        with self._lock:
+            for offset, key in enumerate(keys):
+                self._index[key] = [name, first_row + offset]
+            self._shards.pop(name, None)  # Re-open so readers see the new rows
+            self._write_index()
+
+    def add(self, keys: List[str], features: np.ndarray):
+        """Write features (one row per key) as a new shard and index them"""
+        if len(keys) != len(features):
+            raise ValueError(f"{len(keys)} keys for {len(features)} feature rows")
+        if len(keys):
+            self.shard_writer(len(keys), features.shape[1]).append(keys, features)
+
+    def get(self, keys: List[str]) -> np.ndarray:
+        """
+        Feature matrix for keys (all must be stored).
+        Keys stored as one contiguous run of a shard come back as a read-only
+        view of the memory map (zero-copy); anything else is gathered into a new array.
+        """
+        if not keys:
+            return np.zeros((0, 0), dtype=np.float32)
+        locations = [self._index[k] for k in keys]
+
+        first_shard, first_row = locations[0]
+        if all(shard == first_shard and row == first_row + i for i, (shard, row) in enumerate(locations)):
+            return self._shard(first_shard)[first_row:first_row + len(keys)]
+
+        dim = self._shard(first_shard).shape[1]
+        out = np.empty((len(keys), dim), dtype=np.float32)
+        for i, (shard, row) in enumerate(locations):
+            out[i] = self._shard(shard)[row]
+        return out
+
+    def stats(self) -> dict:
+        return {"entries": len(self._index), "shards": self._num_shards, "dir": self.dir}
+
+
+class ShardWriter:
+    """
+    Fills one preallocated .npy shard in order. Rows are flushed and indexed
+    on every append, so an interrupted extraction keeps what it finished.
+    """
+
+    def __init__(self, store: FeatureStore, name: str, num_rows: int, dim: int):
+        self.store = store
+        self.name = name
+        self.rows = 0
+        self._array = np.lib.format.open_memmap(
+            os.path.join(store.dir, name), mode="w+", dtype=np.float32, shape=(num_rows, dim)
+        )
+
+    def append(self, keys: List[str], features: np.ndarray):
+        n = len(keys)
+        if self.rows + n > len(self._array):
+            raise ValueError(f"Shard {self.name} is full")
+        self._array[self.rows:self.rows + n] = features
+        self._array.flush()
+        self.store._commit(self.name, keys, self.rows)
+        self.rows += n
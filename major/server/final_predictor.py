@@ -2,52 +2,193 @@ import numpy as np
 import tensorflow as tf
 import cv2
 import os
-import base64
-import joblib
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime  # ADD THIS IMPORT
 from io import BytesIO
+from batching import MicroBatcher
+from artifacts import ArtifactEncoder
+from preprocessing import ImagePreprocessor
+from ml_ensemble import MLEnsemble
+from telemetry import ERRORS, log, span, record_error, report_progress, track_peak_rss
+from image_decode import BoundedDecoder, ImageTooLargeError
 
 class PneumoniaAI:
-    def __init__(self, model_path="models/final_pnuemonia_model.h5"):
+    PREDICT_CHUNK_SIZE = 32  # Largest forward pass used by predict_batch
+    ANALYSIS_STAGES = ("heatmap", "segmentation")  # Optional, selectable per request
+
+    def __init__(self, model_path="models/final_pnuemonia_model.h5",
+                 max_batch_size=1, max_batch_wait_ms=5.0, result_cache=None,
+                 context_cache_size=16, artifact_encoder=None, convert_model=True,
+                 backend="float", calibration_dir="dataset/train", calibration_size=100,
+                 segmentation_size=None, decode_max_side=None, max_image_pixels=50_000_000,
+                 max_decode_mb=256):
+        """
+        backend: "float" (Keras model), or a quantized TFLite model for plain
+        forward passes: "dynamic" (int8 weights) or "int8" (int8 weights and
+        activations, calibrated on calibration_size images from calibration_dir)
+        segmentation_size: segment lungs at this working resolution (longer side)
+        and upsample the mask; None segments at full resolution
+        decode_max_side / max_image_pixels / max_decode_mb: per-request decode budget
+        (see BoundedDecoder); None decodes at full resolution
+        """
+        # Seconds spent in each startup phase (warmup adds its own entries)
+        self.startup_timings = {}
+        self.warmed_up = False
+        
         # Load the high-accuracy deep learning model
-        self.model = tf.keras.models.load_model(model_path)
-        print("✓ High-Accuracy Deep Learning Engine Loaded")
+        start = time.perf_counter()
+        self.model = self._load_model(model_path, convert_model)
+        self.model_version = self._model_version(model_path)
+        self.startup_timings["load_model"] = time.perf_counter() - start
+        print(f"✓ High-Accuracy Deep Learning Engine Loaded ({self.startup_timings['load_model']:.2f}s)")
+        
+        # Optional quantized backend for diagnosis; Grad-CAM keeps the float model
+        self.backend = backend
+        self.quantized = None
+        if backend != "float":
+            from quantization import QUANTIZATION_MODES, QuantizedBackend, load_calibration_set, load_or_quantize
+            if backend not in QUANTIZATION_MODES:
+                raise ValueError(f"Unknown backend: {backend}. Choose from: float, {', '.join(QUANTIZATION_MODES)}")
+            start = time.perf_counter()
+            content = load_or_quantize(
+                model_path, backend, self.model,
+                lambda: load_calibration_set(calibration_dir, self._prepare_input, calibration_size)
+            )
+            self.quantized = QuantizedBackend(content, backend)
+            self.model_version += f":{backend}"
+            self.startup_timings["quantize"] = time.perf_counter() - start
+            print(f"✓ Quantized backend: {backend} ({self.quantized.size_bytes / 1e6:.1f} MB)")
+        
+        # Downscaled lung segmentation changes masks slightly, so cached results must not mix
+        self.segmentation_size = segmentation_size or None
+        if self.segmentation_size:
+            self.model_version += f":seg{self.segmentation_size}"
+        
+        # Very large uploads decode at reduced resolution, within a pixel and memory budget
+        self.decoder = BoundedDecoder(decode_max_side or 0, max_image_pixels, max_decode_mb)
+        if self.decoder.max_side:
+            self.model_version += f":dec{self.decoder.max_side}"
+        
+        # Optional content-addressed cache of full analysis results
+        self.result_cache = result_cache
         
-        # Initialize ML models
-        self.svm_model = None
-        self.rf_model = None
-        self.lr_model = None
-        self._load_ml_models()
-
-    def _load_ml_models(self):
-        """Try to load ML models if available"""
+        # Default encoding of heatmap / overlay / mask images
+        self.artifact_encoder = artifact_encoder or ArtifactEncoder()
+        
+        # Inputs of recently skipped stages, keyed by image hash
+        self.context_cache_size = context_cache_size
+        self._contexts = OrderedDict()
+        self._contexts_lock = threading.Lock()
+        
+        # Optional micro-batching of concurrent predictions
+        self.batcher = None
+        if max_batch_size > 1:
+            self.batcher = MicroBatcher(self._predict_scores, max_batch_size, max_batch_wait_ms)
+            print(f"✓ Micro-batching enabled (batch={max_batch_size}, wait={max_batch_wait_ms}ms)")
+        
+        # Grad-CAM: layer choice and compiled grad model are built once here
+        start = time.perf_counter()
+        self.gradcam = None
+        try:
+            from gradcam import GradCAM
+            layer_cache_path = os.path.splitext(model_path)[0] + "_gradcam_layer.json"
+            self.gradcam = GradCAM(self.model, layer_cache_path=layer_cache_path)
+            self.gradcam._get_grad_fn()
+        except Exception as e:
+            print(f"⚠ Grad-CAM not available: {e}")
+        self.startup_timings["gradcam"] = time.perf_counter() - start
+        
+        # The default analysis path classifies in the Grad-CAM pass, so it is batched too
+        self.gradcam_batcher = None
+        if self.batcher is not None and self.gradcam is not None:
+            self.gradcam_batcher = MicroBatcher(self._gradcam_rows, max_batch_size, max_batch_wait_ms, name="gradcam")
+        
+        # Initialize ML models (saved next to the deep learning model)
+        start = time.perf_counter()
+        self._load_ml_models(os.path.dirname(model_path) or ".")
+        self.startup_timings["ml_models"] = time.perf_counter() - start
+
+    def _load_ml_models(self, model_dir):
+        """Load the ML ensemble trained by train_ml_models.py, if present"""
+        self.ml_ensemble = None
+        if not MLEnsemble.available(model_dir):
+            print("⚠ ML Models not available (run train_ml_models.py), using simulated scores")
+            return
         try:
-            if os.path.exists("models/svm_model.pkl"):
-                self.svm_model = joblib.load("models/svm_model.pkl")
-            if os.path.exists("models/rf_model.pkl"):
-                self.rf_model = joblib.load("models/rf_model.pkl")
-            if os.path.exists("models/lr_model.pkl"):
-                self.lr_model = joblib.load("models/lr_model.pkl")
+            self.ml_ensemble = MLEnsemble(model_dir)
+            # Cached results must not mix simulated and real ensemble scores
+            self.model_version += ":ml"
             print("✓ ML Models Loaded")
         except Exception as e:
             print(f"⚠ ML Models not available: {e}")
 
-    def predict(self, image_path):
-        """Basic prediction only"""
-        # 1. Image Preprocessing
-        img = cv2.imread(image_path)
-        if img is None:
-            return {"status": "error", "message": "Image not found"}
-            
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        img = cv2.resize(img, (224, 224))
-        img = img / 255.0
-        img = np.expand_dims(img, axis=0)
-
-        # 2. Get prediction
-        prediction_score = self.model.predict(img, verbose=0)[0][0]
+    @staticmethod
+    def _load_model(model_path, convert_model=True):
+        """
+        Load the Keras model for inference only (no optimizer state).
+        With convert_model, a native .keras copy is cached next to the .h5 and
+        used on later starts until the .h5 changes.
+        """
+        converted_path = os.path.splitext(model_path)[0] + ".keras"
+        if (convert_model and model_path != converted_path and os.path.exists(converted_path)
+                and os.path.getmtime(converted_path) >= os.path.getmtime(model_path)):
+            try:
+                return tf.keras.models.load_model(converted_path, compile=False)
+            except Exception as e:
+                print(f"⚠ Converted model unusable, reloading {model_path}: {e}")
         
-        # 3. Determine diagnosis
+        model = tf.keras.models.load_model(model_path, compile=False)
+        if convert_model and model_path != converted_path:
+            try:
+                model.save(converted_path)
+                print(f"✓ Cached converted model: {converted_path}")
+            except Exception as e:
+                print(f"⚠ Could not cache converted model: {e}")
+        return model
+
+    @staticmethod
+    def _model_version(model_path):
+        """Identifies the loaded weights; part of every result cache key"""
+        stat = os.stat(model_path)
+        return f"{os.path.basename(model_path)}:{stat.st_size}:{int(stat.st_mtime)}"
+
+    @staticmethod
+    def _prepare_input(img):
+        """BGR image -> normalized 224x224 RGB float32 model input"""
+        return ImagePreprocessor.preprocess_batch([img], mode="scaled", color="bgr")[0]
+
+    def _predict_scores(self, batch):
+        """One forward pass over an (N, 224, 224, 3) batch -> N pneumonia scores"""
+        if self.quantized is not None:
+            return self.quantized.predict_scores(batch)
+        return np.asarray(self.model.predict_on_batch(batch))[:, 0]
+
+    def _score(self, model_input):
+        """Score a single prepared input, sharing a forward pass when batching is on"""
+        if self.batcher is not None:
+            return self.batcher(model_input)
+        return self._predict_scores(np.expand_dims(model_input, axis=0))[0]
+
+    def _gradcam_rows(self, batch):
+        """generate_batch as one (score, heatmap, heatmap_colored) row per image"""
+        scores, heatmaps, heatmaps_colored = self.gradcam.generate_batch(batch)
+        if scores is None:
+            scores = [None] * len(batch)
+        return list(zip(scores, heatmaps, heatmaps_colored))
+
+    def _gradcam_with_score(self, model_input):
+        """Score + Grad-CAM for one prepared input, sharing a taped pass when batching is on"""
+        if self.gradcam_batcher is not None:
+            score, heatmap, heatmap_colored = self.gradcam_batcher(model_input)
+            return (None if score is None else float(score)), heatmap, heatmap_colored
+        return self.gradcam.generate_with_score(model_input)
+
+    def _build_prediction(self, prediction_score):
+        """Turn a raw sigmoid score into the basic prediction dict"""
         is_pneumonia = prediction_score > 0.5
         confidence = prediction_score if is_pneumonia else (1 - prediction_score)
 
@@ -59,19 +200,179 @@ class PneumoniaAI:
             "severity": self._calculate_severity(prediction_score) if is_pneumonia else "NONE"
         }
 
+    def predict(self, image_path):
+        """Basic prediction only"""
+        # 1. Image Preprocessing
+        try:
+            img, _ = self.decoder.read(image_path)
+        except ImageTooLargeError as e:
+            return {"status": "error", "message": str(e)}
+        if img is None:
+            return {"status": "error", "message": "Image not found"}
+
+        # 2. Get prediction
+        prediction_score = self._score(self._prepare_input(img))
+        
+        # 3. Determine diagnosis
+        return self._build_prediction(prediction_score)
+
+    def predict_batch(self, images, with_ensemble=False, with_heatmap=False, encoder=None):
+        """
+        Basic prediction for many decoded BGR images in one forward pass
+        Entries that are None come back as errors
+        with_ensemble adds ML ensemble scores from one feature pass per chunk
+        with_heatmap adds Grad-CAM (heatmap section + encoded heatmap / overlay artifacts)
+        from one taped pass per chunk, which also makes the diagnosis
+        """
+        valid = [i for i, img in enumerate(images) if img is not None]
+        results = [{"status": "error", "message": "Could not decode image"} for _ in images]
+        if not valid:
+            return results
+
+        for start in range(0, len(valid), self.PREDICT_CHUNK_SIZE):
+            chunk = valid[start:start + self.PREDICT_CHUNK_SIZE]
+            with span("resize"):
+                batch = ImagePreprocessor.preprocess_batch([images[i] for i in chunk], mode="scaled", color="bgr")
+            scores = heatmaps = None
+            if with_heatmap and self.gradcam is not None:
+                heatmaps = self._heatmap_batch(batch, encoder or self.artifact_encoder)
+                # A quantized backend always makes the diagnosis, as in analyze_image
+                if self.quantized is None:
+                    scores = heatmaps[0]
+            if scores is None:
+                with span("inference"):
+                    scores = self._predict_scores(batch)
+            for j, (i, score) in enumerate(zip(chunk, scores)):
+                results[i] = self._build_prediction(score)
+                if heatmaps is not None:
+                    results[i]["heatmap"], results[i]["artifacts"] = heatmaps[1][j]
+        
+        if with_ensemble and self.ml_ensemble is not None:
+            with span("ml_ensemble"):
+                ml_scores, _ = self.ml_ensemble.predict([images[i] for i in valid])
+            for i, scores in zip(valid, ml_scores):
+                ensemble_score, ensemble_diagnosis, _ = self._calculate_ensemble_prediction(scores)
+                results[i].update({
+                    "model_scores": scores,
+                    "ensemble_score": float(ensemble_score),
+                    "ensemble_diagnosis": ensemble_diagnosis,
+                })
+        return results
+
+    def _heatmap_batch(self, batch, encoder):
+        """
+        Grad-CAM for a preprocessed batch in one taped pass
+        -> (scores or None, [(heatmap section, encoded artifacts)] per image)
+        """
+        with span("gradcam"):
+            scores, heatmaps, heatmaps_colored = self.gradcam.generate_batch(batch)
+            overlays = self.gradcam.create_overlays(batch, heatmaps_colored)
+        sections = []
+        with span("encode"):
+            for heatmap, heatmap_colored, overlay in zip(heatmaps, heatmaps_colored, overlays):
+                sections.append((
+                    {"heatmap": "", "overlay": "", "intensity": float(np.mean(heatmap))},
+                    {"heatmap": encoder.encode(heatmap_colored), "overlay": encoder.encode(overlay)},
+                ))
+        return scores, sections
+
+    def predict_batch_bytes(self, contents, with_ensemble=False, with_heatmap=False, encoder=None):
+        """Decode uploaded images and score them together"""
+        images, too_large = [], {}
+        with span("decode"):
+            for i, content in enumerate(contents):
+                try:
+                    images.append(self.decode_image(content))
+                except ImageTooLargeError as e:
+                    images.append(None)
+                    too_large[i] = str(e)
+        results = self.predict_batch(images, with_ensemble, with_heatmap, encoder)
+        for i, message in too_large.items():
+            results[i] = {"status": "error", "message": message}
+        return results
+
+    @staticmethod
+    def _warmup_image(size=512):
+        """Deterministic chest-like test image (bright lung fields on a dark body)"""
+        y, x = np.mgrid[0:size, 0:size].astype(np.float32) / size
+        lungs = np.exp(-((x - 0.32) ** 2 / 0.02 + (y - 0.5) ** 2 / 0.08))
+        lungs += np.exp(-((x - 0.68) ** 2 / 0.02 + (y - 0.5) ** 2 / 0.08))
+        gray = (40 + 170 * np.clip(lungs, 0, 1)).astype(np.uint8)
+        return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
+    def warmup(self):
+        """
+        Run every inference path once so the first real request doesn't pay for
+        graph tracing, kernel selection or lazy imports.
+        Bypasses the result cache; timings are added to startup_timings.
+        """
+        img = self._warmup_image()
+        image_bytes = cv2.imencode(".png", img)[1].tobytes()
+        batch_size = max(2, self.batcher.max_batch_size if self.batcher else 2)
+        if self.quantized is not None:
+            # Every micro-batch size maps to an interpreter allocated now
+            start = time.perf_counter()
+            self.quantized.prepare(batch_size)
+            self.startup_timings["warmup_quantized"] = time.perf_counter() - start
+        
+        paths = [
+            # Decode + fused prediction/Grad-CAM + segmentation + artifact encoding
+            ("warmup_analysis", lambda: self._full_analysis_bytes(
+                image_bytes, "warmup", self.ANALYSIS_STAGES, None, self.artifact_encoder)),
+            # Plain (micro-batched) forward pass used when heatmaps are skipped
+            ("warmup_fast", lambda: self.analyze_image(img, "warmup", ())),
+            # Multi-image forward passes of /api/analyze/batch
+            ("warmup_batch", lambda: self.predict_batch([img] * batch_size)),
+        ]
+        for name, run in paths:
+            start = time.perf_counter()
+            result = run()
+            self.startup_timings[name] = time.perf_counter() - start
+            failed = [r for r in (result if isinstance(result, list) else [result]) if r["status"] != "success"]
+            if failed:
+                print(f"⚠ Warmup path {name} failed: {failed[0].get('message')}")
+        
+        self.warmed_up = True
+        total = sum(v for k, v in self.startup_timings.items() if k.startswith("warmup_"))
+        print(f"✓ Warmup complete ({total:.2f}s)")
+        return self.startup_timings
+
+    def close(self):
+        """Release background resources"""
+        if self.batcher is not None:
+            self.batcher.close()
+        if self.gradcam_batcher is not None:
+            self.gradcam_batcher.close()
+
     def _calculate_severity(self, score):
         if score > 0.85: return "SEVERE"
         if score > 0.65: return "MODERATE"
         return "MILD"
 
+    def _ml_predictions(self, img, deep_learning_result):
+        """
+        ML ensemble scores from one DenseNet feature pass over the image
+        -> (scores, "models" or "simulated", timings in ms)
+        Falls back to simulated scores when the trained models are missing.
+        """
+        if self.ml_ensemble is not None:
+            try:
+                with span("ml_ensemble"):
+                    scores, timings = self.ml_ensemble.predict([img])
+                return scores[0], "models", timings
+            except Exception as e:
+                record_error("ml_ensemble", e)
+        return self._create_dynamic_ml_predictions(deep_learning_result), "simulated", {}
+
     def _create_dynamic_ml_predictions(self, deep_learning_result):
         """Create dynamic ML predictions based on DL result"""
         raw_score = deep_learning_result["raw_score"]
         diagnosis = deep_learning_result["diagnosis"]
         
-        # Set random seed based on image for consistency
+        # Generator seeded from the image's score for consistency; a private one, since
+        # analyses run concurrently and the global seed would interleave across threads
         seed = int(raw_score * 10000)
-        np.random.seed(seed)
+        rng = np.random.default_rng(seed)
         
         if diagnosis == "PNEUMONIA":
             # ML models should agree with pneumonia diagnosis
@@ -79,24 +380,24 @@ class PneumoniaAI:
             
             # Create realistic variations
             ml_scores = {
-                "svm": float(min(0.98, base + np.random.uniform(0.05, 0.15))),
-                "rf": float(min(0.99, base + np.random.uniform(0.10, 0.20))),
-                "lr": float(min(0.97, base + np.random.uniform(0.02, 0.10))),
-                "resnet50": float(min(0.98, base + np.random.uniform(0.08, 0.18))),
-                "densenet": float(min(0.99, base + np.random.uniform(0.12, 0.22))),
-                "efficientnet": float(min(0.96, base + np.random.uniform(0.03, 0.12)))
+                "svm": float(min(0.98, base + rng.uniform(0.05, 0.15))),
+                "rf": float(min(0.99, base + rng.uniform(0.10, 0.20))),
+                "lr": float(min(0.97, base + rng.uniform(0.02, 0.10))),
+                "resnet50": float(min(0.98, base + rng.uniform(0.08, 0.18))),
+                "densenet": float(min(0.99, base + rng.uniform(0.12, 0.22))),
+                "efficientnet": float(min(0.96, base + rng.uniform(0.03, 0.12)))
             }
         else:
             # For NORMAL cases, ML models should show low pneumonia probability
             base = 1.0 - raw_score
             
             ml_scores = {
-                "svm": float(max(0.1, base - np.random.uniform(0.05, 0.15))),
-                "rf": float(max(0.15, base - np.random.uniform(0.03, 0.12))),
-                "lr": float(max(0.05, base - np.random.uniform(0.08, 0.18))),
+                "svm": float(max(0.1, base - rng.uniform(0.05, 0.15))),
+                "rf": float(max(0.15, base - rng.uniform(0.03, 0.12))),
+                "lr": float(max(0.05, base - rng.uniform(0.08, 0.18))),
                 "resnet50": float(base),
-                "densenet": float(max(0.08, base - np.random.uniform(0.04, 0.10))),
-                "efficientnet": float(max(0.03, base - np.random.uniform(0.06, 0.14)))
+                "densenet": float(max(0.08, base - rng.uniform(0.04, 0.10))),
+                "efficientnet": float(max(0.03, base - rng.uniform(0.06, 0.14)))
             }
         
         return ml_scores
@@ -115,99 +416,245 @@ class PneumoniaAI:
         
         return ensemble_score, ensemble_diagnosis, threshold
 
-    def full_analysis(self, image_path):
+    def decode_image(self, image_bytes):
+        """
+        Decode uploaded bytes to a BGR array within the decode budget (None if not an image)
+        Raises ImageTooLargeError for images over the budget
+        """
+        return self.decoder.decode(image_bytes)[0]
+
+    def _normalize_include(self, include):
+        """Requested optional stages, in pipeline order (None means all)"""
+        if include is None:
+            return self.ANALYSIS_STAGES
+        unknown = set(include) - set(self.ANALYSIS_STAGES)
+        if unknown:
+            raise ValueError(f"Unknown analysis stages: {', '.join(sorted(unknown))}")
+        return tuple(stage for stage in self.ANALYSIS_STAGES if stage in include)
+
+    def full_analysis(self, image_path, include=None, encoder=None):
         """
-        Perform complete analysis with DYNAMIC data
+        Perform complete analysis on an image file (CLI / evaluation scripts)
         """
         try:
-            print(f"🔍 Analyzing: {os.path.basename(image_path)}")
+            with open(image_path, "rb") as f:
+                image_bytes = f.read()
+        except OSError:
+            return {"status": "error", "message": "Image not found"}
+        return self._full_analysis_bytes(image_bytes, os.path.basename(image_path),
+                                         self._normalize_include(include), None, encoder)
+
+    def full_analysis_bytes(self, image_bytes, filename="upload", include=None, encoder=None):
+        """
+        Perform complete analysis on uploaded bytes, without touching disk.
+        include: optional stages to run ("heatmap", "segmentation"); None runs all.
+        encoder: ArtifactEncoder for the image artifacts (engine default if None).
+        Identical images are served from the result cache when one is configured;
+        those report a single "cached" progress stage instead of the analysis stages.
+        """
+        include = self._normalize_include(include)
+        encoder = encoder or self.artifact_encoder
+        image_key = hashlib.sha256(image_bytes).hexdigest()
+        
+        if self.result_cache is None:
+            return self._full_analysis_bytes(image_bytes, filename, include, image_key, encoder)
+        
+        key = self.result_cache.make_key(
+            image_key.encode(), self.model_version, ",".join(include), encoder.cache_token
+        )
+        computed = []
+        
+        def compute():
+            computed.append(True)
+            return self._full_analysis_bytes(image_bytes, filename, include, image_key, encoder)
+        
+        result = self.result_cache.get_or_compute(key, compute)
+        if not computed:
+            # Cache hit (or an identical in-flight request): progress listeners still get a stage
+            report_progress("cached")
+        return result
+
+    def _full_analysis_bytes(self, image_bytes, filename, include, image_key, encoder):
+        """Decode within the budget and analyse, recording decode details and peak RSS"""
+        with track_peak_rss() as memory:
+            try:
+                with span("decode"):
+                    img, decode_info = self.decoder.decode(image_bytes)
+            except ImageTooLargeError as e:
+                log.warning("📏 %s rejected: %s", filename, e)
+                return {"status": "error", "message": str(e)}
+            if img is None:
+                return {"status": "error", "message": "Could not decode image"}
+            report_progress("decode")
+            result = self.analyze_image(img, filename, include, image_key, encoder)
+        if result["status"] == "success":
+            result["decode"] = decode_info
+            result["memory"] = memory
+        return result
+
+    def _remember_context(self, image_key, context):
+        """Keep what skipped stages need, so they can be computed later"""
+        with self._contexts_lock:
+            self._contexts[image_key] = context
+            self._contexts.move_to_end(image_key)
+            while len(self._contexts) > self.context_cache_size:
+                self._contexts.popitem(last=False)
+
+    def complete_analysis(self, image_key, include, encoder=None):
+        """
+        Compute stages skipped by an earlier analysis of the same image
+        Returns the new sections and artifacts, or an error if the image is no longer cached
+        """
+        include = self._normalize_include(include)
+        encoder = encoder or self.artifact_encoder
+        with self._contexts_lock:
+            context = self._contexts.get(image_key)
+        if context is None or any(stage not in context for stage in include):
+            return {"status": "error", "message": "Image is no longer cached, please re-submit it"}
+        
+        result = {"status": "success", "artifacts": {}}
+        if "heatmap" in include:
+            _, result["heatmap"], artifacts = self._heatmap_stage(context["heatmap"], encoder)
+            result["artifacts"].update(artifacts)
+        if "segmentation" in include:
+            result["segmentation"], artifacts = self._segmentation_stage(context["segmentation"], encoder)
+            result["artifacts"].update(artifacts)
+        return result
+
+    def _heatmap_stage(self, img_normalized, encoder):
+        """
+        Prediction + Grad-CAM from a single taped forward pass
+        -> (score or None, heatmap section, encoded artifacts)
+        """
+        log.debug("🔥 Generating Grad-CAM...")
+        artifacts = {}
+        heatmap_intensity = 0.0
+        prediction_score = None
+        
+        try:
+            if self.gradcam is None:
+                raise RuntimeError("Grad-CAM not initialized")
+            with span("gradcam"):
+                prediction_score, heatmap, heatmap_colored = self._gradcam_with_score(img_normalized)
+                heatmap_overlay = None
+                if heatmap_colored is not None:
+                    heatmap_overlay = self.gradcam.create_overlay(img_normalized, heatmap_colored)
             
-            # 1. Get basic prediction
-            basic_result = self.predict(image_path)
-            if basic_result["status"] == "error":
-                return basic_result
+            if heatmap_colored is not None:
+                # Encoded once; served as files or inlined by the API
+                with span("encode"):
+                    artifacts["heatmap"] = encoder.encode(heatmap_colored)
+                    artifacts["overlay"] = encoder.encode(heatmap_overlay)
+                
+                heatmap_intensity = float(np.mean(heatmap))
+        except Exception as e:
+            record_error("gradcam", e)
+        
+        return prediction_score, {
+            "heatmap": "",
+            "overlay": "",
+            "intensity": heatmap_intensity
+        }, artifacts
+
+    def _segmentation_stage(self, img_gray, encoder):
+        """Lung segmentation -> (mask + metrics section, encoded artifacts)"""
+        log.debug("🫁 Generating lung segmentation...")
+        artifacts = {}
+        metrics = {}
+        
+        try:
+            from lung_segmentation import LungSegmentation
+            with span("segmentation"):
+                mask, contours, seg_metrics = LungSegmentation.segment_lungs(
+                    img_gray, self.segmentation_size, as_float=False
+                )
             
-            print(f"✓ DL Prediction: {basic_result['diagnosis']} ({basic_result['confidence']}%)")
+            if mask is not None:
+                with span("encode"):
+                    artifacts["mask"] = encoder.encode(mask)
+                metrics = seg_metrics
+        except Exception as e:
+            record_error("segmentation", e)
+            # Default metrics
+            metrics = {
+                "coverage_percentage": 75.0,
+                "num_lungs_detected": 2,
+                "contrast": 0.5,
+                "lung_intensity": 150,
+                "background_intensity": 50,
+                "lung_pixels": 30000
+            }
+        
+        return {
+            "mask": "",
+            "metrics": metrics
+        }, artifacts
+
+    def analyze_image(self, img, name="image", include=None, image_key=None, encoder=None):
+        """
+        Perform complete analysis with DYNAMIC data on a decoded BGR image.
+        Stages left out of `include` are skipped; with an image_key they can be
+        computed later through complete_analysis.
+        Image artifacts come back encoded under "artifacts" (name -> data, content_type, etag).
+        """
+        try:
+            include = self._normalize_include(include)
+            encoder = encoder or self.artifact_encoder
+            artifacts = {}
+            log.debug("🔍 Analyzing: %s", name)
             
-            # 2. Load image
-            img = cv2.imread(image_path)
-            if img is None:
-                return {"status": "error", "message": "Image not found"}
-                
-            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            img_resized = cv2.resize(img_rgb, (224, 224))
-            img_normalized = img_resized / 255.0
-            img_batch = np.expand_dims(img_normalized, axis=0)
+            # 1. Decoded image is shared by every stage
+            with span("resize"):
+                img_normalized = self._prepare_input(img)
+                img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
             
-            # 3. Generate Grad-CAM
-            print("🔥 Generating Grad-CAM...")
-            heatmap_base64 = ""
-            overlay_base64 = ""
-            heatmap_intensity = 0.0
+            # 2. Prediction + Grad-CAM from a single taped forward pass
+            prediction_score = None
+            heatmap_section = {"heatmap": "", "overlay": "", "intensity": 0.0, "skipped": True}
+            if "heatmap" in include:
+                prediction_score, heatmap_section, stage_artifacts = self._heatmap_stage(img_normalized, encoder)
+                artifacts.update(stage_artifacts)
+                report_progress("heatmap")
             
-            try:
-                from gradcam import GradCAM
-                gradcam = GradCAM(self.model)
-                heatmap, heatmap_colored = gradcam.generate(img_batch)
-                
-                if heatmap_colored is not None:
-                    heatmap_overlay = gradcam.create_overlay(img_normalized, heatmap_colored)
-                    
-                    # Convert to base64
-                    _, heatmap_buffer = cv2.imencode('.png', heatmap_colored)
-                    heatmap_base64 = base64.b64encode(heatmap_buffer).decode('utf-8')
-                    
-                    _, overlay_buffer = cv2.imencode('.png', heatmap_overlay)
-                    overlay_base64 = base64.b64encode(overlay_buffer).decode('utf-8')
-                    
-                    heatmap_intensity = float(np.mean(heatmap))
-            except Exception as e:
-                print(f"⚠ Grad-CAM failed: {e}")
+            # 3. Diagnosis from the same pass (plain, micro-batched forward pass otherwise;
+            #    a quantized backend always makes the diagnosis so results match fast mode)
+            if prediction_score is None or self.quantized is not None:
+                with span("inference"):
+                    prediction_score = self._score(img_normalized)
+            basic_result = self._build_prediction(prediction_score)
+            report_progress("inference")
             
             # 4. Generate lung segmentation
-            print("🫁 Generating lung segmentation...")
-            mask_base64 = ""
-            metrics = {}
+            segmentation_section = {"mask": "", "metrics": {}, "skipped": True}
+            if "segmentation" in include:
+                segmentation_section, stage_artifacts = self._segmentation_stage(img_gray, encoder)
+                artifacts.update(stage_artifacts)
+                report_progress("segmentation")
             
-            try:
-                from lung_segmentation import LungSegmentation
-                img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-                mask, contours, seg_metrics = LungSegmentation.segment_lungs(img_gray)
-                
-                if mask is not None:
-                    mask_uint8 = (mask * 255).astype(np.uint8)
-                    _, mask_buffer = cv2.imencode('.png', mask_uint8)
-                    mask_base64 = base64.b64encode(mask_buffer).decode('utf-8')
-                    metrics = seg_metrics
-            except Exception as e:
-                print(f"⚠ Segmentation failed: {e}")
-                # Default metrics
-                metrics = {
-                    "coverage_percentage": 75.0,
-                    "num_lungs_detected": 2,
-                    "contrast": 0.5,
-                    "lung_intensity": 150,
-                    "background_intensity": 50,
-                    "lung_pixels": 30000
-                }
+            # Keep inputs for skipped stages so they can be filled in on demand
+            if image_key is not None and len(include) < len(self.ANALYSIS_STAGES):
+                context = {}
+                if "heatmap" not in include:
+                    context["heatmap"] = img_normalized
+                if "segmentation" not in include:
+                    context["segmentation"] = img_gray
+                self._remember_context(image_key, context)
             
-            # 5. Create DYNAMIC ML predictions
-            print("🤖 Creating ML predictions...")
-            ml_scores = self._create_dynamic_ml_predictions(basic_result)
+            # 5. ML ensemble on DenseNet features (simulated if models are missing)
+            ml_scores, ml_source, ml_timings = self._ml_predictions(img, basic_result)
             
             # 6. Calculate ensemble prediction
-            print("🧮 Calculating ensemble...")
             ensemble_score, ensemble_diagnosis, threshold = self._calculate_ensemble_prediction(ml_scores)
+            report_progress("ensemble")
             
-            # 7. Debug output
-            print(f"\n📊 ANALYSIS SUMMARY:")
-            print(f"   Deep Learning: {basic_result['diagnosis']} ({basic_result['confidence']}%)")
-            print(f"   SVM: {ml_scores['svm']*100:.1f}%")
-            print(f"   Random Forest: {ml_scores['rf']*100:.1f}%")
-            print(f"   Logistic Regression: {ml_scores['lr']*100:.1f}%")
-            print(f"   Ensemble: {ensemble_diagnosis} ({ensemble_score*100:.1f}%)")
-            print(f"   Threshold: {threshold*100:.0f}%")
-            print("✅ Analysis complete!\n")
+            # 7. Debug output (arguments are only formatted when debug logging is on)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug(
+                    "📊 %s: DL %s (%s%%), SVM %.1f%%, RF %.1f%%, LR %.1f%% [%s], ensemble %s (%.1f%%), threshold %.0f%%",
+                    name, basic_result["diagnosis"], basic_result["confidence"], ml_scores["svm"] * 100,
+                    ml_scores["rf"] * 100, ml_scores["lr"] * 100, ml_source, ensemble_diagnosis,
+                    ensemble_score * 100, threshold * 100
+                )
             
             # 8. Build response
             return {
@@ -222,16 +669,14 @@ class PneumoniaAI:
                 ],
                 "recommendations": self._generate_recommendations(basic_result),
                 "risk_level": "HIGH" if basic_result["diagnosis"] == "PNEUMONIA" else "LOW",
-                "heatmap": {
-                    "heatmap": f"data:image/png;base64,{heatmap_base64}" if heatmap_base64 else "",
-                    "overlay": f"data:image/png;base64,{overlay_base64}" if overlay_base64 else "",
-                    "intensity": heatmap_intensity
-                },
-                "segmentation": {
-                    "mask": f"data:image/png;base64,{mask_base64}" if mask_base64 else "",
-                    "metrics": metrics
-                },
+                "heatmap": heatmap_section,
+                "segmentation": segmentation_section,
+                "artifacts": artifacts,
+                "included": list(include),
+                "image_key": image_key,
                 "model_scores": ml_scores,
+                "ml_source": ml_source,
+                "ml_timings_ms": ml_timings,
                 "ensemble_score": float(ensemble_score),
                 "ensemble_diagnosis": ensemble_diagnosis,
                 "threshold_used": float(threshold),
@@ -240,9 +685,8 @@ class PneumoniaAI:
             }
             
         except Exception as e:
-            print(f"❌ Error in full_analysis: {e}")
-            import traceback
-            traceback.print_exc()
+            ERRORS.inc(stage="analysis")
+            log.exception("❌ Error in full_analysis: %s", e)
             return {
                 "status": "error",
                 "message": f"Analysis failed: {str(e)}"
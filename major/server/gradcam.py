@@ -1,22 +1,108 @@
 import numpy as np
 import cv2
 import tensorflow as tf
+import json
+import logging
+import os
+import threading
+from functools import lru_cache
 from typing import Tuple, List, Optional
 import matplotlib.pyplot as plt
+from telemetry import log, record_error
+
+logger = log.getChild(__name__)  # pneumonia.gradcam, so it shares the request-id handler
+
+
+@lru_cache(maxsize=8)
+def _coordinate_axes(h: int, w: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Row and column coordinates for an (h, w) grid"""
+    return np.arange(h, dtype=np.float64), np.arange(w, dtype=np.float64)
+
+
+@lru_cache(maxsize=8)
+def _simulated_heatmap_template(shape: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Lung-shaped fallback heatmap and its colormap, computed once per output shape.
+    Treat the returned arrays as read-only.
+    """
+    h, w = shape
+    ys, xs = _coordinate_axes(h, w)
+    yy, xx = ys[:, np.newaxis], xs[np.newaxis, :]
+    
+    # Lung-like regions
+    heatmap = np.zeros((h, w), dtype=np.float32)
+    center_y, center_x = h // 2, w // 2
+    radius_y, radius_x = h // 3, w // 4
+    
+    # Left lung first, right lung drawn over it
+    for lung_x in (center_x - w//6, center_x + w//6):
+        inside_box = (np.abs(xx - lung_x) < radius_x) & (np.abs(yy - center_y) < radius_y)
+        dist = np.sqrt(((xx - lung_x) / radius_x)**2 + ((yy - center_y) / radius_y)**2)
+        inside = inside_box & (dist < 1)
+        heatmap[inside] = (0.5 + 0.5 * (1 - dist))[inside]
+    
+    # Add some texture
+    heatmap = cv2.GaussianBlur(heatmap, (31, 31), 0)
+    
+    # Normalize
+    if heatmap.max() > 0:
+        heatmap = heatmap / heatmap.max()
+    
+    heatmap_colored = cv2.applyColorMap(np.uint8(255 * heatmap), cv2.COLORMAP_JET)
+    heatmap.setflags(write=False)
+    heatmap_colored.setflags(write=False)
+    return heatmap, heatmap_colored
 
 
 class GradCAM:
     """Working Grad-CAM that actually produces visible heatmaps"""
     
-    def __init__(self, model, target_layer_name: str = None):
+    def __init__(self, model, target_layer_name: str = None, layer_cache_path: str = None):
         """
-        Initialize with a working model
+        Initialize with a working model.
+        layer_cache_path: JSON file remembering the chosen layer, so restarts skip the scan
         """
         self.model = model
-        self.target_layer_name = target_layer_name or self._find_best_layer()
+        self.layer_cache_path = layer_cache_path
+        self._grad_fns = {}
+        self._grad_fns_lock = threading.Lock()
+        
+        self.target_layer_name = (target_layer_name or self._load_cached_layer()
+                                  or self._find_best_layer())
+        self._save_cached_layer()
         
         print(f"Grad-CAM initialized for layer: {self.target_layer_name}")
     
+    def _model_fingerprint(self) -> str:
+        """Cheap identity of the model architecture, to validate the layer cache"""
+        return f"{self.model.name}:{len(self.model.layers)}:{self.model.count_params()}"
+    
+    def _load_cached_layer(self) -> Optional[str]:
+        """Layer chosen by a previous run for this same model, if any"""
+        if not self.layer_cache_path or not os.path.exists(self.layer_cache_path):
+            return None
+        try:
+            with open(self.layer_cache_path) as f:
+                cached = json.load(f)
+            if cached.get("fingerprint") != self._model_fingerprint():
+                return None
+            layer_name = cached.get("layer")
+            self.model.get_layer(layer_name)
+            return layer_name
+        except Exception as e:
+            logger.warning("⚠ Ignoring Grad-CAM layer cache: %s", e)
+            return None
+    
+    def _save_cached_layer(self):
+        if not self.layer_cache_path:
+            return
+        try:
+            with open(self.layer_cache_path, "w") as f:
+                json.dump({"fingerprint": self._model_fingerprint(),
+                           "layer": self.target_layer_name}, f)
+        except OSError as e:
+            logger.warning("⚠ Could not persist Grad-CAM layer: %s", e)
+    
     def _find_best_layer(self):
         """Find a good convolutional layer for Grad-CAM"""
         # Try common ResNet layers first
@@ -40,10 +126,10 @@ class GradCAM:
         
         return self.model.layers[-2].name  # Second last layer
     
-    def _build_grad_model(self):
+    def _build_grad_model(self, layer_name: str = None):
         """Build model for gradient computation"""
         try:
-            target_layer = self.model.get_layer(self.target_layer_name)
+            target_layer = self.model.get_layer(layer_name or self.target_layer_name)
         except:
             # Find any convolutional layer
             for layer in self.model.layers:
@@ -58,124 +144,135 @@ class GradCAM:
             outputs=[target_layer.output, self.model.output]
         )
     
+    def _get_grad_fn(self, layer_name: str = None):
+        """
+        Compiled (predictions, heatmaps) function for a layer, built once and cached.
+        The fixed input signature means it is traced once, whatever the batch size.
+        """
+        layer_name = layer_name or self.target_layer_name
+        grad_fn = self._grad_fns.get(layer_name)
+        if grad_fn is not None:
+            return grad_fn
+        
+        with self._grad_fns_lock:
+            if layer_name in self._grad_fns:
+                return self._grad_fns[layer_name]
+            
+            grad_model = self._build_grad_model(layer_name)
+            input_shape = [None] + list(self.model.input_shape[1:])
+            
+            @tf.function(input_signature=[tf.TensorSpec(input_shape, tf.float32)])
+            def grad_fn(images):
+                with tf.GradientTape() as tape:
+                    conv_outputs, predictions = grad_model(images, training=False)
+                    # Pneumonia probability (sigmoid output)
+                    loss = predictions[:, 0]
+                
+                grads = tape.gradient(loss, conv_outputs)
+                if grads is None:
+                    raise ValueError("Gradients are None")
+                
+                # Pool gradients per image and weight the feature maps
+                pooled_grads = tf.reduce_mean(grads, axis=(1, 2))
+                heatmaps = tf.reduce_sum(conv_outputs * pooled_grads[:, tf.newaxis, tf.newaxis, :], axis=-1)
+                
+                # ReLU + per-image normalization
+                heatmaps = tf.maximum(heatmaps, 0)
+                heatmap_max = tf.reduce_max(heatmaps, axis=(1, 2), keepdims=True)
+                heatmaps = tf.math.divide_no_nan(heatmaps, heatmap_max)
+                
+                return predictions, heatmaps
+            
+            self._grad_fns[layer_name] = grad_fn
+            return grad_fn
+    
     def generate(self, image: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
         """
         Generate ACTUAL visible Grad-CAM heatmap
         """
+        _, heatmap, heatmap_colored = self.generate_with_score(image)
+        return heatmap, heatmap_colored
+    
+    def generate_with_score(self, image: np.ndarray,
+                            rng: Optional[np.random.Generator] = None) -> Tuple[Optional[float], np.ndarray, np.ndarray]:
+        """
+        Prediction score and Grad-CAM heatmap from ONE taped forward pass.
+        The score is None if the forward pass itself failed.
+        rng: generator for the simulated activations added to weak heatmaps
+        """
         # Ensure image is properly formatted
         if len(image.shape) == 4:
             image = image[0]
         
-        image_batch = np.expand_dims(image, axis=0)
+        log.debug("Generating Grad-CAM for image shape: %s", image.shape)
+        scores, heatmaps, heatmaps_colored = self.generate_batch(image[np.newaxis], rng)
+        heatmap = heatmaps[0]
         
-        print(f"Generating Grad-CAM for image shape: {image.shape}")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Generated heatmap: min=%.3f, max=%.3f, mean=%.3f", heatmap.min(), heatmap.max(), heatmap.mean())
+        
+        return (None if scores is None else float(scores[0])), heatmap, heatmaps_colored[0]
+    
+    def generate_batch(self, images: np.ndarray,
+                       rng: Optional[np.random.Generator] = None) -> Tuple[Optional[np.ndarray], np.ndarray, np.ndarray]:
+        """
+        Scores and Grad-CAM heatmaps for N same-sized images (N, H, W, C) from one
+        taped forward and backward pass; gradients, pooled weights and normalization
+        are per image. Heatmaps are resized and colormapped in bulk.
+        rng: generator for the simulated activations added to weak heatmaps
+        -> (scores (N,) or None if the pass failed, heatmaps (N, H, W), colored (N, H, W, 3))
+        """
+        images = np.asarray(images, dtype=np.float32)
+        n, h, w = images.shape[:3]
         
         try:
-            # Build gradient model
-            grad_model = self._build_grad_model()
-            
-            # Get gradients
-            with tf.GradientTape() as tape:
-                tape.watch(image_batch)
-                conv_outputs, predictions = grad_model(image_batch)
-                
-                # For pneumonia detection (sigmoid output)
-                # We want to visualize what contributes to pneumonia probability
-                loss = predictions[:, 0]  # Pneumonia probability
-            
-            grads = tape.gradient(loss, conv_outputs)
-            
-            if grads is None:
-                print("WARNING: Gradients are None, using fallback")
-                return self._create_simulated_heatmap(image.shape[:2])
-            
-            # Pool gradients
-            pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2))
-            
-            # Weight feature maps
-            conv_output = conv_outputs[0]
-            heatmap = tf.reduce_sum(conv_output * pooled_grads, axis=-1)
-            
-            # Apply ReLU
-            heatmap = tf.maximum(heatmap, 0)
-            
-            # Normalize
-            heatmap_max = tf.reduce_max(heatmap)
-            if heatmap_max > 0:
-                heatmap = heatmap / heatmap_max
-            
-            heatmap = heatmap.numpy()
-            
+            predictions, heatmaps = self._get_grad_fn()(images)
+            scores = predictions.numpy()[:, 0]
+            heatmaps = heatmaps.numpy()
         except Exception as e:
-            print(f"Grad-CAM error: {e}")
-            return self._create_simulated_heatmap(image.shape[:2])
+            record_error("gradcam", e)
+            heatmap, heatmap_colored = _simulated_heatmap_template((h, w))
+            return None, np.repeat(heatmap[np.newaxis], n, axis=0), np.repeat(heatmap_colored[np.newaxis], n, axis=0)
         
-        # Resize to original image size
-        heatmap = cv2.resize(heatmap, (image.shape[1], image.shape[0]))
+        # Resize to the input size: heatmaps as channels of one image (cv2 takes up to 512)
+        resized = np.empty((n, h, w), dtype=np.float32)
+        for start in range(0, n, 512):
+            chunk = np.ascontiguousarray(heatmaps[start:start + 512].transpose(1, 2, 0))
+            out = cv2.resize(chunk, (w, h))
+            resized[start:start + 512] = out.reshape(h, w, -1).transpose(2, 0, 1)
         
-        # Ensure heatmap has values (not all zeros)
-        if np.max(heatmap) < 0.1:
-            print("WARNING: Heatmap is mostly zero, adding simulated activation")
-            heatmap = self._enhance_heatmap(heatmap)
-        
-        # Apply colormap
-        heatmap_uint8 = np.uint8(255 * heatmap)
-        heatmap_colored = cv2.applyColorMap(heatmap_uint8, cv2.COLORMAP_JET)
+        # Ensure heatmaps have values (not all zeros)
+        for i in np.flatnonzero(resized.reshape(n, -1).max(axis=1) < 0.1):
+            log.debug("Heatmap %d is mostly zero, adding simulated activation", i)
+            resized[i] = self._enhance_heatmap(resized[i], rng)
         
-        print(f"Generated heatmap: min={heatmap.min():.3f}, max={heatmap.max():.3f}, mean={heatmap.mean():.3f}")
+        # Apply colormap once over the stacked heatmaps
+        heatmaps_uint8 = np.uint8(255 * resized)
+        colored = cv2.applyColorMap(heatmaps_uint8.reshape(n * h, w), cv2.COLORMAP_JET).reshape(n, h, w, 3)
         
-        return heatmap, heatmap_colored
+        return scores, resized, colored
     
     def _create_simulated_heatmap(self, shape):
         """Create a simulated heatmap when Grad-CAM fails"""
-        h, w = shape
-        
-        # Create a centered heatmap (lung area simulation)
-        heatmap = np.zeros((h, w), dtype=np.float32)
-        
-        # Lung-like regions
-        center_y, center_x = h // 2, w // 2
-        radius_y, radius_x = h // 3, w // 4
-        
-        for y in range(h):
-            for x in range(w):
-                # Left lung
-                if abs(x - center_x + w//6) < radius_x and abs(y - center_y) < radius_y:
-                    dist = np.sqrt(((x - (center_x - w//6)) / radius_x)**2 + 
-                                   ((y - center_y) / radius_y)**2)
-                    if dist < 1:
-                        heatmap[y, x] = 0.5 + 0.5 * (1 - dist)
-                
-                # Right lung
-                if abs(x - center_x - w//6) < radius_x and abs(y - center_y) < radius_y:
-                    dist = np.sqrt(((x - (center_x + w//6)) / radius_x)**2 + 
-                                   ((y - center_y) / radius_y)**2)
-                    if dist < 1:
-                        heatmap[y, x] = 0.5 + 0.5 * (1 - dist)
-        
-        # Add some texture
-        heatmap = cv2.GaussianBlur(heatmap, (31, 31), 0)
-        
-        # Normalize
-        if heatmap.max() > 0:
-            heatmap = heatmap / heatmap.max()
-        
-        return heatmap, cv2.applyColorMap(np.uint8(255 * heatmap), cv2.COLORMAP_JET)
+        heatmap, heatmap_colored = _simulated_heatmap_template(tuple(shape))
+        return heatmap.copy(), heatmap_colored.copy()
     
-    def _enhance_heatmap(self, heatmap):
-        """Enhance a weak heatmap"""
+    def _enhance_heatmap(self, heatmap, rng: Optional[np.random.Generator] = None):
+        """Enhance a weak heatmap (own generator by default: analyses run on several threads)"""
         if np.max(heatmap) < 0.1:
-            # Add simulated activations
+            rng = rng or np.random.default_rng()
+            # Add simulated activations as separable Gaussian blobs
             h, w = heatmap.shape
+            ys, xs = _coordinate_axes(h, w)
             for i in range(5):
-                x = np.random.randint(w//4, 3*w//4)
-                y = np.random.randint(h//4, 3*h//4)
-                size = np.random.randint(10, 30)
+                x = rng.integers(w//4, 3*w//4)
+                y = rng.integers(h//4, 3*h//4)
+                size = rng.integers(10, 30)
                 
-                # Add Gaussian blob
-                xx, yy = np.meshgrid(np.arange(w), np.arange(h))
-                dist = np.sqrt((xx - x)**2 + (yy - y)**2)
-                heatmap += 0.3 * np.exp(-dist**2 / (2 * (size/2)**2))
+                # exp(-d^2 / 2s^2) factors into a column and a row profile
+                denom = 2 * (size/2)**2
+                heatmap += 0.3 * np.outer(np.exp(-(ys - y)**2 / denom),
+                                          np.exp(-(xs - x)**2 / denom))
         
         # Clip and normalize
         heatmap = np.clip(heatmap, 0, 1)
@@ -209,6 +306,20 @@ class GradCAM:
                                  heatmap_colored, alpha, 0)
         
         return overlay
+    
+    def create_overlays(self, originals: np.ndarray, heatmaps_colored: np.ndarray,
+                        alpha: float = 0.5) -> np.ndarray:
+        """create_overlay for N same-sized images (N, H, W, 3) in one blend"""
+        originals = np.asarray(originals)
+        if originals.max() <= 1.0:
+            originals_uint8 = (originals * 255).astype(np.uint8)
+        else:
+            originals_uint8 = originals.astype(np.uint8)
+        
+        n, h, w = originals_uint8.shape[:3]
+        overlays = cv2.addWeighted(originals_uint8.reshape(n * h, w, 3), 1 - alpha,
+                                   np.ascontiguousarray(heatmaps_colored).reshape(n * h, w, 3), alpha, 0)
+        return overlays.reshape(n, h, w, 3)
 
 
 class MultiLayerActivationVisualizer:
@@ -217,57 +328,91 @@ class MultiLayerActivationVisualizer:
     def __init__(self, model, layer_names: List[str] = None):
         self.model = model
         self.layer_names = layer_names or ['conv2_block3_out', 'conv3_block4_out', 'conv4_block6_out']
-        self.activation_models = {}
+        self.activation_model = None
+        self.layer_shapes = {}
         
-        self._build_activation_models()
+        self._build_activation_model()
     
-    def _build_activation_models(self):
-        """Build models for extracting activations"""
+    def _build_activation_model(self):
+        """
+        One multi-output model for every available layer, so the shared backbone
+        runs once, and a compiled function that reduces channels in-graph.
+        The fixed input signature means it is traced once, whatever the batch size.
+        """
+        outputs = []
         for layer_name in self.layer_names:
             try:
-                layer = self.model.get_layer(layer_name)
-                activation_model = tf.keras.models.Model(
-                    inputs=self.model.inputs,
-                    outputs=layer.output
-                )
-                self.activation_models[layer_name] = activation_model
-            except:
-                print(f"Could not access layer: {layer_name}")
+                output = self.model.get_layer(layer_name).output
+            except Exception:
+                log.warning("Could not access layer: %s", layer_name)
                 continue
+            self.layer_shapes[layer_name] = tuple(output.shape[1:])
+            outputs.append(output)
+        
+        if not outputs:
+            return
+        
+        self.activation_model = tf.keras.models.Model(inputs=self.model.inputs, outputs=outputs)
+        activation_model = self.activation_model
+        input_shape = [None] + list(self.model.input_shape[1:])
+        
+        @tf.function(input_signature=[tf.TensorSpec(input_shape, tf.float32)])
+        def activation_fn(images):
+            activations = activation_model(images, training=False)
+            if not isinstance(activations, (list, tuple)):
+                activations = [activations]
+            
+            maps = []
+            for activation in activations:
+                # Mean across channels, then per-image min-max normalization (flat maps stay as-is)
+                if len(activation.shape) == 4:
+                    activation = tf.reduce_mean(activation, axis=-1)
+                axes = list(range(1, len(activation.shape)))
+                min_val = tf.reduce_min(activation, axis=axes, keepdims=True)
+                value_range = tf.reduce_max(activation, axis=axes, keepdims=True) - min_val
+                maps.append(tf.where(value_range > 0,
+                                     tf.math.divide_no_nan(activation - min_val, value_range),
+                                     activation))
+            return maps
+        
+        self._activation_fn = activation_fn
+    
+    def _empty_activations(self) -> dict:
+        return {
+            layer_name: {
+                "mean_activation": np.zeros((10, 10)),
+                "shape": [1, 1, 1],
+                "num_features": 1,
+            }
+            for layer_name in self.layer_shapes
+        }
     
     def visualize(self, image: np.ndarray) -> dict:
         """Extract and visualize layer activations"""
-        image_batch = np.expand_dims(image, axis=0)
+        if len(image.shape) == 4:
+            image = image[0]
+        return self.visualize_batch(np.expand_dims(image, axis=0))[0]
+    
+    def visualize_batch(self, images: np.ndarray) -> List[dict]:
+        """Activations of every layer for a batch of images, from one forward pass"""
+        images = np.asarray(images, dtype=np.float32)
+        if self.activation_model is None:
+            return [{} for _ in range(len(images))]
         
-        activations = {}
-        for layer_name, activation_model in self.activation_models.items():
-            try:
-                activation = activation_model.predict(image_batch, verbose=0)
-                
-                # Process activation
-                if len(activation.shape) == 4:
-                    # Take mean across channels and batch
-                    mean_activation = np.mean(activation[0], axis=-1)
-                else:
-                    mean_activation = activation[0]
-                
-                # Normalize
-                min_val, max_val = mean_activation.min(), mean_activation.max()
-                if max_val - min_val > 0:
-                    mean_activation = (mean_activation - min_val) / (max_val - min_val)
-                
-                activations[layer_name] = {
-                    "mean_activation": mean_activation,
-                    "shape": activation.shape,
-                    "num_features": activation.shape[-1] if len(activation.shape) == 4 else 1,
-                }
-                
-            except Exception as e:
-                print(f"Error visualizing {layer_name}: {e}")
+        try:
+            maps = [m.numpy() for m in self._activation_fn(images)]
+        except Exception as e:
+            record_error("activations", e)
+            return [self._empty_activations() for _ in range(len(images))]
+        
+        results = []
+        for i in range(len(images)):
+            activations = {}
+            for (layer_name, shape), layer_maps in zip(self.layer_shapes.items(), maps):
                 activations[layer_name] = {
-                    "mean_activation": np.zeros((10, 10)),
-                    "shape": [1, 1, 1],
-                    "num_features": 1,
+                    "mean_activation": layer_maps[i],
+                    "shape": (1,) + shape,
+                    "num_features": shape[-1] if len(shape) == 3 else 1,
                 }
-        
-        return activations
\ No newline at end of file
+            results.append(activations)
+        return results
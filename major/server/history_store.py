@@ -0,0 +1,241 @@
+import base64
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Optional, Tuple, List
+
+from artifacts import artifact_extension
+
+# Ids main.py generates (older records have no random suffix)
+ANALYSIS_ID_PATTERN = re.compile(r"res_\d{14}(_[0-9a-f]{6})?")
+
+
+class HistoryStore:
+    """
+    Persistent analysis history.
+    Records live in SQLite (indexed by id, date and diagnosis); large image
+    artifacts (heatmap, overlay, mask) are written out-of-line as files and
+    only referenced from the record.
+    Old records are evicted by age and by total size.
+    """
+
+    def __init__(self, root_dir: str = "history", max_age_days: float = 30,
+                 max_bytes: int = 1024 * 1024 * 1024):
+        self.root_dir = root_dir
+        self.artifact_dir = os.path.join(root_dir, "artifacts")
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        os.makedirs(self.artifact_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(root_dir, "history.db"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS analyses (
+                id TEXT PRIMARY KEY,
+                created_at TEXT NOT NULL,
+                diagnosis TEXT,
+                confidence REAL,
+                filename TEXT,
+                size_bytes INTEGER NOT NULL,
+                record TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_analyses_created ON analyses (created_at, id);
+            CREATE INDEX IF NOT EXISTS idx_analyses_diagnosis ON analyses (diagnosis, created_at, id);
+        """)
+        self._conn.commit()
+        # Running total of size_bytes, kept in step with every insert and delete so
+        # retention does not have to sum the whole table on each save
+        self._total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(size_bytes), 0) FROM analyses").fetchone()[0]
+
+    # ---------- artifacts ----------
+
+    def _analysis_dir(self, analysis_id: str) -> Optional[str]:
+        """Artifact directory of an analysis, or None if the id could escape artifact_dir"""
+        if not isinstance(analysis_id, str) or not ANALYSIS_ID_PATTERN.fullmatch(analysis_id):
+            return None
+        return self._contained(os.path.join(self.artifact_dir, analysis_id))
+
+    def _contained(self, path: str) -> Optional[str]:
+        root = os.path.realpath(self.artifact_dir)
+        return path if os.path.realpath(path).startswith(root + os.sep) else None
+
+    def _artifact_path(self, analysis_id: str, name: str, content_type: str) -> Optional[str]:
+        analysis_dir = self._analysis_dir(analysis_id)
+        if analysis_dir is None:
+            return None
+        return self._contained(os.path.join(analysis_dir, f"{name}{artifact_extension(content_type)}"))
+
+    def _remove_artifacts(self, analysis_id: str):
+        analysis_dir = self._analysis_dir(analysis_id)
+        if analysis_dir is not None:
+            shutil.rmtree(analysis_dir, ignore_errors=True)
+
+    def _write_artifacts(self, analysis_id: str, artifacts: dict) -> dict:
+        """Write encoded artifacts to disk; returns their metadata"""
+        written = {}
+        for name, artifact in artifacts.items():
+            path = self._artifact_path(analysis_id, name, artifact["content_type"])
+            if path is None:
+                raise ValueError(f"Invalid artifact {name!r} for analysis {analysis_id!r}")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(artifact["data"])
+            written[name] = {
+                "content_type": artifact["content_type"],
+                "etag": artifact["etag"],
+                "size": len(artifact["data"]),
+            }
+        return written
+
+    def read_artifact(self, analysis_id: str, name: str) -> Optional[Tuple[bytes, dict]]:
+        """Artifact bytes and metadata (content_type, etag, size), or None"""
+        if self._analysis_dir(analysis_id) is None:
+            return None
+        record = self.get(analysis_id)
+        meta = (record or {}).get("artifacts", {}).get(name)
+        if meta is None:
+            return None
+        path = self._artifact_path(analysis_id, name, meta["content_type"])
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read(), meta
+        except OSError:
+            return None
+
+    # ---------- records ----------
+
+    def save(self, record: dict, artifacts: dict = None):
+        """
+        Store an analysis record; artifacts (name -> data, content_type, etag)
+        are written out-of-line and listed under record["artifacts"]
+        """
+        analysis_id = record["id"]
+        record = dict(record)
+        record["artifacts"] = {**record.get("artifacts", {}),
+                               **self._write_artifacts(analysis_id, artifacts or {})}
+        artifact_bytes = sum(meta["size"] for meta in record["artifacts"].values())
+        payload = json.dumps(record)
+        analysis = record.get("analysis", {})
+
+        size_bytes = len(payload) + artifact_bytes
+
+        with self._lock:
+            replaced = self._conn.execute(
+                "SELECT size_bytes FROM analyses WHERE id = ?", (analysis_id,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analyses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (analysis_id, record.get("timestamp") or datetime.now().isoformat(),
+                 analysis.get("diagnosis"), analysis.get("confidence"), record.get("filename"),
+                 size_bytes, payload)
+            )
+            self._conn.commit()
+            self._total_bytes += size_bytes - (replaced[0] if replaced else 0)
+        self.enforce_retention()
+
+    def get(self, analysis_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT record FROM analyses WHERE id = ?", (analysis_id,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def delete(self, analysis_id: str) -> bool:
+        if self._analysis_dir(analysis_id) is None:
+            return False
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size_bytes FROM analyses WHERE id = ?", (analysis_id,)).fetchone()
+            if row is None:
+                return False
+            self._conn.execute("DELETE FROM analyses WHERE id = ?", (analysis_id,))
+            self._conn.commit()
+            self._total_bytes -= row[0]
+        self._remove_artifacts(analysis_id)
+        return True
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+
+    @staticmethod
+    def _encode_cursor(created_at: str, analysis_id: str) -> str:
+        return base64.urlsafe_b64encode(f"{created_at}|{analysis_id}".encode()).decode()
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> Tuple[str, str]:
+        created_at, analysis_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return created_at, analysis_id
+
+    def list_records(self, limit: int = 10, cursor: str = None, diagnosis: str = None,
+                     since: str = None, until: str = None) -> Tuple[List[dict], Optional[str]]:
+        """
+        Newest-first page of record summaries and the cursor for the next page.
+        since/until are ISO dates or timestamps; cursor comes from a previous call.
+        """
+        clauses, params = [], []
+        if diagnosis:
+            clauses.append("diagnosis = ?")
+            params.append(diagnosis.upper())
+        if since:
+            clauses.append("created_at >= ?")
+            params.append(since)
+        if until:
+            clauses.append("created_at < ?")
+            params.append(until)
+        if cursor:
+            created_at, analysis_id = self._decode_cursor(cursor)
+            clauses.append("(created_at < ? OR (created_at = ? AND id < ?))")
+            params.extend([created_at, created_at, analysis_id])
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        query = (f"SELECT id, created_at, diagnosis, confidence, filename FROM analyses {where} "
+                 f"ORDER BY created_at DESC, id DESC LIMIT ?")
+
+        with self._lock:
+            rows = self._conn.execute(query, params + [limit + 1]).fetchall()
+
+        items = [
+            {"id": r[0], "timestamp": r[1], "diagnosis": r[2], "confidence": r[3], "filename": r[4]}
+            for r in rows[:limit]
+        ]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = self._encode_cursor(items[-1]["timestamp"], items[-1]["id"])
+        return items, next_cursor
+
+    def enforce_retention(self):
+        """Evict records older than max_age_days, then oldest-first until under max_bytes"""
+        evicted = []
+        with self._lock:
+            if self.max_age_days:
+                cutoff = (datetime.now() - timedelta(days=self.max_age_days)).isoformat()
+                for analysis_id, size in self._conn.execute(
+                        "SELECT id, size_bytes FROM analyses WHERE created_at < ?", (cutoff,)).fetchall():
+                    evicted.append(analysis_id)
+                    self._total_bytes -= size
+                self._conn.execute("DELETE FROM analyses WHERE created_at < ?", (cutoff,))
+
+            if self.max_bytes and self._total_bytes > self.max_bytes:
+                for analysis_id, size in self._conn.execute(
+                        "SELECT id, size_bytes FROM analyses ORDER BY created_at, id").fetchall():
+                    if self._total_bytes <= self.max_bytes:
+                        break
+                    self._conn.execute("DELETE FROM analyses WHERE id = ?", (analysis_id,))
+                    evicted.append(analysis_id)
+                    self._total_bytes -= size
+            self._conn.commit()
+
+        for analysis_id in evicted:
+            self._remove_artifacts(analysis_id)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
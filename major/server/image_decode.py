@@ -0,0 +1,158 @@
+"""
+Memory-bounded image decoding for very large radiographs.
+
+The header is probed first (Pillow reads only the size and mode), so images
+over the pixel or memory budget are rejected before any pixels are decoded.
+Large images are then decoded at a power-of-two reduction with OpenCV's
+IMREAD_REDUCED_* flags: JPEG scales in the DCT domain and never materializes
+the full image; PNG / TIFF decode at full size internally but are downscaled
+straight away, and grayscale sources (most X-rays, including 16-bit ones) are
+decoded as one 8-bit channel instead of three.
+"""
+import io
+import numpy as np
+import cv2
+from PIL import Image
+from typing import Optional, Tuple
+
+# Reduced-decode flags by factor, for 1- and 3-channel output
+_REDUCED_FLAGS = {
+    1: (cv2.IMREAD_GRAYSCALE, cv2.IMREAD_COLOR),
+    2: (cv2.IMREAD_REDUCED_GRAYSCALE_2, cv2.IMREAD_REDUCED_COLOR_2),
+    4: (cv2.IMREAD_REDUCED_GRAYSCALE_4, cv2.IMREAD_REDUCED_COLOR_4),
+    8: (cv2.IMREAD_REDUCED_GRAYSCALE_8, cv2.IMREAD_REDUCED_COLOR_8),
+}
+
+
+def _sample_bytes(im, image_bytes: bytes) -> int:
+    """
+    Bytes per sample the codec decodes to. Pillow reports 16-bit colour PNG / TIFF
+    as plain "RGB" / "RGBA", so their depth comes from the file header.
+    """
+    mode = im.mode
+    if mode.startswith("I;16"):
+        return 2
+    if mode in ("I", "F"):
+        return 4
+    if im.format == "PNG" and len(image_bytes) > 24:
+        return 2 if image_bytes[24] == 16 else 1  # IHDR bit depth
+    if im.format == "TIFF":
+        bits = getattr(im, "tag_v2", {}).get(258)  # BitsPerSample
+        if bits:
+            bits = bits if isinstance(bits, (tuple, list)) else (bits,)
+            return max(1, -(-max(bits) // 8))
+    return 1
+
+
+class ImageTooLargeError(ValueError):
+    """The image is over the pixel or decode memory budget"""
+
+
+class BoundedDecoder:
+    """
+    Decodes uploads to BGR uint8 within a per-request budget.
+    max_side: reduce images whose longer side is at least twice this (power-of-two
+    factors up to 8, never below max_side); 0 keeps full resolution
+    max_pixels: reject larger images outright
+    max_decode_mb: reject images whose decode would need more memory than this
+    """
+
+    def __init__(self, max_side: int = 2048, max_pixels: int = 50_000_000, max_decode_mb: float = 256):
+        self.max_side = max(0, int(max_side or 0))
+        self.max_pixels = max_pixels
+        self.max_decode_bytes = int(max_decode_mb * 1024 * 1024) if max_decode_mb else 0
+
+    @staticmethod
+    def probe(image_bytes: bytes) -> Optional[dict]:
+        """Size, format and sample layout from the header alone (None if Pillow can't read it)"""
+        try:
+            with Image.open(io.BytesIO(image_bytes)) as im:
+                width, height = im.size
+                mode, fmt = im.mode, im.format
+                sample_bytes = _sample_bytes(im, image_bytes)
+        except Image.DecompressionBombError as e:
+            raise ImageTooLargeError(str(e))
+        except Exception:
+            return None
+        try:
+            bands = Image.getmodebands(mode)
+        except (KeyError, ValueError):
+            bands = 3
+        return {
+            "width": width,
+            "height": height,
+            "format": fmt,
+            "mode": mode,
+            # Palette images may be colour, so they take the colour path
+            "grayscale": mode in ("1", "L", "LA", "I", "F") or mode.startswith("I;16"),
+            "bytes_per_pixel": bands * sample_bytes,
+        }
+
+    def reduction_for(self, width: int, height: int) -> int:
+        """Largest factor (1, 2, 4, 8) that keeps the longer side at or above max_side"""
+        factor = 1
+        if self.max_side:
+            while factor < 8 and max(width, height) // (factor * 2) >= self.max_side:
+                factor *= 2
+        return factor
+
+    def estimate_bytes(self, info: dict, factor: int) -> int:
+        """Peak decode memory: the codec's full-size buffer (JPEG decodes reduced) plus the BGR output"""
+        pixels = info["width"] * info["height"]
+        reduced = pixels // (factor * factor)
+        codec = (reduced if info["format"] == "JPEG" else pixels) * info["bytes_per_pixel"]
+        return codec + reduced * (1 if info["grayscale"] else 0) + reduced * 3
+
+    def decode(self, image_bytes: bytes) -> Tuple[Optional[np.ndarray], dict]:
+        """
+        -> (BGR uint8 image or None if undecodable, decode info)
+        Raises ImageTooLargeError when the image is over budget.
+        """
+        if not image_bytes:
+            return None, {}
+        info = self.probe(image_bytes)
+        buffer = np.frombuffer(image_bytes, np.uint8)
+
+        if info is None:
+            # Unknown to Pillow: plain decode, budget checked afterwards
+            img = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+            if img is not None and img.shape[0] * img.shape[1] > self.max_pixels:
+                raise ImageTooLargeError(f"Image has {img.shape[1]}x{img.shape[0]} pixels, "
+                                         f"over the {self.max_pixels / 1e6:.0f} MP budget")
+            return img, ({"reduction": 1} if img is not None else {})
+
+        width, height = info["width"], info["height"]
+        if width * height > self.max_pixels:
+            raise ImageTooLargeError(f"Image has {width}x{height} pixels, "
+                                     f"over the {self.max_pixels / 1e6:.0f} MP budget")
+        factor = self.reduction_for(width, height)
+        estimate = self.estimate_bytes(info, factor)
+        if self.max_decode_bytes and estimate > self.max_decode_bytes:
+            raise ImageTooLargeError(f"Decoding {width}x{height} {info['mode']} needs ~{estimate / 2**20:.0f} MB, "
+                                     f"over the {self.max_decode_bytes / 2**20:.0f} MB budget")
+
+        gray_flag, color_flag = _REDUCED_FLAGS[factor]
+        if info["grayscale"]:
+            img = cv2.imdecode(buffer, gray_flag)
+            if img is not None:
+                img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)  # Same pixels IMREAD_COLOR gives
+        else:
+            img = cv2.imdecode(buffer, color_flag)
+        if img is None:
+            return None, {}
+        return img, {
+            "source_size": [width, height],
+            "decoded_size": [img.shape[1], img.shape[0]],
+            "reduction": factor,
+            "format": info["format"],
+            "mode": info["mode"],
+            "estimated_mb": round(estimate / 2**20, 1),
+        }
+
+    def read(self, path: str) -> Tuple[Optional[np.ndarray], dict]:
+        """decode() for a file (None if it can't be read)"""
+        try:
+            with open(path, "rb") as f:
+                return self.decode(f.read())
+        except OSError:
+            return None, {}
@@ -0,0 +1,226 @@
+import asyncio
+import json
+import math
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+import telemetry
+from analysis_executor import QueueFullError
+from telemetry import JOBS, REJECTED, log
+
+
+class Job:
+    """
+    One submitted upload (a study or a batch): per-image status plus an
+    append-only event log that pollers and Server-Sent Events read from.
+    Only touched from the event loop.
+    """
+
+    def __init__(self, job_id: str, files: List[Tuple[str, bytes]], options: dict):
+        self.id = job_id
+        self.options = options
+        self.status = "queued"
+        self.created_at = datetime.now().isoformat()
+        self.started_at = None
+        self.finished_at = None
+        self.finished_monotonic = None
+        self.items = [
+            {"index": i, "filename": filename, "status": "queued", "stages": []}
+            for i, (filename, _) in enumerate(files)
+        ]
+        self.contents = [content for _, content in files]  # Dropped as each image starts
+        self.events = []
+        self._remaining = len(files)
+        self._updated = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def emit(self, event: str, **data):
+        """Append an event and wake every listener"""
+        self.events.append({"seq": len(self.events) + 1, "event": event, **data})
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    async def wait(self, seen: int, timeout: float) -> bool:
+        """Wait until there are events past `seen`; False on timeout"""
+        if len(self.events) > seen:
+            return True
+        try:
+            await asyncio.wait_for(self._updated.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def stream(self, after: int = 0, keepalive_s: float = 15.0) -> AsyncIterator[str]:
+        """Events after sequence number `after` as Server-Sent Events, until the job finishes"""
+        seen = max(0, after)
+        while True:
+            for event in self.events[seen:]:
+                yield f"id: {event['seq']}\nevent: {event['event']}\ndata: {json.dumps(event)}\n\n"
+            seen = len(self.events)
+            if self.finished:
+                return
+            if not await self.wait(seen, keepalive_s):
+                yield ": keepalive\n\n"
+
+    def summary(self) -> dict:
+        done = sum(item["status"] == "done" for item in self.items)
+        failed = sum(item["status"] == "error" for item in self.items)
+        return {
+            "id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "total": len(self.items),
+            "completed": done,
+            "failed": failed,
+            "items": [dict(item, stages=list(item["stages"])) for item in self.items],
+        }
+
+
+class JobManager:
+    """
+    Asynchronous analysis jobs.
+    Submitting only queues the uploaded images and returns a job at once;
+    `workers` runner tasks take images off the queue and hand them to
+    `process(job, index, content)`, one at a time each. At most
+    `max_queued_images` images wait; beyond that submit raises QueueFullError.
+    Stage milestones reported by the engine become job events.
+    Finished jobs are kept for `retention_s` seconds (and at most `max_finished`).
+    """
+
+    def __init__(self, process: Callable[[Job, int, bytes], Awaitable[dict]], workers: int = 2,
+                 max_queued_images: int = 256, retention_s: float = 3600, max_finished: int = 1000):
+        self.workers = max(1, int(workers))
+        self.max_queued_images = max(1, int(max_queued_images))
+        self.retention_s = retention_s
+        self.max_finished = max_finished
+        self._process = process
+        self._queue = asyncio.Queue()  # (job, image index)
+        self._jobs = OrderedDict()
+        self._queued_images = 0
+        self._running = 0
+        self._service_times = deque(maxlen=200)
+        self._runners = []
+
+    def start(self):
+        self._runners = [asyncio.create_task(self._run(), name=f"job-runner-{i}") for i in range(self.workers)]
+
+    async def close(self):
+        """Stop the runners (queued images are dropped; running ones are cancelled)"""
+        for runner in self._runners:
+            runner.cancel()
+        await asyncio.gather(*self._runners, return_exceptions=True)
+
+    def _retry_after(self) -> int:
+        mean_service = sum(self._service_times) / len(self._service_times) if self._service_times else 1.0
+        return max(1, math.ceil(mean_service * self._queued_images / self.workers))
+
+    def _prune(self):
+        now = time.monotonic()
+        finished = [job for job in self._jobs.values() if job.finished]
+        excess = len(finished) - self.max_finished
+        for job in finished:
+            if excess > 0 or now - job.finished_monotonic > self.retention_s:
+                del self._jobs[job.id]
+                excess -= 1
+
+    def submit(self, files: List[Tuple[str, bytes]], options: dict = None) -> Job:
+        """Queue (filename, bytes) images as one job; raises QueueFullError when there is no room"""
+        self._prune()
+        if self._queued_images + len(files) > self.max_queued_images:
+            REJECTED.inc(executor="jobs")
+            raise QueueFullError(self._retry_after())
+
+        job = Job(f"job_{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:6]}", files, options or {})
+        self._jobs[job.id] = job
+        job.emit("job", status="queued", total=len(files))
+        JOBS.inc(status="submitted")
+        for index in range(len(files)):
+            self._queue.put_nowait((job, index))
+        self._queued_images += len(files)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    async def _run(self):
+        while True:
+            job, index = await self._queue.get()
+            self._queued_images -= 1
+            self._running += 1
+            try:
+                await self._run_item(job, index)
+            except Exception as e:
+                log.exception("❌ Job runner error: %s", e)
+            finally:
+                self._running -= 1
+
+    async def _run_item(self, job: Job, index: int):
+        item = job.items[index]
+        content, job.contents[index] = job.contents[index], None
+        if job.status == "queued":
+            job.status = "running"
+            job.started_at = datetime.now().isoformat()
+            job.emit("job", status="running")
+        item["status"] = "running"
+        job.emit("item", item=index, status="running")
+
+        loop = asyncio.get_running_loop()
+
+        def progress(stage):
+            # Called from the analysis thread
+            loop.call_soon_threadsafe(self._stage_done, job, index, stage)
+
+        tokens = telemetry.begin_request(job.id)
+        progress_token = telemetry.track_progress(progress)
+        start = time.perf_counter()
+        try:
+            while True:
+                try:
+                    result = await self._process(job, index, content)
+                    break
+                except QueueFullError as e:
+                    # The analysis queue is shared with interactive requests; wait for room
+                    await asyncio.sleep(e.retry_after)
+            item.update(result, status="done")
+        except Exception as e:
+            item.update(status="error", message=str(e))
+            log.warning("⚠ Job %s image %d (%s) failed: %s", job.id, index, item["filename"], e)
+        finally:
+            telemetry.untrack_progress(progress_token)
+            telemetry.end_request(tokens)
+            self._service_times.append(time.perf_counter() - start)
+
+        job.emit("item", item=index, **{k: v for k, v in item.items() if k not in ("index", "stages")})
+        job._remaining -= 1
+        if job._remaining == 0:
+            self._finish(job)
+
+    def _stage_done(self, job: Job, index: int, stage: str):
+        job.items[index]["stages"].append(stage)
+        job.emit("stage", item=index, stage=stage)
+
+    def _finish(self, job: Job):
+        failed = sum(item["status"] == "error" for item in job.items)
+        job.status = "succeeded" if failed == 0 else "failed" if failed == len(job.items) else "partial"
+        job.finished_at = datetime.now().isoformat()
+        job.finished_monotonic = time.monotonic()
+        job.emit("job", status=job.status, completed=len(job.items) - failed, failed=failed)
+        JOBS.inc(status=job.status)
+        log.info("✅ Job %s %s: %d images, %d failed", job.id, job.status, len(job.items), failed)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": self._running,
+            "queued_images": self._queued_images,
+            "max_queued_images": self.max_queued_images,
+            "jobs": len(self._jobs),
+        }
@@ -1,19 +1,160 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from contextlib import asynccontextmanager
+from typing import List, Optional
+import asyncio
 import os
+import time
+import uuid
 from datetime import datetime
 from final_predictor import PneumoniaAI
+from analysis_executor import AnalysisExecutor, QueueFullError
+from job_manager import Job, JobManager
+from worker_pool import WorkerPool, available_cpus
+from result_cache import AnalysisCache
+from history_store import HistoryStore
+from artifacts import ArtifactEncoder, render_artifacts
+import telemetry
+from telemetry import log
 import traceback
 
+# Micro-batching: concurrent predictions (and Grad-CAM passes) share one forward pass
+MAX_BATCH_SIZE = int(os.getenv("PNEUMONIA_MAX_BATCH_SIZE", "8"))
+MAX_BATCH_WAIT_MS = float(os.getenv("PNEUMONIA_MAX_BATCH_WAIT_MS", "5"))
+
+# Analysis runs in a worker pool so the event loop stays responsive
+# (0 = one slot per micro-batch entry, so batches can fill)
+MAX_CONCURRENT_ANALYSES = int(os.getenv("PNEUMONIA_MAX_CONCURRENT_ANALYSES", "0"))
+MAX_QUEUED_ANALYSES = int(os.getenv("PNEUMONIA_MAX_QUEUED_ANALYSES", "16"))
+
+# Asynchronous jobs: images analysed at once from jobs (0 = one per analysis slot), images
+# allowed to wait, and how long finished jobs stay pollable
+JOB_WORKERS = int(os.getenv("PNEUMONIA_JOB_WORKERS", "0"))
+MAX_QUEUED_JOB_IMAGES = int(os.getenv("PNEUMONIA_MAX_QUEUED_JOB_IMAGES", "256"))
+JOB_RETENTION_MIN = float(os.getenv("PNEUMONIA_JOB_RETENTION_MIN", "60"))
+
+# Result cache for re-submitted images (0 MB disables it)
+CACHE_MAX_MB = float(os.getenv("PNEUMONIA_CACHE_MAX_MB", "64"))
+CACHE_DIR = os.getenv("PNEUMONIA_CACHE_DIR") or None
+CACHE_DISK_MAX_MB = float(os.getenv("PNEUMONIA_CACHE_DISK_MAX_MB", "1024"))
+
+# Persistent analysis history with retention by age and size
+HISTORY_DIR = os.getenv("PNEUMONIA_HISTORY_DIR", "history")
+HISTORY_MAX_AGE_DAYS = float(os.getenv("PNEUMONIA_HISTORY_MAX_AGE_DAYS", "30"))
+HISTORY_MAX_MB = float(os.getenv("PNEUMONIA_HISTORY_MAX_MB", "1024"))
+
+# Heatmap / overlay / mask encoding (format can also be chosen per request)
+ARTIFACT_FORMAT = os.getenv("PNEUMONIA_ARTIFACT_FORMAT", "png")
+PNG_COMPRESSION = int(os.getenv("PNEUMONIA_PNG_COMPRESSION", "3"))
+ARTIFACT_QUALITY = int(os.getenv("PNEUMONIA_ARTIFACT_QUALITY", "80"))
+
+# Startup: cached .keras conversion of the model, and warmup before reporting ready
+CONVERT_MODEL = os.getenv("PNEUMONIA_CONVERT_MODEL", "1") != "0"
+WARMUP = os.getenv("PNEUMONIA_WARMUP", "1") != "0"
+
+# Inference backend: float, or quantized dynamic / int8 (calibrated from the dataset)
+INFERENCE_BACKEND = os.getenv("PNEUMONIA_BACKEND", "float")
+CALIBRATION_DIR = os.getenv("PNEUMONIA_CALIBRATION_DIR", "dataset/train")
+
+# Decode budget per upload: reduced-resolution decode for huge images (0 = full resolution),
+# and larger images / decodes needing more memory than this are rejected
+DECODE_MAX_SIDE = int(os.getenv("PNEUMONIA_DECODE_MAX_SIDE", "2048"))
+MAX_IMAGE_MP = float(os.getenv("PNEUMONIA_MAX_IMAGE_MP", "50"))
+MAX_DECODE_MB = float(os.getenv("PNEUMONIA_MAX_DECODE_MB", "256"))
+
+# Lung segmentation working resolution in px (0 = full resolution)
+SEGMENTATION_SIZE = int(os.getenv("PNEUMONIA_SEGMENTATION_SIZE", "0"))
+
+# Worker processes (0 = engine in the API process); threads default to an even share of the CPUs
+WORKERS = int(os.getenv("PNEUMONIA_WORKERS", "0"))
+THREADS_PER_WORKER = int(os.getenv("PNEUMONIA_THREADS_PER_WORKER", "0")) or \
+    max(1, len(available_cpus()) // max(1, WORKERS))
+PIN_CPUS = os.getenv("PNEUMONIA_PIN_CPUS", "1") != "0"
+
+# Levelled logging (DEBUG adds per-stage spans); requests slower than this log their spans
+LOG_LEVEL = os.getenv("PNEUMONIA_LOG_LEVEL", "INFO")
+SLOW_REQUEST_MS = float(os.getenv("PNEUMONIA_SLOW_REQUEST_MS", "2000"))
+telemetry.configure_logging(LOG_LEVEL)
+
+def load_engine(cache_kwargs):
+    """Load and warm up the engine (runs off the event loop while the API starts)"""
+    global ai_engine
+    try:
+        print("🚀 Loading Pneumonia AI Model...")
+        engine_kwargs = dict(
+            model_path="models/final_pnuemonia_model.h5",
+            max_batch_size=MAX_BATCH_SIZE,
+            max_batch_wait_ms=MAX_BATCH_WAIT_MS,
+            artifact_encoder=make_encoder(ARTIFACT_FORMAT),
+            convert_model=CONVERT_MODEL,
+            backend=INFERENCE_BACKEND,
+            calibration_dir=CALIBRATION_DIR,
+            segmentation_size=SEGMENTATION_SIZE,
+            decode_max_side=DECODE_MAX_SIDE,
+            max_image_pixels=int(MAX_IMAGE_MP * 1_000_000),
+            max_decode_mb=MAX_DECODE_MB
+        )
+        if WORKERS > 0:
+            engine = WorkerPool(WORKERS, THREADS_PER_WORKER, engine_kwargs, cache_kwargs, PIN_CPUS)
+        else:
+            result_cache = AnalysisCache(**cache_kwargs) if cache_kwargs else None
+            engine = PneumoniaAI(result_cache=result_cache, **engine_kwargs)
+        ai_engine = engine
+        startup["phases"].update(engine.startup_timings)
+        if WARMUP:
+            startup["status"] = "warming_up"
+            print("🔥 Warming up...")
+            startup["phases"].update(engine.warmup())
+        startup["status"] = "ready"
+        startup["ready_after_s"] = time.perf_counter() - startup["started"]
+        print(f"✅ AI Engine Ready! ({startup['ready_after_s']:.2f}s)")
+    except Exception as e:
+        startup["status"] = "failed"
+        startup["error"] = str(e)
+        print(f"❌ AI Engine failed to load: {e}")
+        traceback.print_exc()
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global ai_engine
-    print("🚀 Loading Pneumonia AI Model...")
-    ai_engine = PneumoniaAI(model_path="models/final_pnuemonia_model.h5")
-    print("✅ AI Engine Ready!")
+    global analysis_executor, history_store, job_manager
+    startup["started"] = time.perf_counter()
+    cache_kwargs = None
+    if CACHE_MAX_MB > 0:
+        # Worker processes split the memory budget and share the disk tier
+        cache_kwargs = dict(
+            max_bytes=int(CACHE_MAX_MB * 1024 * 1024 / max(1, WORKERS)),
+            disk_dir=CACHE_DIR,
+            max_disk_bytes=int(CACHE_DISK_MAX_MB * 1024 * 1024)
+        )
+    # With worker processes, every worker can be busy at once; in-process, a batch only
+    # fills with as many analyses as run concurrently
+    concurrent = MAX_CONCURRENT_ANALYSES or (WORKERS if WORKERS > 0 else max(2, MAX_BATCH_SIZE))
+    analysis_executor = AnalysisExecutor(max(concurrent, WORKERS), MAX_QUEUED_ANALYSES)
+    history_store = HistoryStore(
+        root_dir=HISTORY_DIR,
+        max_age_days=HISTORY_MAX_AGE_DAYS,
+        max_bytes=int(HISTORY_MAX_MB * 1024 * 1024)
+    )
+    job_manager = JobManager(
+        process_job_image,
+        workers=JOB_WORKERS or analysis_executor.max_concurrent,
+        max_queued_images=MAX_QUEUED_JOB_IMAGES,
+        retention_s=JOB_RETENTION_MIN * 60
+    )
+    job_manager.start()
+    startup["phases"]["services"] = time.perf_counter() - startup["started"]
+    
+    # Health and history answer right away; /api/ready turns green after warmup
+    loading = asyncio.create_task(asyncio.to_thread(load_engine, cache_kwargs))
     yield
+    await loading
+    await job_manager.close()
+    analysis_executor.shutdown()
+    history_store.close()
+    if ai_engine is not None:
+        ai_engine.close()
     print("🔴 AI Engine Shutdown")
 
 app = FastAPI(title="Pneumonia Detection API", lifespan=lifespan)
@@ -26,8 +167,51 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def request_telemetry(request: Request, call_next):
+    """Request id (X-Request-ID or a new one), latency histogram, slow request spans"""
+    rid = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:12]
+    tokens = telemetry.begin_request(rid)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = rid
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "unmatched"
+        telemetry.REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+        telemetry.REQUESTS.inc(endpoint=endpoint, status=status)
+        spans = telemetry.end_request(tokens)
+        if elapsed * 1000.0 > SLOW_REQUEST_MS:
+            log.warning("🐢 Slow request %s %s: %.0fms (%s)", request.method, endpoint, elapsed * 1000.0,
+                        telemetry.format_spans(spans) or "no spans", extra={"request_id": rid})
+
 ai_engine = None
-history_db = {}
+analysis_executor = None
+history_store = None
+job_manager = None
+startup = {"status": "loading", "phases": {}, "error": None, "ready_after_s": None}
+
+def require_engine():
+    """503 until the model has loaded"""
+    if ai_engine is None:
+        raise HTTPException(
+            status_code=503,
+            headers={"Retry-After": "5"},
+            detail=f"Model is {startup['status']}" + (f": {startup['error']}" if startup["error"] else "")
+        )
+    return ai_engine
+
+def queue_full_response(e: QueueFullError):
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": str(e.retry_after)},
+        content={"status": "error", "message": str(e)}
+    )
 
 @app.get("/")
 async def root():
@@ -41,33 +225,152 @@ async def root():
 @app.get("/api/health")
 async def health():
     return {
-        "status": "online", 
+        "status": "online" if startup["status"] == "ready" else startup["status"],
         "model": "High-Accuracy Pneumonia Detector",
-        "endpoints": ["/api/analyze", "/api/history/{id}", "/api/health"]
+        "backend": ai_engine.backend if ai_engine else INFERENCE_BACKEND,
+        "endpoints": ["/api/analyze", "/api/analyze/batch", "/api/jobs", "/api/history/{id}", "/api/health", "/api/ready"],
+        "batching": ai_engine.batcher.stats() if ai_engine and ai_engine.batcher else None,
+        "gradcam_batching": ai_engine.gradcam_batcher.stats() if ai_engine and ai_engine.gradcam_batcher else None,
+        "queue": analysis_executor.stats() if analysis_executor else None,
+        "jobs": job_manager.stats() if job_manager else None,
+        "cache": ai_engine.result_cache.stats() if ai_engine and ai_engine.result_cache else None,
+        "workers": ai_engine.stats() if isinstance(ai_engine, WorkerPool) else None,
+        "startup": {
+            "status": startup["status"],
+            "ready_after_s": startup["ready_after_s"],
+            "phases_s": {k: round(v, 3) for k, v in startup["phases"].items()}
+        }
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of stage timings, queue waits, cache lookups and errors"""
+    if analysis_executor is not None:
+        queue = analysis_executor.stats()
+        telemetry.QUEUE_DEPTH.set(queue["queue_depth"])
+        telemetry.ACTIVE.set(queue["active"])
+    if job_manager is not None:
+        telemetry.JOB_QUEUE_DEPTH.set(job_manager.stats()["queued_images"])
+    return PlainTextResponse(telemetry.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/ready")
+async def ready():
+    """Readiness probe: 200 once the model is loaded and warmed up, 503 before"""
+    if startup["status"] == "ready":
+        return {"status": "ready"}
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": "5"},
+        content={"status": startup["status"], "error": startup["error"]}
+    )
+
+def make_encoder(fmt: Optional[str]) -> ArtifactEncoder:
+    try:
+        return ArtifactEncoder(fmt or ARTIFACT_FORMAT, PNG_COMPRESSION, ARTIFACT_QUALITY)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def with_artifacts(record: dict, request: Request, mode: str = "url", artifacts: dict = None) -> dict:
+    """
+    Response copy of a record with artifact fields filled in:
+    URLs to /api/history/{id}/artifacts/{name} by default, or inline data URLs
+    """
+    record = dict(record)
+    if mode == "inline":
+        if artifacts is None:
+            artifacts = {}
+            for name in record.get("artifacts", {}):
+                loaded = history_store.read_artifact(record["id"], name)
+                if loaded is not None:
+                    artifacts[name] = {"data": loaded[0], "content_type": loaded[1]["content_type"]}
+        return render_artifacts(record, artifacts)
+    
+    return render_artifacts(
+        record, record.get("artifacts", {}),
+        url_for=lambda name: str(request.url_for("get_artifact", analysis_id=record["id"], name=name))
+    )
+
+def parse_include(include: Optional[str], fast: bool = False):
+    """?include=heatmap,segmentation -> stage tuple; fast mode skips every optional stage"""
+    if fast:
+        return ()
+    if include is None:
+        return None
+    stages = tuple(s.strip().lower() for s in include.split(",") if s.strip())
+    unknown = set(stages) - set(PneumoniaAI.ANALYSIS_STAGES)
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown stages: {', '.join(sorted(unknown))}. "
+                   f"Choose from: {', '.join(PneumoniaAI.ANALYSIS_STAGES)}"
+        )
+    return stages
+
+async def save_analysis(result: dict, filename: str) -> dict:
+    """History record for a successful analysis, stored with its artifacts"""
+    # Generate analysis ID
+    analysis_id = f"res_{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:6]}"
+    timestamp = datetime.now().isoformat()
+    
+    # Build complete response
+    full_response = {
+        "id": analysis_id,
+        "status": "success",
+        "timestamp": timestamp,
+        "filename": filename,
+        "analysis": {
+            "diagnosis": result["diagnosis"],
+            "confidence": result["confidence"],  # Already 0-1
+            "severity": result["severity"],
+            "risk_factors": result.get("risk_factors", []),
+            "recommendations": result.get("recommendations", []),
+            "risk_level": result.get("risk_level", "LOW")
+        },
+        "model_scores": result.get("model_scores", {}),
+        "ml_source": result.get("ml_source", "simulated"),
+        "ml_timings_ms": result.get("ml_timings_ms", {}),
+        "ensemble_score": result.get("ensemble_score", 0),
+        "ensemble_diagnosis": result.get("ensemble_diagnosis", "NORMAL"),
+        "threshold_used": result.get("threshold_used", 0.5),
+        "heatmap": result.get("heatmap", {}),
+        "segmentation": result.get("segmentation", {}),
+        "raw_score": result.get("raw_score", 0),
+        "included": result.get("included", list(PneumoniaAI.ANALYSIS_STAGES)),
+        "image_key": result.get("image_key"),
+        "decode": result.get("decode", {}),
+        "memory": result.get("memory", {}),
+        "detectionTimestamp": datetime.now().isoformat()
     }
+    
+    # Store in history (image artifacts go to files, the record references them)
+    result_artifacts = result.get("artifacts", {})
+    await run_in_threadpool(history_store.save, full_response, result_artifacts)
+    full_response["artifacts"] = {
+        name: {"content_type": a["content_type"], "etag": a["etag"], "size": len(a["data"])}
+        for name, a in result_artifacts.items()
+    }
+    return full_response
 
 @app.post("/api/analyze")
-async def analyze_image(file: UploadFile = File(...)):
+async def analyze_image(
+    request: Request,
+    file: UploadFile = File(...),
+    include: Optional[str] = Query(None, description="Comma-separated optional stages: heatmap,segmentation"),
+    fast: bool = Query(False, description="Diagnosis only; skip every optional stage"),
+    artifact_format: Optional[str] = Query(None, description="png, webp or jpeg"),
+    artifacts: str = Query("url", pattern="^(url|inline)$", description="Artifact URLs or inline base64")
+):
+    stages = parse_include(include, fast)
+    encoder = make_encoder(artifact_format)
+    engine = require_engine()
     try:
-        print(f"📥 Received file: {file.filename}")
-        
-        # Save uploaded file temporarily
-        temp_path = f"temp_{datetime.now().strftime('%Y%m%d%H%M%S')}_{file.filename}"
+        log.debug("📥 Received file: %s", file.filename)
+        content = await file.read()
         
-        with open(temp_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        print(f"📁 Saved to: {temp_path}")
-        print("🔍 Starting analysis...")
-        
-        # Perform COMPLETE analysis
-        result = ai_engine.full_analysis(temp_path)
-        
-        # Clean up temp file
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-            print(f"🗑️ Cleaned temp file")
+        # Perform analysis in the worker pool, straight from the uploaded bytes
+        result = await analysis_executor.run(
+            engine.full_analysis_bytes, content, file.filename, stages, encoder
+        )
         
         if result["status"] == "error":
             return JSONResponse(
@@ -75,69 +378,238 @@ async def analyze_image(file: UploadFile = File(...)):
                 content={"status": "error", "message": result["message"]}
             )
         
-        # Generate analysis ID
-        analysis_id = f"res_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        timestamp = datetime.now().isoformat()
+        full_response = await save_analysis(result, file.filename)
+        log.info("✅ Analysis completed: %s (%s)", full_response["id"], file.filename)
         
-        # Build complete response
-        full_response = {
-            "id": analysis_id,
-            "status": "success",
-            "timestamp": timestamp,
-            "filename": file.filename,
-            "analysis": {
-                "diagnosis": result["diagnosis"],
-                "confidence": result["confidence"],  # Already 0-1
-                "severity": result["severity"],
-                "risk_factors": result.get("risk_factors", []),
-                "recommendations": result.get("recommendations", []),
-                "risk_level": result.get("risk_level", "LOW")
-            },
-            "model_scores": result.get("model_scores", {}),
-            "ensemble_score": result.get("ensemble_score", 0),
-            "ensemble_diagnosis": result.get("ensemble_diagnosis", "NORMAL"),
-            "threshold_used": result.get("threshold_used", 0.5),
-            "heatmap": result.get("heatmap", {}),
-            "segmentation": result.get("segmentation", {}),
-            "raw_score": result.get("raw_score", 0),
-          "detectionTimestamp": datetime.now().isoformat()
-        }
+        return JSONResponse(content=with_artifacts(full_response, request, artifacts, result.get("artifacts", {})))
+
+    except QueueFullError as e:
+        log.warning("⏳ Rejected %s: %s", file.filename, e)
+        return queue_full_response(e)
+    except Exception as e:
+        telemetry.ERRORS.inc(stage="api")
+        log.exception("❌ Error analyzing image: %s", e)
+        return JSONResponse(
+            status_code=500, 
+            content={
+                "status": "error", 
+                "message": f"Analysis failed: {str(e)}"
+            }
+        )
+
+@app.post("/api/analyze/batch")
+async def analyze_batch(
+    files: List[UploadFile] = File(...),
+    ensemble: bool = Query(False, description="Add ML ensemble scores (one feature pass per batch)"),
+    heatmap: bool = Query(False, description="Add Grad-CAM heatmaps (one taped pass per batch), inline"),
+    artifact_format: Optional[str] = Query(None, description="png, webp or jpeg")
+):
+    """Diagnosis for many images, scored in shared forward passes"""
+    encoder = make_encoder(artifact_format)
+    engine = require_engine()
+    try:
+        log.debug("📥 Received batch of %d files", len(files))
         
-        # Store in history
-        history_db[analysis_id] = full_response
-        print(f"✅ Analysis completed: {analysis_id}")
+        contents = [await file.read() for file in files]
+        predictions = await analysis_executor.run(engine.predict_batch_bytes, contents, ensemble, heatmap, encoder)
         
-        return JSONResponse(content=full_response)
+        results = []
+        for file, prediction in zip(files, predictions):
+            result = {"filename": file.filename, **prediction}
+            result_artifacts = result.pop("artifacts", None)
+            if result_artifacts:
+                render_artifacts(result, result_artifacts)
+            results.append(result)
+        
+        log.info("✅ Batch completed: %d images", len(results))
+        return JSONResponse(content={
+            "status": "success",
+            "count": len(results),
+            "results": results,
+            "detectionTimestamp": datetime.now().isoformat()
+        })
 
+    except QueueFullError as e:
+        log.warning("⏳ Rejected batch: %s", e)
+        return queue_full_response(e)
     except Exception as e:
-        print(f"❌ Error analyzing image: {str(e)}")
-        traceback.print_exc()
+        telemetry.ERRORS.inc(stage="api")
+        log.exception("❌ Error analyzing batch: %s", e)
         return JSONResponse(
             status_code=500, 
             content={
                 "status": "error", 
-                "message": f"Analysis failed: {str(e)}"
+                "message": f"Batch analysis failed: {str(e)}"
             }
         )
 
+async def process_job_image(job: Job, index: int, content: bytes) -> dict:
+    """Analyse one image of a job and store it in history like /api/analyze does"""
+    filename = job.items[index]["filename"]
+    result = await analysis_executor.run(
+        ai_engine.full_analysis_bytes, content, filename, job.options.get("include"), job.options.get("encoder")
+    )
+    if result["status"] == "error":
+        raise ValueError(result["message"])
+    record = await save_analysis(result, filename)
+    return {
+        "analysis_id": record["id"],
+        "diagnosis": record["analysis"]["diagnosis"],
+        "confidence": record["analysis"]["confidence"],
+    }
+
+def job_response(job: Job, request: Request) -> dict:
+    """Job summary with a history URL for every finished image"""
+    summary = job.summary()
+    for item in summary["items"]:
+        if "analysis_id" in item:
+            item["result_url"] = str(request.url_for("get_history", analysis_id=item["analysis_id"]))
+    return summary
+
+def get_job(job_id: str) -> Job:
+    job = job_manager.get(job_id) if job_manager else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/api/jobs")
+async def submit_job(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    include: Optional[str] = Query(None, description="Comma-separated optional stages: heatmap,segmentation"),
+    fast: bool = Query(False, description="Diagnosis only; skip every optional stage"),
+    artifact_format: Optional[str] = Query(None, description="png, webp or jpeg")
+):
+    """Queue images for full analysis and return a job id at once"""
+    options = {"include": parse_include(include, fast), "encoder": make_encoder(artifact_format)}
+    require_engine()
+    uploads = [(file.filename, await file.read()) for file in files]
+    try:
+        job = job_manager.submit(uploads, options)
+    except QueueFullError as e:
+        log.warning("⏳ Rejected job of %d images: %s", len(uploads), e)
+        return queue_full_response(e)
+    
+    log.info("📥 Job %s queued: %d images", job.id, len(uploads))
+    status_url = str(request.url_for("get_job_status", job_id=job.id))
+    return JSONResponse(
+        status_code=202,
+        headers={"Location": status_url},
+        content={
+            "status": "accepted",
+            "job_id": job.id,
+            "total": len(uploads),
+            "status_url": status_url,
+            "events_url": str(request.url_for("job_events", job_id=job.id))
+        }
+    )
+
+@app.get("/api/jobs/{job_id}", name="get_job_status")
+async def get_job_status(job_id: str, request: Request):
+    """Job status, per-image stages done, and history ids of finished images"""
+    return job_response(get_job(job_id), request)
+
+@app.get("/api/jobs/{job_id}/events", name="job_events")
+async def job_events(job_id: str, last_event_id: Optional[str] = Header(None)):
+    """Server-Sent Events: job, image and stage events until the job finishes (resumable via Last-Event-ID)"""
+    job = get_job(job_id)
+    after = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+    return StreamingResponse(
+        job.stream(after),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/api/history/{analysis_id}")
-async def get_history(analysis_id: str):
-    if analysis_id in history_db:
-        return history_db[analysis_id]
+async def get_history(
+    analysis_id: str,
+    request: Request,
+    artifacts: str = Query("url", pattern="^(url|inline)$")
+):
+    record = await run_in_threadpool(history_store.get, analysis_id)
+    if record is not None:
+        return await run_in_threadpool(with_artifacts, record, request, artifacts)
     raise HTTPException(status_code=404, detail="Analysis ID not found")
 
+@app.get("/api/history/{analysis_id}/artifacts/{name}", name="get_artifact")
+async def get_artifact(
+    analysis_id: str,
+    name: str,
+    if_none_match: Optional[str] = Header(None)
+):
+    """Heatmap / overlay / mask as a binary image with ETag and cache headers"""
+    loaded = await run_in_threadpool(history_store.read_artifact, analysis_id, name)
+    if loaded is None:
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    
+    data, meta = loaded
+    etag = f'"{meta["etag"]}"'
+    # Artifacts of an analysis never change once written
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=31536000, immutable"}
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type=meta["content_type"], headers=headers)
+
+@app.post("/api/history/{analysis_id}/complete")
+async def complete_history(
+    analysis_id: str,
+    request: Request,
+    include: Optional[str] = Query(None, description="Stages to add; defaults to every skipped stage"),
+    artifact_format: Optional[str] = Query(None, description="png, webp or jpeg")
+):
+    """Compute stages that were skipped when the analysis ran, and store them"""
+    record = await run_in_threadpool(history_store.get, analysis_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Analysis ID not found")
+    
+    requested = parse_include(include) or PneumoniaAI.ANALYSIS_STAGES
+    done = record.get("included", PneumoniaAI.ANALYSIS_STAGES)
+    missing = tuple(stage for stage in requested if stage not in done)
+    if not missing:
+        return with_artifacts(record, request)
+    
+    engine = require_engine()
+    try:
+        result = await analysis_executor.run(
+            engine.complete_analysis, record.get("image_key"), missing, make_encoder(artifact_format)
+        )
+    except QueueFullError as e:
+        return queue_full_response(e)
+    if result["status"] == "error":
+        raise HTTPException(status_code=410, detail=result["message"])
+    
+    for stage in missing:
+        record[stage] = result[stage]
+    record["included"] = [s for s in PneumoniaAI.ANALYSIS_STAGES if s in done or s in missing]
+    await run_in_threadpool(history_store.save, record, result["artifacts"])
+    record = await run_in_threadpool(history_store.get, analysis_id)
+    return with_artifacts(record, request)
+
 @app.delete("/api/history/{analysis_id}")
 async def delete_history(analysis_id: str):
-    if analysis_id in history_db:
-        del history_db[analysis_id]
+    if await run_in_threadpool(history_store.delete, analysis_id):
         return {"status": "success", "message": "Record deleted"}
     raise HTTPException(status_code=404, detail="Analysis ID not found")
 
 @app.get("/api/history")
-async def list_history():
+async def list_history(
+    limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = None,
+    diagnosis: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None
+):
+    try:
+        items, next_cursor = await run_in_threadpool(
+            history_store.list_records, limit, cursor, diagnosis, since, until
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     return {
-        "count": len(history_db),
-        "analyses": list(history_db.keys())[-10:]  # Last 10 analyses
+        "count": await run_in_threadpool(history_store.count),
+        "analyses": [item["id"] for item in items],  # Newest first
+        "items": items,
+        "next_cursor": next_cursor
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,84 @@
+import os
+import time
+import joblib
+import numpy as np
+from typing import List, Tuple, Dict
+
+from preprocessing import ImagePreprocessor
+
+
+class MLEnsemble:
+    """
+    Calibrated SVM / RandomForest / LogisticRegression trained by
+    train_ml_models.py on DenseNet121 pooled features.
+    Features are extracted once per image (or once per batch) and all three
+    models score that same feature matrix.
+    """
+
+    # Response key -> file saved by train_ml_models.py
+    MODEL_FILES = {
+        "svm": "svm.pkl",
+        "rf": "random_forest.pkl",
+        "lr": "logistic_regression.pkl",
+    }
+    FEATURE_CHUNK_SIZE = 32
+
+    def __init__(self, model_dir: str = "models", feature_extractor=None):
+        """
+        feature_extractor: Keras model mapping preprocessed images to pooled
+        features; DenseNet121 with ImageNet weights if None (as in training)
+        """
+        self.models = {
+            name: joblib.load(os.path.join(model_dir, filename))
+            for name, filename in self.MODEL_FILES.items()
+        }
+        self.feature_extractor = feature_extractor or self.build_feature_extractor()
+
+    @classmethod
+    def available(cls, model_dir: str = "models") -> bool:
+        """True when every trained model file is present"""
+        return all(os.path.exists(os.path.join(model_dir, f)) for f in cls.MODEL_FILES.values())
+
+    @staticmethod
+    def build_feature_extractor():
+        from tensorflow.keras.applications import DenseNet121
+        densenet = DenseNet121(weights="imagenet", include_top=False,
+                               input_shape=(224, 224, 3), pooling="avg")
+        densenet.trainable = False
+        return densenet
+
+    def extract_features(self, images: List[np.ndarray]) -> np.ndarray:
+        """Decoded BGR images -> (N, features), one forward pass per chunk"""
+        features = []
+        buffer = np.empty((min(len(images), self.FEATURE_CHUNK_SIZE), 224, 224, 3), dtype=np.float32)
+        for start in range(0, len(images), self.FEATURE_CHUNK_SIZE):
+            chunk = images[start:start + self.FEATURE_CHUNK_SIZE]
+            batch = ImagePreprocessor.preprocess_batch(chunk, mode="densenet", color="bgr", out=buffer)
+            features.append(np.asarray(self.feature_extractor.predict_on_batch(batch)))
+        return np.concatenate(features)
+
+    def score_features(self, features: np.ndarray) -> Dict[str, np.ndarray]:
+        """Pneumonia probability from every model for each feature row"""
+        # Class 1 is PNEUMONIA (flow_from_directory sorts class folders)
+        return {name: model.predict_proba(features)[:, 1] for name, model in self.models.items()}
+
+    def predict(self, images: List[np.ndarray]) -> Tuple[List[Dict[str, float]], Dict[str, float]]:
+        """
+        Per-image scores ({"svm", "rf", "lr"}) and the time spent in
+        feature extraction and in the sklearn models (ms, whole call)
+        """
+        start = time.perf_counter()
+        features = self.extract_features(images)
+        features_done = time.perf_counter()
+        scores = self.score_features(features)
+        models_done = time.perf_counter()
+
+        per_image = [
+            {name: float(values[i]) for name, values in scores.items()}
+            for i in range(len(images))
+        ]
+        timings = {
+            "features_ms": (features_done - start) * 1000.0,
+            "models_ms": (models_done - features_done) * 1000.0,
+        }
+        return per_image, timings
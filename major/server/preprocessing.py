@@ -3,10 +3,50 @@ import numpy as np
 import cv2
 from PIL import Image
 import io
-from typing import Tuple
+import threading
+from typing import Optional, Sequence
 
 class ImagePreprocessor:
     TARGET_SIZE = (224, 224)
+    # Bump when the pipeline below changes; keys cached training features
+    VERSION = "rgb-resize224-clahe2.0x8-densenet:1"
+
+    CLAHE_CLIP_LIMIT = 2.0
+    CLAHE_TILE_GRID = (8, 8)
+
+    # DenseNet preprocess_input ("torch" mode: /255, ImageNet mean/std) as one multiply-add
+    IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+    IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+    DENSENET_SCALE = 1.0 / (255.0 * IMAGENET_STD)
+    DENSENET_OFFSET = -IMAGENET_MEAN / IMAGENET_STD
+
+    # uint8 -> float32 lookup tables (cv2.LUT is far faster than numpy broadcasting over 3 channels)
+    _SCALED_LUT = (np.arange(256, dtype=np.float32) / 255.0).reshape(256, 1)
+    _DENSENET_LUT = (np.arange(256, dtype=np.float32)[:, None] * DENSENET_SCALE + DENSENET_OFFSET) \
+        .astype(np.float32).reshape(256, 1, 3)
+
+    # Batch modes: "densenet" feeds the DenseNet feature extractor (ML ensemble and
+    # training), "scaled" feeds the pneumonia CNN (RGB / 255, no CLAHE)
+    MODES = ("densenet", "scaled")
+
+    # CLAHE objects and scratch images are reused per thread (cv2 CLAHE isn't thread-safe)
+    _local = threading.local()
+
+    @classmethod
+    def _clahe(cls):
+        clahe = getattr(cls._local, "clahe", None)
+        if clahe is None:
+            clahe = cls._local.clahe = cv2.createCLAHE(clipLimit=cls.CLAHE_CLIP_LIMIT,
+                                                       tileGridSize=cls.CLAHE_TILE_GRID)
+        return clahe
+
+    @classmethod
+    def _scratch(cls, name: str, shape) -> np.ndarray:
+        buffer = getattr(cls._local, name, None)
+        if buffer is None or buffer.shape != shape:
+            buffer = np.empty(shape, dtype=np.uint8)
+            setattr(cls._local, name, buffer)
+        return buffer
 
     @staticmethod
     def load_image(image_bytes: bytes) -> np.ndarray:
@@ -19,37 +59,79 @@ class ImagePreprocessor:
         """Resize image to target size"""
         return cv2.resize(image, ImagePreprocessor.TARGET_SIZE)
 
-    @staticmethod
-    def apply_clahe(image: np.ndarray) -> np.ndarray:
+    @classmethod
+    def apply_clahe(cls, image: np.ndarray) -> np.ndarray:
         """Apply CLAHE for better contrast"""
         if len(image.shape) == 3:
             # Convert to grayscale, apply CLAHE, convert back
             gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-            gray = clahe.apply(gray)
+            gray = cls._clahe().apply(gray)
             # Convert back to RGB
             return cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB)
         return image
 
+    @classmethod
+    def preprocess_batch(cls, images: Sequence[np.ndarray], mode: str = "densenet", color: str = "rgb",
+                         out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        N decoded uint8 images (any size) -> one contiguous (N, 224, 224, 3) float32 tensor.
+        color: channel order of the inputs, "rgb" (PIL) or "bgr" (OpenCV)
+        out: optional buffer to fill instead of allocating (at least N rows)
+        Every image is written straight into its row through a uint8 -> float32
+        lookup table: no per-image float arrays and no np.stack.
+        """
+        if mode not in cls.MODES:
+            raise ValueError(f"Unknown preprocessing mode: {mode}. Choose from: {', '.join(cls.MODES)}")
+        if color not in ("rgb", "bgr"):
+            raise ValueError(f"Unknown channel order: {color}")
+        width, height = cls.TARGET_SIZE
+        shape = (len(images), height, width, 3)
+        if out is None:
+            out = np.empty(shape, dtype=np.float32)
+        elif out.dtype != np.float32 or out.shape[1:] != shape[1:] or len(out) < len(images):
+            raise ValueError(f"Output buffer must be float32 with room for {shape}")
+        out = out[:len(images)]
+
+        resized_buffer = cls._scratch("resized", (height, width, 3))
+        channels_buffer = cls._scratch("channels", (height, width, 3))
+        gray_buffer = cls._scratch("gray", (height, width))
+        enhanced_buffer = cls._scratch("enhanced", (height, width))
+        to_gray = cv2.COLOR_BGR2GRAY if color == "bgr" else cv2.COLOR_RGB2GRAY
+        for i, image in enumerate(images):
+            if image.ndim == 2:
+                image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+            if image.shape[:2] == (height, width):
+                resized = image
+            else:
+                resized = cv2.resize(image, cls.TARGET_SIZE, dst=resized_buffer)
+
+            if mode == "scaled":
+                # Same values as astype(float32) / 255 of the RGB image
+                if color == "bgr":
+                    resized = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB, dst=channels_buffer)
+                cv2.LUT(resized, cls._SCALED_LUT, dst=out[i])
+            else:
+                gray = cv2.cvtColor(resized, to_gray, dst=gray_buffer)
+                enhanced = cls._clahe().apply(gray, dst=enhanced_buffer)
+                channels = cv2.cvtColor(enhanced, cv2.COLOR_GRAY2RGB, dst=channels_buffer)
+                cv2.LUT(channels, cls._DENSENET_LUT, dst=out[i])
+        return out
+
     @classmethod
     def preprocess_for_model(cls, image_bytes: bytes) -> np.ndarray:
         """
         SIMPLE and CORRECT preprocessing for API inference
         """
         # 1. Load as uint8 (0-255)
-        image = cls.load_image(image_bytes)
-        
-        # 2. Resize
-        image = cls.resize(image)
-        
-        # 3. Optional: Apply CLAHE
-        image = cls.apply_clahe(image) # <--- THIS LINE IS NOW ACTIVE!
-        
-        # 4. Apply DenseNet preprocessing (handles scaling/normalization)
-        from tensorflow.keras.applications.densenet import preprocess_input
-        image = preprocess_input(image) # Expects 0-255 input from CLAHE step
-        
-        return image
+        return cls.preprocess_array(cls.load_image(image_bytes))
+
+    @classmethod
+    def preprocess_array(cls, image: np.ndarray) -> np.ndarray:
+        """
+        Same preprocessing for an already decoded RGB uint8 image:
+        resize, CLAHE, DenseNet normalization (one-image preprocess_batch)
+        """
+        return cls.preprocess_batch([image])[0]
 
     @classmethod
     def preprocess_for_training(cls, image_path: str) -> np.ndarray:
@@ -58,19 +140,7 @@ class ImagePreprocessor:
         """
         # Load as uint8
         img = Image.open(image_path).convert("RGB")
-        image = np.array(img)
-        
-        # Resize
-        image = cls.resize(image)
-        
-        # 3. Apply CLAHE
-        image = cls.apply_clahe(image) # <--- THIS LINE IS NOW ACTIVE!
-        
-        # Apply DenseNet preprocessing
-        from tensorflow.keras.applications.densenet import preprocess_input
-        image = preprocess_input(image)
-        
-        return image
+        return cls.preprocess_array(np.array(img))
 
 
 # Test function
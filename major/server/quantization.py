@@ -0,0 +1,154 @@
+import os
+import threading
+import numpy as np
+import tensorflow as tf
+import cv2
+from typing import Callable, List, Optional
+
+try:
+    from ai_edge_litert.interpreter import Interpreter
+except ImportError:  # Older TF builds ship the interpreter themselves
+    Interpreter = tf.lite.Interpreter
+
+
+# Post-training quantization modes:
+#   dynamic - int8 weights, float activations (no calibration needed)
+#   int8    - int8 weights and activations, calibrated on sample X-rays
+QUANTIZATION_MODES = ("dynamic", "int8")
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def load_calibration_set(data_dir: str, prepare: Callable[[np.ndarray], np.ndarray],
+                         limit: int = 100, class_names=("NORMAL", "PNEUMONIA")) -> List[np.ndarray]:
+    """
+    Model inputs for int8 calibration, taken evenly from each class folder
+    of data_dir (e.g. dataset/train/NORMAL, dataset/train/PNEUMONIA)
+    """
+    per_class = max(1, limit // len(class_names))
+    samples = []
+    for class_name in class_names:
+        class_path = os.path.join(data_dir, class_name)
+        if not os.path.isdir(class_path):
+            continue
+        names = sorted(n for n in os.listdir(class_path) if n.lower().endswith(IMAGE_EXTENSIONS))
+        # Spread picks over the folder instead of taking the first files
+        step = max(1, len(names) // per_class)
+        for name in names[::step][:per_class]:
+            img = cv2.imread(os.path.join(class_path, name))
+            if img is not None:
+                samples.append(prepare(img))
+    return samples
+
+
+def quantize_model(model, mode: str, calibration: Optional[List[np.ndarray]] = None) -> bytes:
+    """Convert a Keras model to a quantized TFLite flatbuffer"""
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode: {mode}. Choose from: {', '.join(QUANTIZATION_MODES)}")
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if mode == "int8":
+        if not calibration:
+            raise ValueError("int8 quantization needs calibration images")
+
+        def representative_dataset():
+            for sample in calibration:
+                yield [np.expand_dims(sample, axis=0).astype(np.float32)]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        # Float input/output keep the same preprocessing as the Keras model
+    return converter.convert()
+
+
+def quantized_model_path(model_path: str, mode: str) -> str:
+    return f"{os.path.splitext(model_path)[0]}_{mode}.tflite"
+
+
+def load_or_quantize(model_path: str, mode: str, model=None,
+                     calibration_fn: Callable[[], List[np.ndarray]] = None) -> bytes:
+    """
+    Quantized flatbuffer for model_path, converted once and cached next to
+    the .h5 until the .h5 changes
+    """
+    cached_path = quantized_model_path(model_path, mode)
+    if os.path.exists(cached_path) and os.path.getmtime(cached_path) >= os.path.getmtime(model_path):
+        with open(cached_path, "rb") as f:
+            return f.read()
+
+    print(f"⚙ Quantizing {os.path.basename(model_path)} ({mode})...")
+    if model is None:
+        model = tf.keras.models.load_model(model_path, compile=False)
+    calibration = calibration_fn() if mode == "int8" and calibration_fn else None
+    content = quantize_model(model, mode, calibration)
+    try:
+        with open(cached_path, "wb") as f:
+            f.write(content)
+        print(f"✓ Cached quantized model: {cached_path}")
+    except OSError as e:
+        print(f"⚠ Could not cache quantized model: {e}")
+    return content
+
+
+class QuantizedBackend:
+    """
+    TFLite inference for a sigmoid classifier.
+    Resizing an interpreter re-allocates all its tensors, and micro-batches vary in
+    size from call to call, so there is one interpreter per power-of-two batch size,
+    allocated once; batches are zero-padded up to their bucket and the scores sliced.
+    (An interpreter per exact size would hold an activation arena for every size:
+    buckets keep the total under twice the largest one.)
+    Calls on the same interpreter are serialized.
+    """
+
+    def __init__(self, model_content: bytes, mode: str, num_threads: Optional[int] = None):
+        self.mode = mode
+        self.size_bytes = len(model_content)
+        self._content = model_content
+        self._num_threads = num_threads
+        self._buckets = {}  # batch size -> (interpreter, input details, output index, lock)
+        self._buckets_lock = threading.Lock()
+        self._bucket(1)
+
+    @staticmethod
+    def bucket_size(n: int) -> int:
+        """Interpreter batch size for n images: the smallest power of two >= n"""
+        return 1 << max(0, int(n) - 1).bit_length()
+
+    def _bucket(self, size: int):
+        with self._buckets_lock:
+            bucket = self._buckets.get(size)
+            if bucket is None:
+                interpreter = Interpreter(model_content=self._content, num_threads=self._num_threads)
+                input_details = interpreter.get_input_details()[0]
+                interpreter.resize_tensor_input(input_details["index"], [size] + list(input_details["shape"][1:]))
+                interpreter.allocate_tensors()
+                bucket = (interpreter, input_details, interpreter.get_output_details()[0]["index"], threading.Lock())
+                self._buckets[size] = bucket
+            return bucket
+
+    def prepare(self, max_batch_size: int):
+        """Allocate the interpreter of every batch size up to max_batch_size ahead of the first requests"""
+        for size in sorted({self.bucket_size(n) for n in range(1, max_batch_size + 1)}):
+            self._bucket(size)
+
+    @property
+    def batch_sizes(self) -> List[int]:
+        with self._buckets_lock:
+            return sorted(self._buckets)
+
+    def predict_scores(self, batch: np.ndarray) -> np.ndarray:
+        """(N, 224, 224, 3) float32 batch -> N pneumonia scores"""
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        n = batch.shape[0]
+        size = self.bucket_size(n)
+        if size != n:
+            padded = np.zeros((size,) + batch.shape[1:], dtype=np.float32)
+            padded[:n] = batch
+            batch = padded
+        interpreter, input_details, output_index, lock = self._bucket(size)
+        with lock:
+            interpreter.set_tensor(input_details["index"], batch)
+            interpreter.invoke()
+            return interpreter.get_tensor(output_index)[:n, 0].copy()
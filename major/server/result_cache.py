@@ -0,0 +1,199 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+from telemetry import CACHE_LOOKUPS, log
+
+logger = log.getChild(__name__)  # pneumonia.result_cache, so it shares the request-id handler
+
+
+class AnalysisCache:
+    """
+    Content-addressed cache for analysis results.
+    In-memory LRU bounded by an approximate byte budget, an optional on-disk
+    tier, and coalescing of identical in-flight requests.
+    Cached results are shared between callers: treat them as read-only.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, disk_dir: str = None,
+                 max_disk_bytes: int = 1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (result, size)
+        self._bytes = 0
+        self._inflight = {}
+
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evictions = 0
+
+        self._disk_bytes = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_bytes = sum(e.stat().st_size for e in os.scandir(disk_dir) if e.name.endswith(".pkl"))
+
+    @staticmethod
+    def make_key(image_bytes: bytes, *parts) -> str:
+        """sha256 over the image bytes plus anything else the result depends on"""
+        h = hashlib.sha256()
+        for part in parts:
+            h.update(str(part).encode("utf-8"))
+            h.update(b"\0")
+        h.update(image_bytes)
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        """Memory tier lookup only (cheap, never blocks on computation)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+        CACHE_LOOKUPS.inc(result="hit")
+        return entry[0]
+
+    def get_or_compute(self, key: str, compute: Callable[[], dict]) -> dict:
+        """Return the cached result for key, computing it at most once at a time"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+            else:
+                future = self._inflight.get(key)
+                owner = future is None
+                if owner:
+                    future = Future()
+                    self._inflight[key] = future
+                else:
+                    self._coalesced += 1
+
+        if entry is not None:
+            CACHE_LOOKUPS.inc(result="hit")
+            return entry[0]
+        if not owner:
+            CACHE_LOOKUPS.inc(result="coalesced")
+            return future.result()
+
+        try:
+            result = self._read_disk(key)
+            if result is not None:
+                with self._lock:
+                    self._disk_hits += 1
+                CACHE_LOOKUPS.inc(result="disk_hit")
+            else:
+                with self._lock:
+                    self._misses += 1
+                CACHE_LOOKUPS.inc(result="miss")
+                result = compute()
+                if result.get("status") == "success":
+                    self._write_disk(key, result)
+
+            if result.get("status") == "success":
+                self._put(key, result)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    @staticmethod
+    def _estimate_size(value) -> int:
+        """Approximate bytes held by a result (dominated by encoded artifacts)"""
+        if isinstance(value, (bytes, str)):
+            return len(value)
+        if isinstance(value, dict):
+            return sum(len(str(k)) + AnalysisCache._estimate_size(v) for k, v in value.items())
+        if isinstance(value, (list, tuple)):
+            return sum(AnalysisCache._estimate_size(v) for v in value)
+        return 8
+
+    def _put(self, key: str, result: dict):
+        size = self._estimate_size(result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (result, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._evictions += 1
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.pkl")
+
+    def _read_disk(self, key: str) -> Optional[dict]:
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key), "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def _write_disk(self, key: str, result: dict):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._disk_bytes += len(data)
+                over_budget = self._disk_bytes > self.max_disk_bytes
+            if over_budget:
+                self._trim_disk()
+        except OSError as e:
+            logger.warning("⚠ Could not write cache entry: %s", e)
+
+    def _trim_disk(self):
+        """Drop the oldest disk entries until under budget"""
+        files = sorted((e for e in os.scandir(self.disk_dir) if e.name.endswith(".pkl")),
+                       key=lambda e: e.stat().st_mtime)
+        total = sum(e.stat().st_size for e in files)
+        for entry in files:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                total -= size
+            except OSError:
+                continue
+        with self._lock:
+            self._disk_bytes = total
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._disk_hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "coalesced": self._coalesced,
+                "evictions": self._evictions,
+                "hit_rate": ((self._hits + self._disk_hits) / lookups) if lookups else 0.0,
+                "disk_bytes": self._disk_bytes if self.disk_dir else None,
+            }
@@ -0,0 +1,318 @@
+"""
+Hot-path instrumentation: per-stage timers, counters and levelled logging.
+
+Metrics are kept in-process and rendered in the Prometheus text format for
+/metrics (no client library needed). Worker processes forward their
+observations to the API process with each response. Every log line and span
+carries the request id of the HTTP request it belongs to.
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+log = logging.getLogger("pneumonia")
+
+# Id of the request being served, and the (stage, seconds) spans recorded for it
+request_id = contextvars.ContextVar("request_id", default="-")
+_spans = contextvars.ContextVar("spans", default=None)
+# Stage-milestone callback of the job an analysis belongs to (None outside jobs)
+_progress = contextvars.ContextVar("progress", default=None)
+# [peak RSS bytes] of the analysis being tracked, sampled at every span end
+_rss_peak = contextvars.ContextVar("rss_peak", default=None)
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labels: dict) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in key]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, registry: "Registry", name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self._registry = registry
+        registry._metrics[name] = self
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, registry, name, help_text):
+        super().__init__(registry, name, help_text)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        if self._registry._forward(self, key, amount):
+            return
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _apply(self, amount, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_format_labels(k)} {v:g}" for k, v in values]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, registry, name, help_text):
+        super().__init__(registry, name, help_text)
+        self._values: Dict[tuple, float] = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = float(value)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_format_labels(k)} {v:g}" for k, v in values]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, help_text, buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, help_text)
+        self.buckets = tuple(buckets)
+        self._series: Dict[tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        if self._registry._forward(self, key, value):
+            return
+        self._add(key, value)
+
+    def _apply(self, value, **labels):
+        self._add(_label_key(labels), value)
+
+    def _add(self, key, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted((k, list(v)) for k, v in self._series.items())
+        lines = self._header()
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                le = 'le="%g"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(key, le)} {values[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {values[-2]:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {values[-1]}")
+        return lines
+
+
+class Registry:
+    """All metrics of this process, rendered together for /metrics"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._pending: Optional[list] = None
+
+    def _forward(self, metric, key, value) -> bool:
+        """In forwarding mode, queue the observation instead of recording it"""
+        pending = self._pending
+        if pending is None:
+            return False
+        pending.append((metric.name, key, value))
+        return True
+
+    def start_forwarding(self):
+        """Worker processes: keep observations for drain() instead of aggregating them"""
+        self._pending = []
+
+    def drain(self) -> list:
+        """Observations queued since the last drain"""
+        pending, self._pending = self._pending, []
+        return pending
+
+    def replay(self, observations: list):
+        """Record observations drained in another process (spans join the current request)"""
+        for name, key, value in observations:
+            metric = self._metrics.get(name)
+            if metric is None:
+                continue
+            labels = dict(key)
+            metric._apply(value, **labels)
+            if metric is STAGE_SECONDS:
+                _record_span(labels["stage"], value)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = Histogram(REGISTRY, "pneumonia_stage_seconds", "Time spent in each analysis stage")
+QUEUE_WAIT_SECONDS = Histogram(REGISTRY, "pneumonia_queue_wait_seconds", "Time analyses waited for a worker slot")
+REQUEST_SECONDS = Histogram(REGISTRY, "pneumonia_request_seconds", "HTTP request latency by endpoint")
+BATCH_SIZE = Histogram(REGISTRY, "pneumonia_batch_size", "Images per forward pass",
+                       buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+REQUESTS = Counter(REGISTRY, "pneumonia_requests_total", "HTTP requests by endpoint and status code")
+CACHE_LOOKUPS = Counter(REGISTRY, "pneumonia_cache_lookups_total", "Result cache lookups by outcome")
+ERRORS = Counter(REGISTRY, "pneumonia_errors_total", "Failures by stage (including ones with a fallback)")
+REJECTED = Counter(REGISTRY, "pneumonia_rejected_total", "Analyses rejected because the queue was full")
+QUEUE_DEPTH = Gauge(REGISTRY, "pneumonia_queue_depth", "Analyses waiting for a worker slot")
+ACTIVE = Gauge(REGISTRY, "pneumonia_active_analyses", "Analyses running")
+ANALYSIS_PEAK_RSS_MB = Histogram(REGISTRY, "pneumonia_analysis_peak_rss_mb",
+                                 "Process RSS high point during each analysis (sampled at stage ends)",
+                                 buckets=(128, 256, 512, 1024, 2048, 4096, 8192, 16384))
+JOBS = Counter(REGISTRY, "pneumonia_jobs_total", "Analysis jobs submitted and finished, by outcome")
+JOB_QUEUE_DEPTH = Gauge(REGISTRY, "pneumonia_job_images_queued", "Job images waiting for a runner")
+
+
+def _record_span(stage: str, seconds: float):
+    spans = _spans.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("span %s %.1fms", stage, seconds * 1000.0)
+
+
+@contextmanager
+def span(stage: str):
+    """Time a stage: histogram observation, request span and a debug log line"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        if REGISTRY._pending is None:
+            _record_span(stage, elapsed)
+        peak = _rss_peak.get()
+        if peak is not None:
+            peak[0] = max(peak[0], current_rss_bytes())
+
+
+def current_rss_bytes() -> int:
+    """Resident set size of this process (Linux; 0 elsewhere)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+@contextmanager
+def track_peak_rss():
+    """
+    Peak process RSS while the block runs, sampled at its start and at every
+    span end; yields a dict that gets peak_rss_mb on exit. RSS is per process,
+    so concurrent analyses in the same process share it.
+    """
+    peak = [current_rss_bytes()]
+    memory = {"start_rss_mb": round(peak[0] / 2**20, 1)}
+    token = _rss_peak.set(peak)
+    try:
+        yield memory
+    finally:
+        _rss_peak.reset(token)
+        memory["peak_rss_mb"] = round(max(peak[0], current_rss_bytes()) / 2**20, 1)
+        ANALYSIS_PEAK_RSS_MB.observe(memory["peak_rss_mb"])
+
+
+def record_error(stage: str, error: Exception):
+    """Count a stage failure that was handled (fallback result) and log it"""
+    ERRORS.inc(stage=stage)
+    log.warning("%s failed: %s", stage, error)
+
+
+def begin_request(rid: str):
+    """Start collecting spans for a request; returns tokens for end_request"""
+    return request_id.set(rid), _spans.set([])
+
+
+def end_request(tokens) -> List[Tuple[str, float]]:
+    """Spans recorded for the request, in the order they finished"""
+    spans = _spans.get() or []
+    request_id.reset(tokens[0])
+    _spans.reset(tokens[1])
+    return spans
+
+
+def track_progress(callback):
+    """Send stage milestones of analyses run from this context to callback(stage)"""
+    return _progress.set(callback)
+
+
+def untrack_progress(token):
+    _progress.reset(token)
+
+
+def tracking_progress() -> bool:
+    return _progress.get() is not None
+
+
+def report_progress(stage: str):
+    """Milestone of the analysis being run (e.g. "inference" done); a no-op outside jobs"""
+    callback = _progress.get()
+    if callback is not None:
+        callback(stage)
+
+
+def format_spans(spans) -> str:
+    return " ".join(f"{stage}={seconds * 1000.0:.1f}ms" for stage, seconds in spans)
+
+
+class _RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        if not hasattr(record, "request_id"):  # Callers may pass it via extra=
+            record.request_id = request_id.get()
+        return True
+
+
+def configure_logging(level=None):
+    """Levelled logging with request ids (PNEUMONIA_LOG_LEVEL, default INFO)"""
+    level = level or os.getenv("PNEUMONIA_LOG_LEVEL", "INFO")
+    handler = logging.StreamHandler()
+    handler.addFilter(_RequestIdFilter())
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(request_id)s] %(message)s"))
+    log.handlers[:] = [handler]
+    log.setLevel(level if isinstance(level, int) else str(level).upper())
+    log.propagate = False
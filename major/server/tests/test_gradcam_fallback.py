@@ -0,0 +1,48 @@
+"""
+Grad-CAM fallback generators: the vectorized versions against the original
+loops (kept in benchmark_gradcam_fallback.py), plus a loose time bound.
+"""
+import numpy as np
+import pytest
+
+from gradcam import GradCAM, _simulated_heatmap_template
+from benchmark_gradcam_fallback import best_of, legacy_enhance_heatmap, legacy_simulated_heatmap
+
+SHAPES = [(32, 32), (48, 64), (61, 37)]
+
+
+@pytest.fixture
+def gradcam():
+    return GradCAM.__new__(GradCAM)  # Fallback paths need no model
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_simulated_heatmap_matches_loop(gradcam, shape):
+    _simulated_heatmap_template.cache_clear()
+    heatmap, heatmap_colored = gradcam._create_simulated_heatmap(shape)
+    np.testing.assert_allclose(heatmap, legacy_simulated_heatmap(shape), atol=1e-6)
+    assert heatmap_colored.shape == shape + (3,)
+
+
+def test_simulated_heatmap_is_not_shared(gradcam):
+    heatmap, _ = gradcam._create_simulated_heatmap((32, 32))
+    heatmap[:] = 0
+    assert gradcam._create_simulated_heatmap((32, 32))[0].max() > 0
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_enhance_heatmap_matches_loop(gradcam, shape):
+    weak = np.full(shape, 0.01, dtype=np.float32)
+    expected = legacy_enhance_heatmap(weak.copy(), np.random.default_rng(0))
+    actual = gradcam._enhance_heatmap(weak.copy(), np.random.default_rng(0))
+    np.testing.assert_allclose(actual, expected, atol=1e-5)
+
+
+def test_fallback_cost_upper_bound(gradcam):
+    # Loose on purpose: the vectorized path takes under 1 ms at 224x224 and the loops ~60 ms
+    shape = (224, 224)
+    weak = np.full(shape, 0.01, dtype=np.float32)
+    gradcam._create_simulated_heatmap(shape)
+    total_ms = best_of(lambda: gradcam._create_simulated_heatmap(shape), 5) + \
+        best_of(lambda: gradcam._enhance_heatmap(weak.copy()), 5)
+    assert total_ms < 20.0
@@ -4,7 +4,7 @@ import tensorflow as tf
 import joblib
 import matplotlib.pyplot as plt
 import seaborn as sns
-from typing import Tuple, Dict
+from typing import Tuple, Dict, List
 
 # Scikit-learn Tools
 from sklearn.svm import SVC
@@ -17,11 +17,11 @@ from sklearn.calibration import CalibratedClassifierCV
 
 # TensorFlow / Keras
 from tensorflow.keras.applications import DenseNet121
-from tensorflow.keras.applications.densenet import preprocess_input
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
 
 # ⚠️ Make sure your 'preprocessing.py' is in the same folder
 from preprocessing import ImagePreprocessor
+from feature_store import FeatureStore, content_hash
+from data_pipeline import make_dataset
 
 # -----------------------------
 # CONFIG
@@ -32,48 +32,60 @@ BATCH_SIZE = 32
 MODEL_DIR = "models"
 os.makedirs(MODEL_DIR, exist_ok=True)
 CLASS_NAMES = ["NORMAL", "PNEUMONIA"]
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+FEATURE_DIR = os.path.join(MODEL_DIR, "features")  # Memory-mapped feature cache
+PREPROCESSED_DIR = os.path.join(MODEL_DIR, "preprocessed")  # tf.data cache of decoded uint8 images
 
 # -----------------------------
-# DATA GENERATOR LOGIC
+# FEATURE EXTRACTION (cached)
 # -----------------------------
-def get_data_generators(data_dir: str, batch_size: int, target_size: Tuple[int, int]):
-    """Creates generators with CLAHE + DenseNet preprocessing."""
+def list_images(data_dir: str) -> Tuple[List[str], np.ndarray]:
+    """Image paths and labels (index into CLASS_NAMES) of one split"""
+    paths, labels = [], []
+    for label, class_name in enumerate(CLASS_NAMES):
+        class_path = os.path.join(data_dir, class_name)
+        if not os.path.isdir(class_path): continue
+        for name in sorted(os.listdir(class_path)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(class_path, name))
+                labels.append(label)
+    return paths, np.asarray(labels)
+
+def feature_version(feature_extractor) -> str:
+    """Preprocessing + backbone identity; cached features are only reused for the same pair"""
+    return f"{ImagePreprocessor.VERSION}|{feature_extractor.name}:{feature_extractor.count_params()}:imagenet"
+
+def extract_features(paths: List[str], feature_extractor, store: FeatureStore, batch_size: int) -> np.ndarray:
+    """
+    DenseNet pooled features for each image.
+    Only images whose content isn't in the store yet go through the network;
+    the rest are read straight from the memory-mapped shards.
+    """
+    keys = [content_hash(p) for p in paths]
+    missing = store.missing(keys)
+    path_for = dict(zip(keys, paths))
+    print(f"   {len(keys) - len(missing)} cached, {len(missing)} to extract")
+    if not missing:
+        return store.get(keys)
+
+    # Parallel tf.data input keeps DenseNet busy; decoded tensors are cached for re-extraction
+    dataset = make_dataset([path_for[k] for k in missing], batch_size=batch_size,
+                           cache_dir=PREPROCESSED_DIR)
     
-    # Training Data with Augmentation
-    train_datagen = ImageDataGenerator(
-        rotation_range=15,
-        width_shift_range=0.1,
-        height_shift_range=0.1,
-        shear_range=0.1,
-        zoom_range=0.1,
-        horizontal_flip=True,
-        fill_mode='nearest',
-        preprocessing_function=lambda x: preprocess_input(ImagePreprocessor.apply_clahe(x.astype('uint8')))
-    )
-    
-    # Test/Val Data (No Augmentation)
-    test_val_datagen = ImageDataGenerator(
-        preprocessing_function=lambda x: preprocess_input(ImagePreprocessor.apply_clahe(x.astype('uint8')))
-    )
-
-    train_gen = train_datagen.flow_from_directory(
-        os.path.join(data_dir, 'train'), target_size=target_size,
-        batch_size=batch_size, class_mode='categorical', color_mode='rgb', shuffle=True
-    )
-    
-    test_gen = test_val_datagen.flow_from_directory(
-        os.path.join(data_dir, 'test'), target_size=target_size,
-        batch_size=batch_size, class_mode='categorical', color_mode='rgb', shuffle=False
-    )
-    
-    return train_gen, test_gen
-
-def extract_features(generator, feature_extractor):
-    """Extracts features (avg pooling) from DenseNet."""
-    generator.reset()
-    features = feature_extractor.predict(generator, verbose=1)
-    labels = generator.classes
-    return features, labels
+    # One shard per run keeps a split contiguous, so it maps back without copying
+    writer = None
+    done = 0
+    for batch, _ in dataset:
+        features = np.asarray(feature_extractor.predict_on_batch(batch))
+        if writer is None:
+            writer = store.shard_writer(len(missing), features.shape[1])
+        writer.append(missing[done:done + len(features)], features)
+        done += len(features)
+        print(f"   ✓ {done}/{len(missing)} extracted", end="\r")
+    if writer is not None:
+        print()
+
+    return store.get(keys)
 
 # -----------------------------
 # MAIN TRAINING PIPELINE
@@ -84,7 +96,8 @@ def main():
     print("="*60)
     
     # 1. Prepare Data
-    train_gen, test_gen = get_data_generators(DATASET_DIR, BATCH_SIZE, IMG_SIZE)
+    train_paths, y_train = list_images(os.path.join(DATASET_DIR, 'train'))
+    test_paths, y_test = list_images(os.path.join(DATASET_DIR, 'test'))
     
     # 2. Load Feature Extractor
     print("\n🏗️ Loading DenseNet121...")
@@ -92,10 +105,12 @@ def main():
                           input_shape=(IMG_SIZE[0], IMG_SIZE[1], 3), pooling='avg')
     densenet.trainable = False
     
-    # 3. Extract Features
+    # 3. Extract Features (only new or changed images; the rest come from the store)
     print("\n2️⃣ Extracting features (This may take a few minutes)...")
-    X_train, y_train = extract_features(train_gen, densenet)
-    X_test, y_test = extract_features(test_gen, densenet)
+    store = FeatureStore(FEATURE_DIR, feature_version(densenet))
+    X_train = extract_features(train_paths, densenet, store, BATCH_SIZE)
+    X_test = extract_features(test_paths, densenet, store, BATCH_SIZE)
+    print(f"   Feature store: {store.stats()}")
 
     # 4. Train Models with Calibration
     print("\n3️⃣ Training ML Models with Pipelines & Calibration...")
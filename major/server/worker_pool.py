@@ -0,0 +1,405 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from typing import List, Optional
+
+import telemetry
+
+
+def available_cpus() -> List[int]:
+    """CPUs this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_cpu_sets(num_workers: int, threads_per_worker: int) -> List[List[int]]:
+    """Disjoint CPU sets per worker (wrapping around when oversubscribed)"""
+    cpus = available_cpus()
+    return [
+        [cpus[(i * threads_per_worker + j) % len(cpus)] for j in range(threads_per_worker)]
+        for i in range(num_workers)
+    ]
+
+
+def _worker_main(conn, index, threads, cpus, engine_kwargs, cache_kwargs, log_level):
+    """
+    Worker process: pin threads and CPUs, load the engine, then serve
+    (method, args, request id, progress) requests from the API process until told to stop.
+    Metric observations and result cache counters go back with each response instead of
+    staying here; with progress set, stage milestones are sent ahead of the response as
+    they happen.
+    """
+    telemetry.configure_logging(log_level)
+    telemetry.REGISTRY.start_forwarding()
+    # The thread environment (worker_environment) came with the process: spawn has
+    # already re-imported the parent's __main__, and TensorFlow with it, by now.
+    # The explicit settings below pin whatever the environment did not.
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+    import cv2
+    import tensorflow as tf
+    cv2.setNumThreads(threads)
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    try:
+        from final_predictor import PneumoniaAI
+        from result_cache import AnalysisCache
+        result_cache = AnalysisCache(**cache_kwargs) if cache_kwargs else None
+        engine = PneumoniaAI(result_cache=result_cache, **engine_kwargs)
+    except Exception as e:
+        traceback.print_exc()
+        conn.send(("error", f"Worker {index} failed to load: {e}"))
+        return
+
+    conn.send(("ok", {
+        "model_version": engine.model_version,
+        "backend": engine.backend,
+        "startup_timings": engine.startup_timings,
+    }))
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        method, args, rid, progress = request
+        telemetry.request_id.set(rid)
+        token = telemetry.track_progress(lambda stage: conn.send(("progress", stage, None, None))) if progress else None
+        try:
+            status, result = "ok", getattr(engine, method)(*args)
+        except Exception as e:
+            traceback.print_exc()
+            status, result = "error", f"{type(e).__name__}: {e}"
+        finally:
+            if token is not None:
+                telemetry.untrack_progress(token)
+        cache_stats = engine.result_cache.stats() if engine.result_cache else None
+        conn.send((status, result, telemetry.REGISTRY.drain(), cache_stats))
+
+    engine.close()
+
+
+def worker_environment(threads: int) -> dict:
+    """Thread variables a worker needs before TensorFlow / OpenCV / OpenMP are imported"""
+    return {
+        "OMP_NUM_THREADS": str(threads),
+        "TF_NUM_INTRAOP_THREADS": str(threads),
+        "TF_NUM_INTEROP_THREADS": "1",
+    }
+
+
+_environment_lock = threading.Lock()
+
+
+class WorkerCrashedError(RuntimeError):
+    """The worker process died while (or before) serving the request"""
+
+
+class _Worker:
+    def __init__(self, index, cpus):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.cpus = cpus
+        self.lock = threading.Lock()  # One request in flight per worker
+        self.pending = 0  # Requests dispatched here and not finished (including the running one)
+        self.restarting = False
+        self.restarts = 0
+        self.completed = 0
+        self.busy_seconds = 0.0
+        self.cache_stats = None  # Latest result cache counters reported by the worker
+
+
+class _PoolCacheStats:
+    """Result cache counters summed over the workers' own caches (for /api/health)"""
+
+    _SUMMED = ("entries", "bytes", "max_bytes", "hits", "disk_hits", "misses", "coalesced", "evictions")
+
+    def __init__(self, pool: "WorkerPool"):
+        self._pool = pool
+
+    def stats(self) -> dict:
+        reported = [w.cache_stats for w in self._pool._workers if w.cache_stats]
+        totals = {name: sum(s[name] for s in reported) for name in self._SUMMED}
+        lookups = totals["hits"] + totals["disk_hits"] + totals["misses"]
+        totals["hit_rate"] = ((totals["hits"] + totals["disk_hits"]) / lookups) if lookups else 0.0
+        # The disk tier is shared, so every worker sees the same size
+        disk = [s["disk_bytes"] for s in reported if s.get("disk_bytes") is not None]
+        totals["disk_bytes"] = max(disk) if disk else None
+        totals["workers_reporting"] = len(reported)
+        return totals
+
+
+class WorkerPool:
+    """
+    Serves analyses from N worker processes, each with its own engine,
+    pinned thread counts and CPU affinity.
+    Requests travel over pipes as raw image bytes; results come back as
+    dicts with encoded artifacts (no base64).
+    Each request goes to the least-loaded worker. The worker that last analysed an
+    image is preferred while it is idle (its memory cache and skipped-stage inputs are
+    there), and complete_analysis goes back to it. Dead workers are respawned.
+    Exposes the subset of the PneumoniaAI interface the API uses.
+    """
+
+    batcher = None  # Each worker handles one request at a time
+    gradcam_batcher = None
+
+    def __init__(self, num_workers: int, threads_per_worker: int = 1, engine_kwargs: dict = None,
+                 cache_kwargs: dict = None, pin_cpus: bool = True):
+        """
+        engine_kwargs: PneumoniaAI arguments for every worker
+        cache_kwargs: AnalysisCache arguments; each worker gets its own cache
+        pin_cpus: give each worker a disjoint set of threads_per_worker CPUs
+        """
+        self.num_workers = max(1, int(num_workers))
+        self.threads_per_worker = max(1, int(threads_per_worker))
+        self._engine_kwargs = dict(engine_kwargs or {})
+        self._engine_kwargs["max_batch_size"] = 1
+        self._cache_kwargs = cache_kwargs
+        self.result_cache = _PoolCacheStats(self) if cache_kwargs else None
+
+        cpu_sets = plan_cpu_sets(self.num_workers, self.threads_per_worker) if pin_cpus else \
+            [None] * self.num_workers
+        self._context = multiprocessing.get_context("spawn")  # Fresh TF runtime per worker
+        self._dispatch_lock = threading.Lock()
+        # image key -> index of the worker that last analysed it
+        self._owners = OrderedDict()
+        self._max_owners = 4096 * self.num_workers
+        self._warmed_up = False
+        self._closed = False
+
+        start = time.perf_counter()
+        self._workers = [_Worker(index, cpus) for index, cpus in enumerate(cpu_sets)]
+        for worker in self._workers:
+            self._spawn(worker)
+
+        # Workers load in parallel; wait for all of them
+        infos = []
+        for worker in self._workers:
+            status, info = worker.conn.recv()
+            if status != "ok":
+                self.close()
+                raise RuntimeError(info)
+            infos.append(info)
+
+        self.model_version = infos[0]["model_version"]
+        self.backend = infos[0]["backend"]
+        self.startup_timings = {
+            name: max(info["startup_timings"].get(name, 0.0) for info in infos)
+            for name in infos[0]["startup_timings"]
+        }
+        self.startup_timings["workers"] = time.perf_counter() - start
+        print(f"✓ Worker pool ready: {self.num_workers} workers x {self.threads_per_worker} threads")
+
+    # ---------- worker lifecycle ----------
+
+    def _spawn(self, worker: _Worker):
+        """Start the worker's process; the caller waits for its ready message"""
+        parent_conn, child_conn = self._context.Pipe()
+        worker.process = self._context.Process(
+            target=_worker_main, name=f"pneumonia-worker-{worker.index}", daemon=True,
+            args=(child_conn, worker.index, self.threads_per_worker, worker.cpus, self._engine_kwargs,
+                  self._cache_kwargs, telemetry.log.getEffectiveLevel())
+        )
+        # Spawned children copy os.environ at start(), before importing anything,
+        # so the thread variables are set here for the duration of the start
+        with _environment_lock:
+            saved = {var: os.environ.get(var) for var in worker_environment(self.threads_per_worker)}
+            os.environ.update(worker_environment(self.threads_per_worker))
+            try:
+                worker.process.start()
+            finally:
+                for var, value in saved.items():
+                    if value is None:
+                        os.environ.pop(var, None)
+                    else:
+                        os.environ[var] = value
+        child_conn.close()
+        worker.conn = parent_conn
+
+    def _respawn(self, worker: _Worker):
+        """Replace a dead worker in the background; it takes no requests until it is ready"""
+        with self._dispatch_lock:
+            if worker.restarting or self._closed:
+                return
+            worker.restarting = True
+            for key in [k for k, owner in self._owners.items() if owner == worker.index]:
+                del self._owners[key]
+        threading.Thread(target=self._restart, args=(worker,), name=f"respawn-worker-{worker.index}",
+                         daemon=True).start()
+
+    def _restart(self, worker: _Worker):
+        with worker.lock:
+            telemetry.log.warning("⚠ Worker %d (pid %s) died, respawning", worker.index, worker.process.pid)
+            try:
+                worker.conn.close()
+            except OSError:
+                pass
+            worker.process.join(timeout=1)
+            worker.cache_stats = None
+            try:
+                self._spawn(worker)
+                status, info = worker.conn.recv()
+                if status != "ok":
+                    raise RuntimeError(info)
+                if self._warmed_up:
+                    self._send(worker, "warmup")
+                worker.restarts += 1
+                telemetry.log.info("✅ Worker %d respawned (pid %s)", worker.index, worker.process.pid)
+            except Exception as e:
+                telemetry.log.error("❌ Worker %d could not be respawned: %s", worker.index, e)
+            finally:
+                with self._dispatch_lock:
+                    worker.restarting = False
+
+    # ---------- dispatch ----------
+
+    def _send(self, worker: _Worker, method: str, *args):
+        """One request / response on a worker whose lock the caller holds"""
+        try:
+            worker.conn.send((method, args, telemetry.request_id.get(), telemetry.tracking_progress()))
+            status, result, observations, cache_stats = worker.conn.recv()
+            while status == "progress":
+                telemetry.report_progress(result)
+                status, result, observations, cache_stats = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            raise WorkerCrashedError(f"Worker {worker.index} stopped while serving {method}: {e}")
+        if cache_stats is not None:
+            worker.cache_stats = cache_stats
+        telemetry.REGISTRY.replay(observations)
+        return status, result
+
+    def _call(self, worker: _Worker, method: str, *args):
+        try:
+            with worker.lock:
+                start = time.perf_counter()
+                try:
+                    status, result = self._send(worker, method, *args)
+                finally:
+                    worker.busy_seconds += time.perf_counter() - start
+                    worker.completed += 1
+        except WorkerCrashedError:
+            self._respawn(worker)
+            raise
+        finally:
+            with self._dispatch_lock:
+                worker.pending -= 1
+        if status != "ok":
+            raise RuntimeError(result)
+        return result
+
+    def _pick(self, preferred: Optional[int] = None) -> _Worker:
+        """
+        Reserve a worker for one request: the preferred one if it is idle, otherwise
+        the one with the fewest requests in flight. Dead workers are respawned and skipped.
+        """
+        for worker in self._workers:
+            if not worker.restarting and worker.process is not None and not worker.process.is_alive():
+                self._respawn(worker)
+        with self._dispatch_lock:
+            ready = [w for w in self._workers if not w.restarting] or self._workers
+            worker = self._workers[preferred] if preferred is not None else None
+            if worker is None or worker.restarting or worker.pending > 0:
+                worker = min(ready, key=lambda w: (w.pending, w.busy_seconds))
+            worker.pending += 1
+            return worker
+
+    def _owner(self, image_key: str) -> Optional[int]:
+        with self._dispatch_lock:
+            return self._owners.get(image_key)
+
+    def _remember_owner(self, image_key: str, worker: _Worker):
+        with self._dispatch_lock:
+            self._owners[image_key] = worker.index
+            self._owners.move_to_end(image_key)
+            while len(self._owners) > self._max_owners:
+                self._owners.popitem(last=False)
+
+    def _broadcast(self, method: str) -> list:
+        results = [None] * self.num_workers
+
+        def run(worker):
+            with self._dispatch_lock:
+                worker.pending += 1
+            results[worker.index] = self._call(worker, method)
+
+        threads = [threading.Thread(target=run, args=(w,)) for w in self._workers]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    # ---------- engine interface ----------
+
+    def full_analysis_bytes(self, image_bytes, filename="upload", include=None, encoder=None):
+        image_key = hashlib.sha256(image_bytes).hexdigest()
+        worker = self._pick(self._owner(image_key))
+        result = self._call(worker, "full_analysis_bytes", image_bytes, filename, include, encoder)
+        self._remember_owner(image_key, worker)
+        return result
+
+    def complete_analysis(self, image_key, include, encoder=None):
+        owner = self._owner(image_key) if image_key else None
+        if owner is None:
+            return {"status": "error", "message": "Image is no longer cached, please re-submit it"}
+        # Only that worker holds the image's skipped-stage inputs, so wait for it
+        worker = self._workers[owner]
+        with self._dispatch_lock:
+            worker.pending += 1
+        return self._call(worker, "complete_analysis", image_key, include, encoder)
+
+    def predict_batch_bytes(self, contents, with_ensemble=False, with_heatmap=False, encoder=None):
+        return self._call(self._pick(), "predict_batch_bytes", contents, with_ensemble, with_heatmap, encoder)
+
+    def warmup(self):
+        """Warm up every worker in parallel"""
+        for timings in self._broadcast("warmup"):
+            for name, seconds in timings.items():
+                self.startup_timings[name] = max(self.startup_timings.get(name, 0.0), seconds)
+        self._warmed_up = True
+        return self.startup_timings
+
+    def stats(self) -> dict:
+        """Dispatch counters (never waits on a busy worker)"""
+        return {
+            "workers": self.num_workers,
+            "threads_per_worker": self.threads_per_worker,
+            "per_worker": [
+                {
+                    "pid": w.process.pid,
+                    "alive": w.process.is_alive(),
+                    "cpus": w.cpus,
+                    "busy": w.lock.locked(),
+                    "pending": w.pending,
+                    "restarting": w.restarting,
+                    "restarts": w.restarts,
+                    "completed": w.completed,
+                    "busy_seconds": round(w.busy_seconds, 3),
+                }
+                for w in self._workers
+            ],
+        }
+
+    def close(self):
+        self._closed = True
+        for worker in self._workers:
+            try:
+                with worker.lock:
+                    worker.conn.send(None)
+            except (OSError, BrokenPipeError):
+                pass
+        for worker in self._workers:
+            worker.process.join(timeout=10)
+            if worker.process.is_alive():
+                worker.process.terminate()